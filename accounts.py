@@ -0,0 +1,67 @@
+import asyncio
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from file_logger import logger
+
+
+# Clients of all Kraken accounts that the bot manages, by account name. Every
+# account has its own API key, nonces, rate limiter, cache and connection pool.
+# The first added account is the primary one (trading, initialization)
+class AccountRegistry:
+    def __init__(self, workers=5):
+        self._clients = collections.OrderedDict()
+        # Maximum number of accounts that will be queried at the same time
+        self._workers = workers
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __iter__(self):
+        return iter(self._clients)
+
+    def __contains__(self, name):
+        return name in self._clients
+
+    def add(self, name, client):
+        if name in self._clients:
+            raise ValueError("Account '" + str(name) + "' already exists")
+        self._clients[name] = client
+
+    def get(self, name):
+        return self._clients[name]
+
+    # Return list of (account name, client)
+    def items(self):
+        return list(self._clients.items())
+
+    @property
+    def primary(self):
+        return next(iter(self._clients))
+
+    # Call 'function(name, client)' for all accounts concurrently. Return dictionary
+    # with account name as key and result as value (in the order of the accounts)
+    def fan_out(self, function):
+        items = self.items()
+
+        # No need for threads with only one account
+        if len(items) == 1:
+            return collections.OrderedDict([(items[0][0], function(*items[0]))])
+
+        # Requests belong to the same update as the caller
+        cid = logger.correlation_id()
+
+        def call(item):
+            logger.new_correlation_id(cid)
+            return function(*item)
+
+        with ThreadPoolExecutor(max_workers=min(len(items), self._workers)) as executor:
+            results = list(executor.map(call, items))
+
+        return collections.OrderedDict(zip([name for name, _ in items], results))
+
+    # Same as 'fan_out' for coroutine functions and asyncio clients. Needs to be awaited
+    async def fan_out_async(self, function):
+        items = self.items()
+        results = await asyncio.gather(*[function(name, client) for name, client in items])
+
+        return collections.OrderedDict(zip([name for name, _ in items], results))
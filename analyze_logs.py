@@ -0,0 +1,97 @@
+#!/usr/bin/python3
+
+# Show latency percentiles per Kraken method and per Telegram command from
+# logfiles that were written with "log_format": "json". Usage:
+# python3 analyze_logs.py [logfile ...]
+# Without arguments, all logfiles in folder 'log' will be analyzed
+
+import os
+import sys
+import glob
+import gzip
+import json
+import math
+from collections import defaultdict
+
+# Endpoint of a structured event
+endpoint_keys = {
+    "kraken_request": "method",
+    "telegram_handler": "handler"
+}
+
+
+# Return all records of structured events in a logfile (plain or gzip)
+def read_events(path):
+    opener = gzip.open if path.endswith(".gz") else open
+
+    with opener(path, "rt", encoding="utf-8", errors="replace") as file:
+        for line in file:
+            # Uncaught exceptions and other text might be in the logfile too
+            if not line.startswith("{"):
+                continue
+
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            if record.get("event") in endpoint_keys:
+                yield record
+
+
+# Return value at percentile 'p' (0 - 100) of sorted values (nearest rank)
+def percentile(values, p):
+    index = max(0, math.ceil(p / 100 * len(values)) - 1)
+    return values[index]
+
+
+def analyze(paths):
+    durations = defaultdict(list)
+    errors = defaultdict(int)
+    retries = defaultdict(int)
+
+    for path in paths:
+        for record in read_events(path):
+            key = (record["event"], record.get(endpoint_keys[record["event"]]))
+
+            durations[key].append(record["duration_ms"])
+            retries[key] += record.get("retries", 0)
+            if record.get("error_class"):
+                errors[key] += 1
+
+    return durations, errors, retries
+
+
+def print_report(durations, errors, retries):
+    header = "%-18s %-26s %7s %7s %7s %9s %9s %9s %9s" % \
+             ("EVENT", "ENDPOINT", "COUNT", "ERRORS", "RETRIES", "P50 ms", "P90 ms", "P99 ms", "MAX ms")
+    print(header)
+    print("-" * len(header))
+
+    # Slowest endpoints first
+    rows = list()
+    for key, values in durations.items():
+        values.sort()
+        rows.append((percentile(values, 99), key, values))
+
+    for p99, (event, endpoint), values in sorted(rows, key=lambda row: row[0], reverse=True):
+        print("%-18s %-26s %7d %7d %7d %9.1f %9.1f %9.1f %9.1f" %
+              (event, endpoint, len(values), errors[(event, endpoint)], retries[(event, endpoint)],
+               percentile(values, 50), percentile(values, 90), p99, values[-1]))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        logfiles = sys.argv[1:]
+    else:
+        logfiles = sorted(glob.glob(os.path.join("log", "*.log")) + glob.glob(os.path.join("log", "*.log.gz")))
+
+    if not logfiles:
+        exit("No logfiles found")
+
+    results = analyze(logfiles)
+
+    if not results[0]:
+        exit("No traced requests found. Set 'log_format' to 'json' in 'config.json'")
+
+    print_report(*results)
@@ -0,0 +1,245 @@
+import sys
+import time
+import asyncio
+from file_logger import logger
+from balance_engine import AvailableBalance
+from kraken_api import request_duration, request_errors, request_retries, error_class
+from kraken_api import others_cancelled, immediate_error
+
+# Optional dependency - without it, the bot can't run in asyncio mode
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+# Return name of an aiohttp exception that the retry policy understands
+def _error_name(ex):
+    if isinstance(ex, asyncio.TimeoutError):
+        return "Timeout"
+    if isinstance(ex, aiohttp.ClientConnectorError):
+        return "ConnectionError"
+    if isinstance(ex, aiohttp.ClientResponseError):
+        return "HTTPError"
+    return type(ex).__name__
+
+
+# Asyncio client for the Kraken API. Waiting for a response doesn't block a thread,
+# so many requests can be in-flight at once. Uses key, nonce, rate limiter, retry
+# policy, response cache, tracer and asset index of the threaded client 'kraken',
+# so that both clients can be used at the same time. All requests share one
+# connection pool. 'open' and 'close' need to be called from the event loop
+class AsyncKraken:
+    def __init__(self, kraken, pool_size=10, connect_timeout=5, read_timeout=30, bulk_workers=5):
+        self._kraken = kraken
+        self._pool_size = pool_size
+        self._connect_timeout = connect_timeout
+        self._read_timeout = read_timeout
+        self._bulk_workers = bulk_workers
+
+        self._session = None
+
+        # Public requests that are currently issued as key: Future
+        self._flights = dict()
+
+    @property
+    def index(self):
+        return self._kraken.index
+
+    @property
+    def tracer(self):
+        return self._kraken.tracer
+
+    # Create the connection pool. Return FALSE if asyncio support is not available
+    async def open(self):
+        if aiohttp is None:
+            logger.warning("Module 'aiohttp' not installed - asyncio mode not available")
+            return False
+
+        timeout = aiohttp.ClientTimeout(sock_connect=self._connect_timeout, sock_read=self._read_timeout)
+        connector = aiohttp.TCPConnector(limit=self._pool_size)
+        headers = {key: value for key, value in self._kraken.pool.headers.items() if key != "Connection"}
+
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout, headers=headers)
+        return True
+
+    async def close(self):
+        if self._session:
+            await self._session.close()
+            self._session = None
+
+    # Issue Kraken API request. Same as 'Kraken.query' but needs to be awaited
+    async def query(self, method, data=None, private=False, priority=None):
+        # Get name of caller coroutine (after the first 'await' it's the event loop)
+        caller = sys._getframe(1).f_code.co_name if self.tracer.enabled else None
+
+        start = time.monotonic()
+        res_data, retries = await self._query_cached(method, data, private, priority)
+
+        request_duration.observe(time.monotonic() - start, method)
+        if res_data["error"]:
+            request_errors.inc(method, error_class(res_data["error"][0]))
+
+        if caller:
+            self.tracer.record(method, caller, start, data, res_data, retries)
+
+        return res_data
+
+    # Return response of public calls from cache if possible. Concurrent requests
+    # for the same data share one in-flight request
+    async def _query_cached(self, method, data, private, priority):
+        cache = self._kraken.cache
+
+        if private or not cache.ttls.get(method):
+            return await self._query_retry(method, data, private, priority)
+
+        res_data = cache.lookup(method, data)
+        if res_data:
+            return res_data, 0
+
+        key = cache.key(method, data)
+        flight = self._flights.get(key)
+        if flight:
+            return await asyncio.shield(flight), 0
+
+        flight = self._flights[key] = asyncio.get_event_loop().create_future()
+        try:
+            res_data, retries = await self._query_retry(method, data, private, priority)
+            cache.store(method, data, res_data)
+            flight.set_result(res_data)
+            return res_data, retries
+        finally:
+            # Request was cancelled - waiting requests will be cancelled too
+            if not flight.done():
+                flight.cancel()
+            del self._flights[key]
+
+    # Issue request and retry it on error if the retry policy allows it.
+    # Return response and number of retries
+    async def _query_retry(self, method, data, private, priority):
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            try:
+                if private:
+                    # Wait until the call doesn't exceed the rate limit
+                    await self._acquire(method, priority)
+
+                    res_data = await self._request(method, data, private)
+
+                    # Counter of the rate limiter got out of sync with Kraken
+                    if any("Rate limit exceeded" in error for error in res_data["error"]):
+                        self._kraken.limiter.penalize()
+                else:
+                    res_data = await self._request(method, data, private)
+
+                # Successful request, no need to retry
+                if not res_data["error"]:
+                    return res_data, attempt
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as ex:
+                logger.exception(self.__class__.__name__ + " exception:")
+
+                # Handle some exceptions immediately without retrying
+                res_data = immediate_error(ex)
+                if res_data:
+                    return res_data, attempt
+
+                res_data = {"error": [_error_name(ex) + ":" + str(ex)]}
+
+            # Return error from last Kraken request if it's not safe to retry
+            error = res_data["error"][0]
+            delay = self._kraken.retry_policy.next_delay(error, private, attempt, start)
+            if delay is None:
+                return res_data, attempt
+
+            attempt += 1
+            request_retries.inc(method)
+            logger.warning("Retry %d for '%s' in %.2f seconds: %s" % (attempt, method, delay, error))
+            await asyncio.sleep(delay)
+
+    # Wait without blocking until the rate limiter allows the call
+    async def _acquire(self, method, priority):
+        start = time.monotonic()
+
+        while True:
+            wait = self._kraken.limiter.try_acquire(method, priority, start)
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    # Send one request. Private requests get the nonce and the signature right before
+    # they are sent, so that concurrent requests rarely reach Kraken out of nonce order
+    async def _request(self, method, data, private):
+        kraken = self._kraken
+        data = dict(data) if data else dict()
+        headers = dict()
+
+        if private:
+            if not kraken.key or not kraken.secret:
+                raise Exception("Either key or secret is not set")
+
+            urlpath = "/" + kraken.apiversion + "/private/" + method
+            data["nonce"] = kraken._nonce()
+            headers["API-Key"] = kraken.key
+            headers["API-Sign"] = kraken._sign(data, urlpath)
+        else:
+            urlpath = "/" + kraken.apiversion + "/public/" + method
+
+        async with self._session.post(kraken.uri + urlpath, data=data, headers=headers) as response:
+            if response.status not in (200, 201, 202):
+                response.raise_for_status()
+            return await response.json(content_type=None)
+
+    # Return available volume of all assets, considering all open orders
+    async def available_balance(self):
+        # Send request to Kraken to get current balance of all currencies
+        res_balance = await self.query("Balance", private=True)
+
+        if res_balance["error"]:
+            return False, res_balance["error"][0]
+
+        # Send request to Kraken to get open orders
+        res_orders = await self.query("OpenOrders", private=True)
+
+        if res_orders["error"]:
+            return False, res_orders["error"][0]
+
+        return True, AvailableBalance(res_balance["result"], res_orders["result"]["open"], self.index)
+
+    async def balance(self):
+        success, balance = await self.available_balance()
+
+        if not success:
+            return False, balance
+
+        return True, self._kraken.balance_msg(balance)
+
+    # Issue the same kind of request for every item of 'data_list' concurrently (but
+    # never more requests at once than 'bulk_workers') and return a list of responses
+    async def bulk_query(self, method, data_list, private=False):
+        semaphore = asyncio.Semaphore(self._bulk_workers)
+
+        async def query(data):
+            async with semaphore:
+                return await self.query(method, data, private)
+
+        return list(await asyncio.gather(*[query(data) for data in data_list]))
+
+    # Same as 'Kraken.cancel_orders' but needs to be awaited
+    async def cancel_orders(self, txids, cancel_all=False):
+        if cancel_all:
+            res_data = await self.query("CancelAll", private=True)
+
+            if not res_data["error"]:
+                return {txid: None for txid in txids}, others_cancelled(res_data, txids)
+
+            # Cancel them one by one if that didn't work
+            logger.warning("Cancelling all orders failed: " + res_data["error"][0])
+
+        responses = await self.bulk_query("CancelOrder", [{"txid": txid} for txid in txids], private=True)
+
+        return {txid: res["error"][0] if res["error"] else None for txid, res in zip(txids, responses)}, 0
@@ -0,0 +1,48 @@
+from collections import namedtuple, defaultdict
+
+# Open order with all values that are needed to calculate locked volumes.
+# 'base' and 'quote' are internal asset names (XXBT, ZEUR), 'volume' is the
+# not yet executed volume of the order
+Order = namedtuple("Order", ["txid", "type", "ordertype", "pair", "base", "quote", "volume", "price", "description"])
+
+
+# Parse an order from the result of 'OpenOrders' or 'QueryOrders'
+def parse_order(txid, data, index):
+    descr = data["descr"]
+    base, quote = index.assets_from_pair(descr["pair"])
+
+    return Order(txid=txid,
+                 type=descr["type"],
+                 ordertype=descr["ordertype"],
+                 pair=descr["pair"],
+                 base=base,
+                 quote=quote,
+                 volume=float(data["vol"]) - float(data.get("vol_exec", 0)),
+                 price=float(descr["price"]),
+                 description=descr["order"])
+
+
+# Parse every order of an 'OpenOrders' result once into an 'Order'
+def parse_orders(open_orders, index):
+    return [parse_order(txid, data, index) for txid, data in open_orders.items()]
+
+
+# Total, locked and available volume of all assets, calculated from the
+# results of 'Balance' and 'OpenOrders' in one pass over all orders.
+# Buy orders lock the quote asset (volume * price), sell orders lock the base asset
+class AvailableBalance:
+    def __init__(self, balance, open_orders, index):
+        self.total = {asset: float(volume) for asset, volume in balance.items()}
+        self.locked = defaultdict(float)
+        self.orders = parse_orders(open_orders, index)
+
+        for order in self.orders:
+            if order.type == "buy":
+                if order.quote:
+                    self.locked[order.quote] += order.volume * order.price
+            elif order.base:
+                self.locked[order.base] += order.volume
+
+    # Return volume of an asset that is not locked in open orders
+    def available(self, asset):
+        return self.total.get(asset, 0.0) - self.locked.get(asset, 0.0)
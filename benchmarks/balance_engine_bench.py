@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+# Benchmark for calculating available balances with many open orders and assets.
+# Execute from the root folder of the project:
+# python3 benchmarks/balance_engine_bench.py [number of assets] [number of orders]
+
+import os
+import sys
+import time
+import random
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from kraken_api import AssetIndex
+from balance_engine import AvailableBalance
+
+
+# Create results of 'Assets', 'AssetPairs', 'Balance' and 'OpenOrders'
+# with the given number of assets and open orders
+def synthetic_data(assets_nr, orders_nr):
+    assets = {"ZEUR": {"altname": "EUR"}, "XXBT": {"altname": "XBT"}}
+    asset_pairs = dict()
+    balance = {"ZEUR": "100000.0000", "XXBT": "50.0000000000"}
+
+    for i in range(assets_nr):
+        name = "XC%03d" % i
+        altname = "C%03d" % i
+        assets[name] = {"altname": altname}
+        balance[name] = "%.10f" % random.uniform(0, 1000)
+
+        for quote in ("ZEUR", "XXBT"):
+            pair_alt = altname + assets[quote]["altname"]
+            asset_pairs[name + quote] = {"altname": pair_alt, "base": name, "quote": quote}
+
+    pair_alts = [data["altname"] for data in asset_pairs.values()]
+
+    open_orders = dict()
+    for i in range(orders_nr):
+        order_type = random.choice(("buy", "sell"))
+        open_orders["O%05d-AAAAA-BBBBBB" % i] = {
+            "vol": "%.8f" % random.uniform(0, 10),
+            "vol_exec": "0.00000000",
+            "descr": {
+                "pair": random.choice(pair_alts),
+                "type": order_type,
+                "ordertype": "limit",
+                "price": "%.5f" % random.uniform(0, 10),
+                "order": "synthetic order"
+            }
+        }
+
+    return assets, asset_pairs, balance, open_orders
+
+
+def bench(label, function, repeat=5):
+    timings = list()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    print("%-28s best %8.2f ms   avg %8.2f ms" % (label, min(timings) * 1000, sum(timings) / repeat * 1000))
+
+
+if __name__ == "__main__":
+    assets_nr = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    orders_nr = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    assets, asset_pairs, balance, open_orders = synthetic_data(assets_nr, orders_nr)
+    print("Assets: %d, pairs: %d, open orders: %d" % (len(assets), len(asset_pairs), len(open_orders)))
+
+    bench("Build asset index", lambda: AssetIndex(assets, asset_pairs))
+
+    index = AssetIndex(assets, asset_pairs)
+    bench("Calculate available balance", lambda: AvailableBalance(balance, open_orders, index))
+
+    available = AvailableBalance(balance, open_orders, index)
+    bench("Lookup all assets", lambda: [available.available(asset) for asset in balance])
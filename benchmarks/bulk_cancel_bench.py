@@ -0,0 +1,49 @@
+#!/usr/bin/python3
+
+# Benchmark for closing many orders at once against the local fake Kraken API.
+# Execute from the root folder of the project:
+# python3 benchmarks/bulk_cancel_bench.py [number of orders] [latency in ms]
+
+import sys
+import time
+import logging
+
+from fake_kraken import FakeKraken, connect
+
+
+# Create open orders on the fake Kraken and return their TXIDs
+def create_orders(fake, orders_nr):
+    return [fake.add_open_order("XXBTZEUR", "buy", 0.01, 1000 + i) for i in range(orders_nr)]
+
+
+def bench(label, function, fake, orders_nr):
+    txids = create_orders(fake, orders_nr)
+    fake.calls.clear()
+
+    start = time.perf_counter()
+    results, _ = function(txids)
+    duration = time.perf_counter() - start
+
+    cancelled = len([txid for txid, error in results.items() if not error])
+    print("%-32s %8.2f s   cancelled %d/%d   requests %s" % (label, duration, cancelled, orders_nr, fake.calls))
+
+
+if __name__ == "__main__":
+    orders_nr = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    latency = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.05
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    fake = FakeKraken(latency=latency).start()
+    print("Orders: %d, latency per request: %d ms" % (orders_nr, latency * 1000))
+
+    # One request after another (like before)
+    sequential = connect(fake, bulk_workers=1)
+    bench("Sequential CancelOrder", lambda txids: sequential.cancel_orders(txids), fake, orders_nr)
+
+    concurrent = connect(fake, bulk_workers=10)
+    bench("Concurrent CancelOrder (10)", lambda txids: concurrent.cancel_orders(txids), fake, orders_nr)
+
+    bench("CancelAll", lambda txids: concurrent.cancel_orders(txids, cancel_all=True), fake, orders_nr)
+
+    fake.stop()
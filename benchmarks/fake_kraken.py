@@ -0,0 +1,261 @@
+#!/usr/bin/python3
+
+# Local stand-in for the Kraken REST API. Keeps open orders and balances in
+# memory and answers with a configurable latency and error rate. Only the
+# methods that the bot uses are implemented
+
+import os
+import sys
+import json
+import time
+import base64
+import random
+import tempfile
+import threading
+import http.server
+import socketserver
+from urllib.parse import parse_qs
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kraken_api
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class FakeKraken:
+    # Temporary errors that are returned randomly (see 'error_rate')
+    errors = ["EService:Busy", "EService:Unavailable", "EAPI:Rate limit exceeded"]
+
+    def __init__(self, latency=0.05, port=0, error_rate=0.0):
+        self.latency = latency
+        # Share of requests (0 - 1) that fail with a temporary error
+        self.error_rate = error_rate
+
+        # Number of requests per method
+        self.calls = dict()
+        # Errors that the next requests of a method will fail with (see 'fail')
+        self._failures = dict()
+
+        self.assets = {
+            "ZEUR": {"altname": "EUR"},
+            "XXBT": {"altname": "XBT"},
+            "XETH": {"altname": "ETH"}
+        }
+        self.asset_pairs = {
+            "XXBTZEUR": {"altname": "XBTEUR", "base": "XXBT", "quote": "ZEUR"},
+            "XETHZEUR": {"altname": "ETHEUR", "base": "XETH", "quote": "ZEUR"},
+            "XETHXXBT": {"altname": "ETHXBT", "base": "XETH", "quote": "XXBT"}
+        }
+        self.prices = {"XXBTZEUR": 5000.0, "XETHZEUR": 400.0, "XETHXXBT": 0.08}
+        self.balance = {"ZEUR": 10000.0, "XXBT": 2.0, "XETH": 20.0}
+
+        self.open_orders = dict()
+        self.closed_orders = dict()
+
+        self._lock = threading.Lock()
+        self._txid_nr = 0
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self._server.server_port
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Create an open limit order and return its TXID
+    def add_open_order(self, pair, order_type, volume, price):
+        with self._lock:
+            self._txid_nr += 1
+            txid = "O%05d-FAKE0-%06d" % (self._txid_nr, self._txid_nr)
+
+        pair_alt = self.asset_pairs[pair]["altname"]
+        self.open_orders[txid] = {
+            "status": "open",
+            "vol": "%.8f" % volume,
+            "vol_exec": "0.00000000",
+            "descr": {
+                "pair": pair_alt,
+                "type": order_type,
+                "ordertype": "limit" if price else "market",
+                "price": "%.5f" % price,
+                "order": "%s %.8f %s @ limit %.5f" % (order_type, volume, pair_alt, price)
+            }
+        }
+
+        return txid
+
+    def _handler(self):
+        fake = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                data = {k: v[0] for k, v in parse_qs(self.rfile.read(length).decode()).items()}
+                method = self.path.rsplit("/", 1)[-1]
+
+                res_data = fake.handle(method, data)
+
+                # Failed on HTTP level
+                if isinstance(res_data, int):
+                    self.send_response(res_data)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                body = json.dumps(res_data).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    # Let the next requests of a method fail, one request per error. An error is
+    # either a Kraken error ('EService:Busy') or an HTTP status code (502)
+    def fail(self, method, *errors):
+        with self._lock:
+            self._failures.setdefault(method, list()).extend(errors)
+
+    # Answer a request for a Kraken API method. Return the response or an HTTP status code
+    def handle(self, method, data):
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            failures = self._failures.get(method)
+            failure = failures.pop(0) if failures else None
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if isinstance(failure, int):
+            return failure
+        if failure:
+            return {"error": [failure]}
+
+        if self.error_rate and random.random() < self.error_rate:
+            return {"error": [random.choice(self.errors)]}
+
+        handler = getattr(self, "_" + method, None)
+        if not handler:
+            return {"error": ["EGeneral:Unknown method"]}
+
+        with self._lock:
+            return {"error": [], "result": handler(data)}
+
+    def _Time(self, data):
+        return {"unixtime": int(time.time())}
+
+    def _Assets(self, data):
+        return self.assets
+
+    def _AssetPairs(self, data):
+        return self.asset_pairs
+
+    def _Ticker(self, data):
+        result = dict()
+        for pair in data["pair"].split(","):
+            price = self.prices[pair] * random.uniform(0.99, 1.01)
+            result[pair] = {"c": ["%.5f" % price, "1.0"]}
+        return result
+
+    def _Balance(self, data):
+        return {asset: "%.10f" % volume for asset, volume in self.balance.items()}
+
+    def _OpenOrders(self, data):
+        return {"open": dict(self.open_orders)}
+
+    def _GetWebSocketsToken(self, data):
+        return {"token": "fake_websockets_token", "expires": 900}
+
+    def _QueryOrders(self, data):
+        result = dict()
+        for txid in data["txid"].split(","):
+            order = self.open_orders.get(txid) or self.closed_orders.get(txid)
+            if order:
+                result[txid] = order
+        return result
+
+    def _CancelOrder(self, data):
+        order = self.open_orders.pop(data["txid"], None)
+        if order:
+            order["status"] = "canceled"
+            self.closed_orders[data["txid"]] = order
+        return {"count": 1 if order else 0}
+
+    def _CancelAll(self, data):
+        count = len(self.open_orders)
+        for txid, order in self.open_orders.items():
+            order["status"] = "canceled"
+            self.closed_orders[txid] = order
+        self.open_orders.clear()
+        return {"count": count}
+
+    def _AddOrder(self, data):
+        self._txid_nr += 1
+        txid = "O%05d-FAKE0-%06d" % (self._txid_nr, self._txid_nr)
+
+        pair_alt = self.asset_pairs[data["pair"]]["altname"]
+        desc = "%s %s %s @ %s" % (data["type"], data["volume"], pair_alt, data["ordertype"])
+
+        # Market orders are executed immediately
+        status = "closed" if data["ordertype"] == "market" else "open"
+        order = {
+            "status": status,
+            "vol": data["volume"],
+            "vol_exec": data["volume"] if status == "closed" else "0.00000000",
+            "descr": {
+                "pair": pair_alt,
+                "type": data["type"],
+                "ordertype": data["ordertype"],
+                "price": data.get("price", "0"),
+                "order": desc
+            }
+        }
+
+        if status == "closed":
+            self.closed_orders[txid] = order
+        else:
+            self.open_orders[txid] = order
+
+        return {"descr": {"order": desc}, "txid": [txid]}
+
+
+# Return a 'Kraken' client that sends its requests to the fake Kraken API
+def connect(fake, **kwargs):
+    with tempfile.NamedTemporaryFile("w", suffix=".key", delete=False) as keyfile:
+        keyfile.write("fake_api_key\n" + base64.b64encode(b"fake_private_key").decode() + "\n")
+
+    kwargs.setdefault("tier", "pro")
+    kraken = kraken_api.Kraken(keyfile.name, **kwargs)
+    kraken.uri = fake.url
+
+    # Temporary key, no need to keep its nonce
+    kraken.nonce.forget()
+    os.remove(keyfile.name)
+    return kraken
+
+
+if __name__ == "__main__":
+    server = FakeKraken().start()
+    print("Fake Kraken API listening on " + server.url)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
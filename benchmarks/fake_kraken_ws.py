@@ -0,0 +1,257 @@
+#!/usr/bin/python3
+
+# Local stand-in for the private Kraken WebSocket API ('openOrders' and 'ownTrades'),
+# backed by the orders of a 'FakeKraken'. After subscribing, a client gets a
+# snapshot of all open orders. Status changes, trades and connection losses are
+# triggered by the caller, so that updates, reconnects and resyncs can be tested
+
+import json
+import time
+import base64
+import socket
+import struct
+import hashlib
+import threading
+import socketserver
+
+# Defined by RFC 6455 to calculate 'Sec-WebSocket-Accept'
+_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+_OP_TEXT, _OP_CLOSE, _OP_PING, _OP_PONG = 0x1, 0x8, 0x9, 0xA
+
+
+class ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+# Connection to one client. Only unfragmented frames are supported
+class _Client:
+    def __init__(self, sock):
+        self._sock = sock
+        self._file = sock.makefile("rb")
+        self._lock = threading.Lock()
+
+        # Names of subscribed channels
+        self.channels = set()
+
+    def handshake(self):
+        headers = dict()
+        self._file.readline()
+
+        while True:
+            line = self._file.readline().decode().strip()
+            if not line:
+                break
+            key, _, value = line.partition(":")
+            headers[key.strip().lower()] = value.strip()
+
+        accept = base64.b64encode(hashlib.sha1((headers["sec-websocket-key"] + _GUID).encode()).digest())
+        self._sock.sendall(b"HTTP/1.1 101 Switching Protocols\r\n"
+                           b"Upgrade: websocket\r\n"
+                           b"Connection: Upgrade\r\n"
+                           b"Sec-WebSocket-Accept: " + accept + b"\r\n\r\n")
+
+    # Return (opcode, payload) of the next frame from the client (always masked)
+    def recv(self):
+        first, second = self._file.read(2)
+        length = second & 0x7F
+
+        if length == 126:
+            length = struct.unpack(">H", self._file.read(2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", self._file.read(8))[0]
+
+        mask = self._file.read(4)
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(self._file.read(length)))
+
+        return first & 0x0F, payload
+
+    def send(self, payload, opcode=_OP_TEXT):
+        if isinstance(payload, str):
+            payload = payload.encode()
+
+        length = len(payload)
+        if length < 126:
+            header = struct.pack(">BB", 0x80 | opcode, length)
+        elif length < 65536:
+            header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+
+        with self._lock:
+            self._sock.sendall(header + payload)
+
+    def send_json(self, msg):
+        self.send(json.dumps(msg))
+
+    # Drop the connection without a close frame (like a network failure)
+    def drop(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class FakeKrakenWS:
+    def __init__(self, fake, port=0):
+        self._fake = fake
+
+        # All received subscribe messages
+        self.subscriptions = list()
+        # Number of connections since start
+        self.connections = 0
+
+        self._clients = list()
+        self._lock = threading.Lock()
+        self._sequence = 0
+
+        self._server = ThreadingTCPServer(("127.0.0.1", port), self._handler())
+
+    @property
+    def url(self):
+        return "ws://127.0.0.1:%d" % self._server.server_address[1]
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.disconnect()
+        self._server.shutdown()
+        self._server.server_close()
+
+    # Wait until 'count' clients are subscribed to 'channel'. Return FALSE on timeout
+    def wait_subscribed(self, channel="openOrders", count=1, timeout=5):
+        deadline = time.monotonic() + timeout
+
+        while time.monotonic() < deadline:
+            with self._lock:
+                if sum(channel in client.channels for client in self._clients) >= count:
+                    return True
+            time.sleep(0.01)
+
+        return False
+
+    # Change status of an order in the fake REST API and send the change to all clients
+    def set_status(self, txid, status):
+        fake = self._fake
+
+        with fake._lock:
+            order = fake.open_orders.pop(txid)
+            order["status"] = status
+            if status == "closed":
+                order["vol_exec"] = order["vol"]
+            fake.closed_orders[txid] = order
+
+        self._publish("openOrders", [{txid: {"status": status, "vol_exec": order["vol_exec"]}}])
+
+    # Send a trade of an order to all clients
+    def trade(self, txid, volume):
+        with self._fake._lock:
+            order = self._fake.open_orders.get(txid) or self._fake.closed_orders[txid]
+
+        trade = {
+            "ordertxid": txid,
+            "pair": order["descr"]["pair"],
+            "time": "%.6f" % time.time(),
+            "type": order["descr"]["type"],
+            "ordertype": order["descr"]["ordertype"],
+            "price": order["descr"]["price"],
+            "vol": "%.8f" % volume
+        }
+
+        self._publish("ownTrades", [{"T%s" % txid: trade}])
+
+    # Drop all connections (the clients should reconnect)
+    def disconnect(self):
+        with self._lock:
+            clients, self._clients = self._clients, list()
+
+        for client in clients:
+            client.drop()
+
+    def _publish(self, channel, data):
+        with self._lock:
+            self._sequence += 1
+            msg = [data, channel, {"sequence": self._sequence}]
+            clients = [client for client in self._clients if channel in client.channels]
+
+        for client in clients:
+            client.send_json(msg)
+
+    def _subscribe(self, client, msg):
+        subscription = msg.get("subscription", dict())
+        channel = subscription.get("name")
+
+        with self._lock:
+            self.subscriptions.append(msg)
+
+        if not subscription.get("token"):
+            client.send_json({"event": "subscriptionStatus", "status": "error", "errorMessage": "EGeneral:Invalid arguments"})
+            return
+
+        client.send_json({"event": "subscriptionStatus", "status": "subscribed", "channelName": channel})
+
+        # Snapshot of all open orders
+        if channel == "openOrders":
+            with self._fake._lock:
+                orders = [{txid: dict(order)} for txid, order in self._fake.open_orders.items()]
+            with self._lock:
+                self._sequence += 1
+                msg = [orders, channel, {"sequence": self._sequence}]
+            client.send_json(msg)
+
+        with self._lock:
+            client.channels.add(channel)
+
+    def _handler(self):
+        fake_ws = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                client = _Client(self.request)
+                client.handshake()
+
+                with fake_ws._lock:
+                    fake_ws._clients.append(client)
+                    fake_ws.connections += 1
+
+                try:
+                    while True:
+                        opcode, payload = client.recv()
+
+                        if opcode == _OP_CLOSE:
+                            client.send(payload, _OP_CLOSE)
+                            break
+                        elif opcode == _OP_PING:
+                            client.send(payload, _OP_PONG)
+                        elif opcode == _OP_TEXT:
+                            msg = json.loads(payload.decode())
+                            if msg.get("event") == "subscribe":
+                                fake_ws._subscribe(client, msg)
+                            elif msg.get("event") == "ping":
+                                client.send_json({"event": "pong", "reqid": msg.get("reqid")})
+                except (OSError, ValueError):
+                    pass
+                finally:
+                    with fake_ws._lock:
+                        if client in fake_ws._clients:
+                            fake_ws._clients.remove(client)
+
+        return Handler
+
+
+if __name__ == "__main__":
+    from fake_kraken import FakeKraken
+
+    fake = FakeKraken().start()
+    server = FakeKrakenWS(fake).start()
+    print("Fake Kraken API listening on " + fake.url + " and " + server.url)
+
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+        fake.stop()
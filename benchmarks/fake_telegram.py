@@ -0,0 +1,76 @@
+#!/usr/bin/python3
+
+# Stand-in for the Telegram bot object. Sent messages are only counted and kept
+# in memory, optionally with a latency per request. Creates updates as if they
+# were sent by a user, so that they can be processed by the dispatcher
+
+import time
+import threading
+
+from telegram import Update
+
+
+class FakeMessage:
+    def __init__(self, message_id, chat_id, text):
+        self.message_id = message_id
+        self.chat_id = chat_id
+        self.text = text
+
+
+class FakeTelegram:
+    id = 1
+    username = "fake_bot"
+    first_name = "Fake"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+        # Number of requests per method
+        self.calls = dict()
+        # All sent and edited texts as (chat ID, text)
+        self.messages = list()
+
+        self._lock = threading.Lock()
+        self._message_id = 0
+        self._update_id = 0
+
+    def _request(self, method, chat_id, text):
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+            self.messages.append((chat_id, text))
+            self._message_id += 1
+            return FakeMessage(self._message_id, chat_id, text)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._request("sendMessage", chat_id, text)
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        return self._request("editMessageText", chat_id, text)
+
+    def send_document(self, chat_id, document, filename=None, **kwargs):
+        return self._request("sendDocument", chat_id, filename)
+
+    def send_photo(self, chat_id, photo, **kwargs):
+        return self._request("sendPhoto", chat_id, None)
+
+    # Return update with a text message that the user with the given ID sent
+    def update(self, user_id, text):
+        with self._lock:
+            self._update_id += 1
+            update_id = self._update_id
+
+        data = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": int(user_id), "type": "private"},
+                "from": {"id": int(user_id), "first_name": "User", "is_bot": False},
+                "text": text
+            }
+        }
+
+        return Update.de_json(data, self)
@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+
+# Benchmark for the conversation handlers of the bot. Replays scripted conversations
+# through the dispatcher (handler matching, conversation states, callbacks) against
+# the local fake Kraken API and a fake Telegram bot. Reports latency, API calls and
+# memory per conversation. Execute from the root folder of the project:
+# python3 benchmarks/handler_bench.py [options]   (see --help)
+#
+# To catch performance regressions, save results with '--save baseline.json' and
+# compare later runs with '--compare baseline.json' (exit code 1 on regression)
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import tracemalloc
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import kraken_api
+from fake_kraken import FakeKraken
+from fake_telegram import FakeTelegram
+
+# Scripted conversations as the user would type them
+flows = {
+    "balance": ["/balance"],
+    "orders": ["/orders", "CANCEL"],
+    "orders_close_all": ["/orders", "CLOSE ALL"],
+    "trade_limit_buy": ["/trade", "BUY", "XBT", "4000", "VOLUME", "0.5", "YES"],
+    "trade_market_sell_all": ["/trade", "SELL", "ETH", "MARKET PRICE", "ALL", "YES"]
+}
+
+# Settings that differ from 'config.json' for the benchmark
+config_overrides = {
+    "user_id": "1",
+    "bot_token": "123456789:FAKE-TOKEN-FOR-BENCHMARKS-ONLY",
+    "used_pairs": {"XBT": "EUR", "ETH": "EUR"},
+    "check_trade": False,
+    "ws_enabled": False,
+    "send_error": False,
+    "log_to_file": False,
+    "metrics_enabled": False,
+    "trace_requests": False,
+    "log_format": "text"
+}
+
+
+# Import the bot in a temporary folder with its own configuration and key file,
+# connected to the fake Kraken and the fake Telegram bot. Return bot and folder
+def load_bot(fake, telegram, tier):
+    with open(os.path.join(ROOT_DIR, "config.json")) as config_file:
+        config = json.load(config_file)
+    config.update(config_overrides)
+    config["api_tier"] = tier
+
+    work_dir = tempfile.mkdtemp(prefix="handler_bench_")
+    with open(os.path.join(work_dir, "config.json"), "w") as config_file:
+        json.dump(config, config_file)
+    with open(os.path.join(work_dir, "kraken.key"), "w") as key_file:
+        key_file.write("fake_api_key\nZmFrZV9wcml2YXRlX2tleQ==\n")
+
+    os.chdir(work_dir)
+    import telegram_kraken_bot as bot
+
+    bot.kraken.uri = fake.url
+    bot.updater.bot = telegram
+    bot.dispatcher.bot = telegram
+
+    # Same as a successful initialization, without reading order limits from the website
+    bot.kraken.load_assets(fake.assets, fake.asset_pairs)
+    bot.assets = dict(fake.assets)
+    bot.is_conf_sane(bot.kraken.index)
+
+    bot.add_handlers()
+
+    return bot, work_dir
+
+
+# Remove the temporary folder of the bot
+def unload_bot(bot, work_dir):
+    # Nonces of the fake key are not needed
+    for _, client in bot.accounts.items():
+        client.nonce.forget()
+
+    os.chdir(ROOT_DIR)
+    shutil.rmtree(work_dir, ignore_errors=True)
+
+
+# Forget state of all conversations (in case a conversation didn't finish)
+def reset_conversations(bot):
+    for group in bot.dispatcher.handlers.values():
+        for handler in group:
+            if hasattr(handler, "conversations"):
+                handler.conversations.clear()
+
+
+# Return sum of all values of a counter metric
+def counter_total(counter):
+    return sum(counter.values().values())
+
+
+# Replay a conversation 'runs' times and return its results
+def run_flow(bot, fake, telegram, messages, runs, open_orders):
+    user_id = bot.config["user_id"]
+
+    durations = list()
+    kraken_calls = dict()
+    telegram_calls = 0
+    errors = counter_total(bot.handler_errors)
+
+    for _ in range(runs):
+        # Every run starts with the same open orders
+        with fake._lock:
+            fake.open_orders = copy.deepcopy(open_orders)
+        reset_conversations(bot)
+        bot.kraken.cache.invalidate()
+
+        calls_before = dict(fake.calls)
+        messages_before = len(telegram.messages)
+
+        start = time.perf_counter()
+        for text in messages:
+            bot.dispatcher.process_update(telegram.update(user_id, text))
+        durations.append(time.perf_counter() - start)
+
+        for method, count in fake.calls.items():
+            kraken_calls[method] = kraken_calls.get(method, 0) + count - calls_before.get(method, 0)
+        telegram_calls += len(telegram.messages) - messages_before
+
+    # One more run to measure memory (not timed because tracing slows it down)
+    with fake._lock:
+        fake.open_orders = copy.deepcopy(open_orders)
+    reset_conversations(bot)
+
+    tracemalloc.start()
+    for text in messages:
+        bot.dispatcher.process_update(telegram.update(user_id, text))
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    durations.sort()
+
+    return {
+        "runs": runs,
+        "avg_ms": sum(durations) / runs * 1000,
+        "p50_ms": durations[int(0.5 * (runs - 1))] * 1000,
+        "p90_ms": durations[int(0.9 * (runs - 1))] * 1000,
+        "max_ms": durations[-1] * 1000,
+        "kraken_calls": {method: count / runs for method, count in kraken_calls.items() if count},
+        "telegram_calls": telegram_calls / runs,
+        "errors": counter_total(bot.handler_errors) - errors,
+        "peak_memory_kb": peak_memory / 1024
+    }
+
+
+def print_results(results):
+    print("%-24s %8s %8s %8s %8s %10s %8s %10s   %s" %
+          ("FLOW", "AVG ms", "P50 ms", "P90 ms", "MAX ms", "TELEGRAM", "ERRORS", "MEMORY kB", "KRAKEN CALLS"))
+
+    for name, result in results.items():
+        calls = ", ".join("%s %g" % (method, count) for method, count in sorted(result["kraken_calls"].items()))
+        print("%-24s %8.1f %8.1f %8.1f %8.1f %10g %8d %10.1f   %s" %
+              (name, result["avg_ms"], result["p50_ms"], result["p90_ms"], result["max_ms"],
+               result["telegram_calls"], result["errors"], result["peak_memory_kb"], calls))
+
+
+# Compare median latency and number of Kraken calls with saved results.
+# Return list of regressions
+def compare(results, baseline, threshold):
+    regressions = list()
+
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+
+        old = baseline[name]
+        if result["p50_ms"] > old["p50_ms"] * (1 + threshold):
+            regressions.append("%s: median %.1f ms (was %.1f ms)" % (name, result["p50_ms"], old["p50_ms"]))
+
+        calls, old_calls = sum(result["kraken_calls"].values()), sum(old["kraken_calls"].values())
+        if calls > old_calls:
+            regressions.append("%s: %g Kraken calls (was %g)" % (name, calls, old_calls))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark conversation handlers")
+    parser.add_argument("--runs", type=int, default=20, help="runs per conversation")
+    parser.add_argument("--latency", type=float, default=50, help="latency of fake Kraken in ms")
+    parser.add_argument("--telegram-latency", type=float, default=0, help="latency of fake Telegram in ms")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of failing Kraken requests (0 - 1)")
+    parser.add_argument("--orders", type=int, default=20, help="open orders at the start of every run")
+    parser.add_argument("--tier", default="unlimited", help="Kraken account tier for the rate limiter")
+    parser.add_argument("--flows", nargs="+", choices=list(flows), default=list(flows))
+    parser.add_argument("--save", help="save results to this file")
+    parser.add_argument("--compare", help="compare results with this file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown for --compare (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Paths are relative to the current folder (the bot is loaded in another one)
+    save_file = os.path.abspath(args.save) if args.save else None
+    compare_file = os.path.abspath(args.compare) if args.compare else None
+
+    # Measure the handlers and not the wait times of the rate limiter. Counter
+    # decreases immediately, also after Kraken reported that the limit was exceeded
+    kraken_api.RateLimiter.tiers["unlimited"] = (1e9, 1e9)
+
+    fake = FakeKraken(latency=args.latency / 1000, error_rate=args.error_rate).start()
+    telegram = FakeTelegram(latency=args.telegram_latency / 1000)
+
+    bot, work_dir = load_bot(fake, telegram, args.tier)
+    logging.getLogger().setLevel(logging.WARNING)
+
+    for i in range(args.orders):
+        fake.add_open_order("XXBTZEUR", "buy", 0.01, 1000 + i)
+    open_orders = copy.deepcopy(fake.open_orders)
+
+    print("Runs: %d, Kraken latency: %g ms, Telegram latency: %g ms, error rate: %g, open orders: %d" %
+          (args.runs, args.latency, args.telegram_latency, args.error_rate, args.orders))
+
+    results = dict()
+    for name in args.flows:
+        results[name] = run_flow(bot, fake, telegram, flows[name], args.runs, open_orders)
+
+    print_results(results)
+
+    fake.stop()
+    unload_bot(bot, work_dir)
+
+    if save_file:
+        with open(save_file, "w") as file:
+            json.dump(results, file, indent=4)
+
+    if compare_file:
+        with open(compare_file) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+
+        if regressions:
+            print("\nRegressions:\n" + "\n".join(regressions))
+            sys.exit(1)
+
+        print("\nNo regressions")
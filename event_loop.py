@@ -0,0 +1,74 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from file_logger import logger
+
+# Python 3.7+ has 'asyncio.all_tasks', before it was a method of 'Task'
+_all_tasks = getattr(asyncio, "all_tasks", None) or asyncio.Task.all_tasks
+
+
+# Runs an asyncio event loop in a background thread. Other threads (handlers of
+# the dispatcher, jobs) hand coroutines over to it with 'submit'. Blocking calls
+# that coroutines can't avoid (requests to Telegram) run in a small thread pool
+class EventLoopThread:
+    def __init__(self, blocking_workers=4, name="EventLoop"):
+        self._name = name
+        self._blocking_workers = blocking_workers
+
+        self.loop = None
+        self._thread = None
+        self._executor = None
+        self._started = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+
+        self.loop = asyncio.new_event_loop()
+        self._executor = ThreadPoolExecutor(max_workers=self._blocking_workers)
+        self.loop.set_default_executor(self._executor)
+
+        self._started.clear()
+        self._thread = threading.Thread(target=self._run, name=self._name, daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+        logger.info("Event loop started")
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.call_soon(self._started.set)
+        self.loop.run_forever()
+
+    # Schedule coroutine on the event loop. Return a 'concurrent.futures.Future'
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    # Run coroutine on the event loop and wait for its result
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+    # Call blocking function in the thread pool. Needs to be awaited on the event loop
+    def run_blocking(self, function, *args, **kwargs):
+        return self.loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+
+    # Cancel remaining tasks and stop the loop
+    def stop(self, timeout=5):
+        if not self.running:
+            return
+
+        self.loop.call_soon_threadsafe(self._cancel_tasks)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._executor.shutdown(wait=False)
+
+        logger.info("Event loop stopped")
+
+    def _cancel_tasks(self):
+        for task in _all_tasks(self.loop):
+            task.cancel()
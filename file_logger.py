@@ -1,32 +1,177 @@
 import logging
 import os
+import re
 import sys
+import gzip
+import json
+import time
+import uuid
+import queue
+import atexit
+import shutil
 import datetime
+import threading
+
+# Python 3.7+. Correlation IDs are then kept per asyncio task and not only per thread
+try:
+    import contextvars
+except ImportError:
+    contextvars = None
+
+
+# Format records as JSON objects, one per line. Records of structured events
+# (Kraken requests, Telegram handlers) contain their fields as separate keys
+class _JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name
+        }
+
+        cid = getattr(record, "cid", None)
+        if cid:
+            entry["cid"] = cid
+
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry["event"] = record.event
+            entry.update(fields)
+        else:
+            entry["msg"] = record.getMessage()
+
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+
+        return json.dumps(entry, default=str)
+
+
+# Add correlation ID of the current thread to every record. Needs to happen
+# in the logging thread because records might be written by another thread
+class _ContextFilter(logging.Filter):
+    def __init__(self, file_logger):
+        super().__init__()
+        self._file_logger = file_logger
+
+    def filter(self, record):
+        record.cid = self._file_logger.correlation_id()
+        return True
+
+
+# Handler that writes records directly to the current logfile
+class _FileHandler(logging.Handler):
+    def __init__(self, file_logger, level, formatter):
+        super().__init__(level)
+        self._file_logger = file_logger
+        self.setFormatter(formatter)
+
+    # Called with the lock of the handler, so only one thread writes at a time
+    def emit(self, record):
+        try:
+            self._file_logger._write([self.format(record) + "\n"], record.created)
+        except Exception:
+            self.handleError(record)
+
+
+# Handler that only puts records into the queue of the background writer.
+# Message and exception are formatted right away because the arguments
+# might change before the writer gets to the record
+class _QueueHandler(logging.Handler):
+    def __init__(self, file_logger, level):
+        super().__init__(level)
+        self._file_logger = file_logger
+
+    def emit(self, record):
+        try:
+            record.msg = record.getMessage()
+            record.args = None
+
+            if record.exc_info:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+                record.exc_info = None
+
+            self._file_logger._enqueue(record)
+        except Exception:
+            self.handleError(record)
 
 
 class FileLogger:
+    # What happens if the queue of the background writer is full:
+    # 'block' waits until there is space, 'drop_new' drops the new record
+    # and 'drop_old' drops the oldest record in the queue
+    overflow_policies = ("block", "drop_new", "drop_old")
+
+    # Formats of logfiles: free text or one JSON object per line
+    log_formats = ("text", "json")
+
     def __init__(self):
         # Formatter string for logging
         self._formatter_str = "%(asctime)s - %(levelname)s - %(name)s - %(message)s"
+        self._formatter = logging.Formatter(self._formatter_str)
         self._date_format = "%y%m%d"
 
         # Folder name for logfiles
         self._log_dir = "log"
 
-        # Current date for logging
+        # Current date for logging and time of next day change (new logfile)
         self._date = datetime.datetime.now().strftime(self._date_format)
+        self._rollover_time = self._next_day()
 
         self._log_level = logging.DEBUG
         self._log_to_file = False
+        self._json = False
+
+        # Rotation and retention of logfiles. Rotated files will be compressed
+        # in the background. Value '0' means no limit
+        self._max_size = 0
+        self._compress = False
+        self._keep_files = 0
+        self._keep_days = 0
+        self._cleanup_lock = threading.Lock()
+
+        # Current logfile, its size and the file that uncaught exceptions are written to
+        self._file = None
+        self._size = 0
+        self._stderr = None
+
+        # Background writer (only if asynchronous logging is enabled)
+        self._async = False
+        self._queue = None
+        self._overflow = "block"
+        self._writer = None
+        self._batch_size = 100
+        self._dropped = 0
+        self._dropped_lock = threading.Lock()
+
+        self._file_handler = None
+
+        # Correlation ID per thread (and per asyncio task if supported)
+        self._context = threading.local()
+        self._cid = contextvars.ContextVar("cid", default=None) if contextvars else None
 
         # Do not use the logger directly. Use function 'log(msg, severity)'
         logging.basicConfig(level=self._log_level, format=self._formatter_str)
         self._logger = logging.getLogger()
 
-    def init(self, log_level, log_to_file):
+    def init(self, log_level, log_to_file, log_async=False, queue_size=10000, overflow="block",
+             max_size=0, compress=False, keep_files=0, keep_days=0, log_format="text"):
         self._log_level = log_level
         self._log_to_file = log_to_file
 
+        if log_format not in self.log_formats:
+            raise ValueError("Unknown log format '" + str(log_format) + "'")
+        if log_format == "json":
+            self._formatter = _JsonFormatter()
+            self._json = True
+
+        self._max_size = max_size
+        self._compress = compress
+        self._keep_files = keep_files
+        self._keep_days = keep_days
+
         # Do not use the logger directly. Use function 'log(msg, severity)'
         logging.basicConfig(level=self._log_level, format=self._formatter_str)
         self._logger = logging.getLogger()
@@ -37,41 +182,273 @@ class FileLogger:
             if not os.path.exists(self._log_dir):
                 os.makedirs(self._log_dir)
 
-            self._update_file_handler()
+            self._open_logfile()
+
+            if log_async:
+                if overflow not in self.overflow_policies:
+                    raise ValueError("Unknown log queue overflow policy '" + str(overflow) + "'")
+
+                self._async = True
+                self._overflow = overflow
+                self._queue = queue.Queue(maxsize=queue_size)
+
+                handler = _QueueHandler(self, self._log_level)
+                handler.addFilter(_ContextFilter(self))
+                self._logger.addHandler(handler)
 
-    def _update_file_handler(self):
-        # Create a file handler for logging
-        logfile_path = os.path.join(self._log_dir, self._date + ".log")
-        handler = logging.FileHandler(logfile_path, encoding="utf-8")
-        handler.setLevel(self._log_level)
+                self._writer = threading.Thread(target=self._write_loop, name="FileLogger", daemon=True)
+                self._writer.start()
+            else:
+                self._file_handler = _FileHandler(self, self._log_level, self._formatter)
+                self._file_handler.addFilter(_ContextFilter(self))
+                self._logger.addHandler(self._file_handler)
 
-        # Format file handler
-        formatter = logging.Formatter(self._formatter_str)
-        handler.setFormatter(formatter)
+            # Write remaining records before exiting
+            atexit.register(self.close)
 
-        # Add file handler to logger
-        self._logger.addHandler(handler)
+            # Logfiles of former runs might not be compressed or deleted yet
+            self._cleanup()
+
+    # Timestamp of the next midnight (local time)
+    def _next_day(self):
+        tomorrow = datetime.date.today() + datetime.timedelta(days=1)
+        return time.mktime(tomorrow.timetuple())
+
+    def _logfile_path(self):
+        return os.path.join(self._log_dir, self._date + ".log")
+
+    # Open logfile of current date. Uncaught exceptions will be appended to it too
+    def _open_logfile(self):
+        logfile_path = self._logfile_path()
+
+        self._file = open(logfile_path, "a", encoding="utf-8")
+        self._size = self._file.tell()
 
         # Redirect all uncaught exceptions to logfile
-        sys.stderr = open(logfile_path, "w")
+        old_stderr = self._stderr
+        self._stderr = open(logfile_path, "a", encoding="utf-8", buffering=1)
+        sys.stderr = self._stderr
 
-    # Log an event and save it in a file with current date as name
-    def log(self, severity, msg, *args, **kwargs):
-        # Add file handler to logger if enabled
-        if self._log_to_file:
-            now = datetime.datetime.now().strftime(self._date_format)
+        if old_stderr:
+            old_stderr.close()
+
+    # Write formatted records to the logfile. Start a new logfile if the day
+    # changed or if the maximum size is reached
+    def _write(self, lines, created):
+        if created >= self._rollover_time:
+            self._rollover()
+
+        if lines:
+            data = "".join(lines)
+            self._file.write(data)
+            # Maximum size is in bytes, not characters
+            self._size += len(data.encode(self._file.encoding or "utf-8"))
+        self._file.flush()
 
-            # If current date not the same as initial one, create new FileHandler
-            if str(now) != str(self._date):
-                self._date = now
-                # Remove old handlers
-                self._logger.handlers = []
-                sys.stderr.close()
+        if self._max_size and self._size >= self._max_size:
+            self._rotate()
 
-                self._update_file_handler()
+    # Day changed: close current logfile and continue with a new one
+    def _rollover(self):
+        self._file.close()
 
+        self._date = datetime.datetime.now().strftime(self._date_format)
+        self._rollover_time = self._next_day()
+
+        self._open_logfile()
+        self._cleanup()
+
+    # Maximum size reached: rename current logfile to 'yymmdd.<number>.log'
+    # and continue with a new one
+    def _rotate(self):
+        self._file.close()
+
+        # Next number after the highest one of today, so that numbers stay in order
+        # even if older files were deleted
+        numbers = [int(match.group(1)) for match in
+                   (re.match(re.escape(self._date) + r"\.(\d+)\.log", name) for name in os.listdir(self._log_dir))
+                   if match]
+        number = max(numbers, default=0) + 1
+
+        rotated_path = os.path.join(self._log_dir, "%s.%d.log" % (self._date, number))
+        os.replace(self._logfile_path(), rotated_path)
+
+        self._open_logfile()
+        self._cleanup()
+
+    # Compress and delete old logfiles in a background thread
+    def _cleanup(self):
+        threading.Thread(target=self._cleanup_files, name="FileLoggerCleanup", daemon=True).start()
+
+    def _cleanup_files(self):
+        with self._cleanup_lock:
+            current = os.path.abspath(self._logfile_path())
+
+            files = list()
+            for name in os.listdir(self._log_dir):
+                path = os.path.join(self._log_dir, name)
+                if os.path.abspath(path) == current or not re.match(r"^\d{6}(\.\d+)?\.log(\.gz)?$", name):
+                    continue
+
+                try:
+                    if self._compress and not name.endswith(".gz"):
+                        path = self._compress_file(path)
+                    files.append((os.path.getmtime(path), path))
+                except OSError as ex:
+                    self._logger.warning("Not possible to compress logfile " + path + ": " + str(ex))
+
+            # Newest files first
+            files.sort(reverse=True)
+
+            min_mtime = time.time() - self._keep_days * 86400
+            for nr, (mtime, path) in enumerate(files):
+                # Current logfile isn't in the list, so keep one file less
+                too_many = self._keep_files and nr >= self._keep_files - 1
+                too_old = self._keep_days and mtime < min_mtime
+
+                if too_many or too_old:
+                    try:
+                        os.remove(path)
+                    except OSError as ex:
+                        self._logger.warning("Not possible to delete logfile " + path + ": " + str(ex))
+
+    # Compress logfile with gzip, delete the original and return new path
+    def _compress_file(self, path):
+        gz_path = path + ".gz"
+
+        with open(path, "rb") as file, gzip.open(gz_path + ".tmp", "wb") as gz_file:
+            shutil.copyfileobj(file, gz_file)
+
+        # Keep modification time for the retention policy
+        mtime = os.path.getmtime(path)
+        os.utime(gz_path + ".tmp", (mtime, mtime))
+
+        os.replace(gz_path + ".tmp", gz_path)
+        os.remove(path)
+
+        return gz_path
+
+    # Put record into queue of the background writer. What happens if the
+    # queue is full depends on the overflow policy
+    def _enqueue(self, item):
+        if self._overflow == "block":
+            self._queue.put(item)
+            return
+
+        while True:
+            try:
+                self._queue.put_nowait(item)
+                return
+            except queue.Full:
+                if self._overflow == "drop_new":
+                    self._count_dropped()
+                    return
+
+            try:
+                dropped = self._queue.get_nowait()
+            except queue.Empty:
+                continue
+
+            # Someone waits for a flush - nothing to wait for anymore
+            if isinstance(dropped, threading.Event):
+                dropped.set()
+            else:
+                self._count_dropped()
+
+    def _count_dropped(self):
+        with self._dropped_lock:
+            self._dropped += 1
+
+    # Background writer: write all records that are in the queue with one
+    # write call. Items can also be an event (flush) or None (stop)
+    def _write_loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = list()
+            created = time.time()
+
+            if self._dropped:
+                with self._dropped_lock:
+                    dropped, self._dropped = self._dropped, 0
+                record = logging.makeLogRecord({"name": __name__,
+                                                "levelno": logging.WARNING,
+                                                "levelname": "WARNING",
+                                                "msg": "%d log records dropped (queue full)" % dropped})
+                lines.append(self._formatter.format(record) + "\n")
+
+            for item in batch:
+                if item is None:
+                    self._write(lines, created)
+                    self._file.close()
+                    return
+
+                if isinstance(item, threading.Event):
+                    self._write(lines, created)
+                    lines = list()
+                    item.set()
+                    continue
+
+                # Records of a new day go into the new logfile
+                if item.created >= self._rollover_time:
+                    self._write(lines, created)
+                    lines = list()
+
+                created = item.created
+                lines.append(self._formatter.format(item) + "\n")
+
+            self._write(lines, created)
+
+    # Wait until all logged records are written to the logfile
+    def flush(self, timeout=5):
+        if self._writer and self._writer.is_alive():
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait(timeout)
+        elif self._file_handler:
+            self._file_handler.flush()
+
+    # Write all remaining records and stop the background writer
+    def close(self, timeout=5):
+        if self._writer and self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join(timeout)
+        elif self._file_handler:
+            self._file_handler.flush()
+
+    # Return correlation ID of the current thread or task (or None). All records
+    # that are logged while handling one update share the same ID
+    def correlation_id(self):
+        if self._cid:
+            return self._cid.get()
+        return getattr(self._context, "cid", None)
+
+    # Set correlation ID of the current thread or task. Return the new ID
+    def new_correlation_id(self, cid=None):
+        cid = cid if cid else uuid.uuid4().hex[:12]
+        if self._cid:
+            self._cid.set(cid)
+        else:
+            self._context.cid = cid
+        return cid
+
+    # Log an event and save it in a file with current date as name
+    def log(self, severity, msg, *args, **kwargs):
         self._logger.log(severity, msg, *args, **kwargs)
 
+    # Log a structured event. In JSON format, 'fields' will be saved as separate
+    # keys, otherwise only the message will be logged. JSON logfiles are read by
+    # 'analyze_logs.py', so there events are always logged, whatever the log level
+    def event(self, event, fields, msg, severity=logging.INFO):
+        if self._json:
+            severity = max(severity, self._log_level)
+        self._logger.log(severity, msg, extra={"event": event, "fields": fields})
+
     def debug(self, msg, *args, **kwargs):
         self.log(logging.DEBUG, msg, *args, **kwargs)
 
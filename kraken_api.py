@@ -1,72 +1,705 @@
 import krakenex
-import inspect
 import bs4
 import re
+import os
+import atexit
+import logging
+import sys
+import time
+import heapq
+import random
+import itertools
+import threading
+import collections
 import requests
+import requests.adapters
+from urllib.parse import urlencode
 from utils import *
 from file_logger import logger
+from metrics import registry
+from balance_engine import AvailableBalance
+from concurrent.futures import ThreadPoolExecutor
 
 
-class Kraken(krakenex.API):
-    _assets = {}
+# Metrics of all Kraken API requests
+request_duration = registry.histogram("kraken_request_duration_seconds",
+                                      "Duration of Kraken API requests (including retries)", ["method"])
+request_errors = registry.counter("kraken_request_errors_total",
+                                  "Kraken API requests that returned an error", ["method", "error_class"])
+request_retries = registry.counter("kraken_request_retries_total",
+                                   "Retries of Kraken API requests", ["method"])
+
+
+# Return class of a Kraken error like 'EAPI' or 'ReadTimeout'
+def error_class(error):
+    return error.split(":")[0]
+
+
+# Return response for exceptions that are returned right away without retrying
+# (for the threaded and the asyncio client) or None if the request can be retried
+def immediate_error(ex):
+    # Mostly this means that the API keys are not correct
+    if "Incorrect padding" in str(ex):
+        return {"error": ["Incorrect padding: please verify that your Kraken API keys are valid"]}
+    # No need to retry if the API service is not available right now
+    if "Service:Unavailable" in str(ex):
+        return {"error": ["Service: Unavailable"]}
+    return None
+
+
+# Return number of orders that 'CancelAll' cancelled besides the known orders 'txids'
+def others_cancelled(res_data, txids):
+    others = int(res_data["result"].get("count", len(txids))) - len(txids)
+
+    if others > 0:
+        logger.warning("Cancelled %d orders that were not known" % others)
+
+    return max(others, 0)
+
+
+# Connection pool for all outbound HTTP requests. Connections are kept alive and
+# reused (no new TLS handshake per request) and every request has a timeout
+class HttpPool:
+    def __init__(self, pool_size=10, connect_timeout=5, read_timeout=30):
+        self.session = requests.Session()
+        self.session.headers.update({"Connection": "keep-alive"})
+        self.init(pool_size, connect_timeout, read_timeout)
+
+    # Set size of the pool and timeouts in seconds
+    def init(self, pool_size, connect_timeout, read_timeout):
+        self.timeout = (connect_timeout, read_timeout)
+
+        # Connections of the old adapters would be left open
+        for old_adapter in set(self.session.adapters.values()):
+            old_adapter.close()
+
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.post(url, **kwargs)
+
+    @property
+    def headers(self):
+        return self.session.headers
+
+    def close(self):
+        self.session.close()
+
+    # Return number of requests and opened connections per host. Every
+    # request that didn't need to open a new connection reused one
+    def stats(self):
+        stats = dict()
+
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools[key]
+
+                host = pool.scheme + "://" + pool.host
+                if pool.port:
+                    host += ":" + str(pool.port)
+                requests_nr = pool.num_requests
+                connections_nr = pool.num_connections
+
+                stats[host] = {
+                    "requests": requests_nr,
+                    "connections": connections_nr,
+                    "reused": max(0, requests_nr - connections_nr)
+                }
+
+        return stats
+
+
+# Shared connection pool for Kraken API and scraped websites
+http_pool = HttpPool()
+
+
+# Models the call counter that Kraken uses to rate-limit private API calls and
+# delays calls that would exceed the limit. Waiting calls are served by priority
+class RateLimiter:
+    # Priorities of calls (lower value will be served first)
+    PRIO_ORDER = 0
+    PRIO_DEFAULT = 1
+    PRIO_POLL = 2
+
+    # Maximum counter value and counter decrease per second for every account tier
+    tiers = {
+        "starter": (15, 0.33),
+        "intermediate": (20, 0.5),
+        "pro": (20, 1.0)
+    }
+
+    # Counter increase for methods that don't increase it by 1
+    costs = {
+        "AddOrder": 0,
+        "CancelOrder": 0,
+        "CancelAll": 0,
+        "Ledgers": 2,
+        "QueryLedgers": 2,
+        "TradesHistory": 2,
+        "QueryTrades": 2
+    }
+
+    # Priority for methods that don't have the default priority
+    priorities = {
+        "AddOrder": PRIO_ORDER,
+        "CancelOrder": PRIO_ORDER,
+        "CancelAll": PRIO_ORDER
+    }
+
+    def __init__(self, tier="starter"):
+        if tier not in self.tiers:
+            raise ValueError("Unknown Kraken account tier '" + str(tier) + "'")
+
+        self._max_counter, self._decay = self.tiers[tier]
+
+        self._counter = 0.0
+        self._last_decay = time.monotonic()
+
+        # Heap of waiting calls as (priority, sequence number)
+        self._waiting = list()
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+
+        # Statistics
+        self._calls = 0
+        self._delayed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    # Decrease the counter by the time that passed since the last decrease
+    def _update_counter(self):
+        now = time.monotonic()
+        self._counter = max(0.0, self._counter - (now - self._last_decay) * self._decay)
+        self._last_decay = now
+
+    # Block until the call for the given method can be issued without exceeding the limit
+    def acquire(self, method, priority=None):
+        cost = min(self.costs.get(method, 1), self._max_counter)
+
+        if priority is None:
+            priority = self.priorities.get(method, self.PRIO_DEFAULT)
+
+        start = time.monotonic()
+
+        with self._cond:
+            entry = (priority, next(self._sequence))
+            heapq.heappush(self._waiting, entry)
+
+            try:
+                while True:
+                    self._update_counter()
+
+                    if self._waiting[0] == entry:
+                        excess = self._counter + cost - self._max_counter
+
+                        # Enough room in the counter, the call can be issued
+                        if excess <= 0:
+                            break
+
+                        # Wait until the counter decreased enough
+                        self._cond.wait(excess / self._decay)
+                    else:
+                        # Wait until calls with higher priority are done
+                        self._cond.wait()
+
+                self._counter += cost
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+            waited = self._count_call(start)
+
+        if waited > 0.001:
+            logger.debug("Rate limit: delayed '" + method + "' by %.2f seconds" % waited)
+
+    # Non-blocking variant of 'acquire' for callers that can't wait in a thread
+    # (coroutines). Return 0 if the call can be issued now, otherwise the seconds to
+    # wait before trying again. Waiting calls of 'acquire' are served first. 'start'
+    # is the monotonic time of the first try
+    def try_acquire(self, method, priority=None, start=None):
+        cost = min(self.costs.get(method, 1), self._max_counter)
+
+        if priority is None:
+            priority = self.priorities.get(method, self.PRIO_DEFAULT)
+
+        with self._cond:
+            self._update_counter()
+            excess = self._counter + cost - self._max_counter
+
+            if excess > 0 or (self._waiting and self._waiting[0][0] <= priority):
+                return max(excess / self._decay, 0.05)
+
+            self._counter += cost
+            waited = self._count_call(start if start else time.monotonic())
+
+        if waited > 0.001:
+            logger.debug("Rate limit: delayed '" + method + "' by %.2f seconds" % waited)
+
+        return 0
+
+    # Update statistics for an issued call. Needs to be called with lock
+    def _count_call(self, start):
+        waited = time.monotonic() - start
+
+        self._calls += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        if waited > 0.001:
+            self._delayed += 1
+
+        return waited
+
+    # Kraken reported that the limit was exceeded - counter is at its maximum
+    def penalize(self):
+        with self._cond:
+            self._update_counter()
+            self._counter = self._max_counter
+            self._cond.notify_all()
+
+    # Return current state and statistics of the rate limiter
+    def metrics(self):
+        with self._cond:
+            self._update_counter()
+
+            return {
+                "counter": round(self._counter, 2),
+                "counter_max": self._max_counter,
+                "queue_depth": len(self._waiting),
+                "calls": self._calls,
+                "delayed_calls": self._delayed,
+                "wait_total": round(self._wait_total, 3),
+                "wait_avg": round(self._wait_total / self._calls, 3) if self._calls else 0.0,
+                "wait_max": round(self._wait_max, 3)
+            }
+
+
+# Decides if and when a failed Kraken request will be issued again. The delay
+# between retries grows exponentially (with random jitter) and all retries have
+# to be done before the deadline (seconds after the first request) is reached
+class RetryPolicy:
+    # Errors that are safe to retry as (error, retry public call, retry private call).
+    # For private calls only errors are retried where the request was surely not
+    # executed by Kraken - otherwise an order could be placed twice. First match wins
+    errors = [
+        ("EService:Busy", True, True),
+        ("EAPI:Rate limit exceeded", True, True),
+        ("EAPI:Invalid nonce", False, True),
+        ("ConnectTimeout", True, True),
+        ("ReadTimeout", True, False),
+        ("Timeout", True, False),
+        ("ConnectionError", True, False),
+        ("HTTPError", True, False)
+    ]
+
+    def __init__(self, retries=0, delay=1, max_delay=10, deadline=30):
+        self.retries = int(retries)
+        self.delay = float(delay)
+        self.max_delay = float(max_delay)
+        self.deadline = float(deadline)
+
+    # Return TRUE if the error is safe to retry for this kind of call
+    def is_retryable(self, error, private):
+        for error_str, retry_public, retry_private in self.errors:
+            if error_str in error:
+                return retry_private if private else retry_public
+        return False
+
+    # Return seconds to wait before retry number 'attempt' (starting with 0) or
+    # None if the request should not be retried. 'start' is the monotonic time
+    # of the first request
+    def next_delay(self, error, private, attempt, start):
+        if attempt >= self.retries or not self.is_retryable(error, private):
+            return None
+
+        # Exponential backoff with jitter: between half and the full backoff time
+        backoff = min(self.max_delay, self.delay * 2 ** attempt)
+        delay = backoff / 2 + random.uniform(0, backoff / 2)
+
+        # Don't retry if the deadline would be exceeded
+        if time.monotonic() + delay - start > self.deadline:
+            return None
+
+        return delay
+
+
+# Records caller, latency, payload size and outcome of Kraken requests if
+# enabled. If disabled, the only overhead is checking attribute 'enabled'
+class RequestTracer:
+    # Request parameters that will not show up in a trace
+    redacted = ("nonce", "otp", "key", "secret", "token")
+
+    def __init__(self, enabled=False, max_records=1000):
+        self.enabled = enabled
+        self._records = collections.deque(maxlen=max_records)
+
+    # Save trace of a finished request and log it
+    def record(self, method, caller, start, data, res_data, retries=0):
+        duration = time.monotonic() - start
+
+        params = dict()
+        if data:
+            for key, value in data.items():
+                params[key] = "***" if key in self.redacted else value
+
+        error = res_data["error"][0] if res_data["error"] else None
+
+        trace = {
+            "method": method,
+            "caller": caller,
+            "duration_ms": round(duration * 1000, 1),
+            "retries": retries,
+            "payload_size": len(urlencode(data)) if data else 0,
+            "params": params,
+            "outcome": error if error else "OK",
+            "error_class": error_class(error) if error else None
+        }
+
+        self._records.append(trace)
+        logger.event("kraken_request", trace, "Trace: " + str(trace), logging.DEBUG)
+
+    # Return a list with the latest traces
+    def records(self):
+        return list(self._records)
+
+
+# Strictly increasing nonces for private requests, shared by all threads and
+# clients of one API key. Based on the clock in milliseconds, but never lower
+# than the last nonce plus 1 (concurrent requests in the same millisecond). The
+# last nonce is saved to a file on exit and restart, so that nonces still
+# increase if they ran ahead of the clock before
+class NonceGenerator:
+    def __init__(self, path=None):
+        self._path = path
+        self._last = self._load()
+        self._lock = threading.Lock()
+
+        if path:
+            atexit.register(self.save)
+
+    def _load(self):
+        if not self._path or not os.path.isfile(self._path):
+            return 0
+
+        try:
+            with open(self._path) as nonce_file:
+                return int(nonce_file.read().strip())
+        except (OSError, ValueError) as ex:
+            logger.warning("Not possible to read last nonce: " + str(ex))
+            return 0
+
+    def next(self):
+        now = int(1000 * time.time())
+
+        with self._lock:
+            self._last = max(self._last + 1, now)
+            return self._last
+
+    # Don't save the last nonce anymore (for keys that won't be used again)
+    def forget(self):
+        atexit.unregister(self.save)
+        self._path = None
+
+    # Save last nonce. Needs to be called before the process is replaced
+    def save(self):
+        if not self._path:
+            return
+
+        with self._lock:
+            last = self._last
+
+        try:
+            tmp_path = self._path + ".tmp"
+            with open(tmp_path, "w") as nonce_file:
+                nonce_file.write(str(last))
+            os.replace(tmp_path, self._path)
+        except OSError as ex:
+            logger.warning("Not possible to save last nonce: " + str(ex))
+
+
+# Read-through cache for responses of public Kraken API calls with a TTL per
+# method. Concurrent requests for the same data share one in-flight request
+class ResponseCache:
+    # Time in seconds that responses of a method will be cached
+    default_ttls = {
+        "Ticker": 5,
+        "Assets": 3600,
+        "AssetPairs": 3600
+    }
+
+    def __init__(self, ttls=None):
+        self.ttls = dict(ttls) if ttls else dict(self.default_ttls)
+
+        # Cached responses as key: (expiry time, response)
+        self._entries = dict()
+        # Requests that are currently issued as key: _Flight
+        self._flights = dict()
+        self._lock = threading.Lock()
+
+        # Number of hits, misses and shared requests per method
+        self._counts = collections.defaultdict(collections.Counter)
+
+    # Holds the result of an in-flight request for all waiting threads
+    class _Flight:
+        def __init__(self):
+            self.done = threading.Event()
+            self.res_data = None
+
+    @staticmethod
+    def key(method, data):
+        return method, tuple(sorted(data.items())) if data else ()
+
+    # Return cached response or call 'fetch' to get it from Kraken
+    def get(self, method, data, fetch):
+        ttl = self.ttls.get(method)
+
+        # Method not cached
+        if not ttl:
+            return fetch()
 
-    def __init__(self, keyfile="kraken.key", retries=0):
+        key = self.key(method, data)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.monotonic():
+                self._counts[method]["hits"] += 1
+                return entry[1]
+
+            flight = self._flights.get(key)
+            if flight:
+                self._counts[method]["shared"] += 1
+                owner = False
+            else:
+                self._counts[method]["misses"] += 1
+                flight = self._Flight()
+                self._flights[key] = flight
+                owner = True
+
+        # Same request is already in-flight, wait for its response
+        if not owner:
+            flight.done.wait()
+            return flight.res_data
+
+        try:
+            flight.res_data = fetch()
+        finally:
+            with self._lock:
+                # Don't cache errors
+                if flight.res_data and not flight.res_data["error"]:
+                    self._entries[key] = (time.monotonic() + ttl, flight.res_data)
+                del self._flights[key]
+
+            flight.done.set()
+
+        return flight.res_data
+
+    # Return cached response or None. For callers that can't wait for an in-flight
+    # request in a thread (coroutines) and fetch the response themselves
+    def lookup(self, method, data):
+        if not self.ttls.get(method):
+            return None
+
+        with self._lock:
+            entry = self._entries.get(self.key(method, data))
+            if entry and entry[0] > time.monotonic():
+                self._counts[method]["hits"] += 1
+                return entry[1]
+
+        return None
+
+    # Cache a response that was fetched after 'lookup' found nothing
+    def store(self, method, data, res_data):
+        ttl = self.ttls.get(method)
+        if not ttl:
+            return
+
+        with self._lock:
+            self._counts[method]["misses"] += 1
+            # Don't cache errors
+            if not res_data["error"]:
+                self._entries[self.key(method, data)] = (time.monotonic() + ttl, res_data)
+
+    # Remove cached responses for a method or all cached responses
+    def invalidate(self, method=None):
+        with self._lock:
+            if method:
+                for key in [k for k in self._entries if k[0] == method]:
+                    del self._entries[key]
+            else:
+                self._entries.clear()
+
+    # Return number of cache hits, misses, requests that shared an in-flight
+    # request and cached responses per method
+    def stats(self):
+        with self._lock:
+            stats = dict()
+
+            for method, counts in self._counts.items():
+                stats[method] = {
+                    "hits": counts["hits"],
+                    "misses": counts["misses"],
+                    "shared": counts["shared"],
+                    "entries": sum(1 for key in self._entries if key[0] == method)
+                }
+
+            return stats
+
+
+# Lookup tables for assets and asset pairs, built once from the responses of
+# 'Assets' and 'AssetPairs'. An index is never changed after it was built. If
+# the data changes, a new index will be built and replaces the old one
+class AssetIndex:
+    def __init__(self, assets=None, asset_pairs=None):
+        self.assets = assets if assets else dict()
+        self.asset_pairs = asset_pairs if asset_pairs else dict()
+
+        # Internal asset name (XXBT) to altname (XBT) and the other way round
+        self.altname = dict()
+        self.name = dict()
+        for asset, data in self.assets.items():
+            self.altname[asset] = data["altname"]
+            self.name[data["altname"]] = asset
+
+        # Pair name (XXBTZEUR) and pair altname (XBTEUR) to (base asset, quote asset)
+        self._pair_assets = dict()
+        # (Base altname, quote altname) to pair name
+        self._pairs = dict()
+
+        for pair, data in self.asset_pairs.items():
+            # Skip dark pool pairs
+            if pair.endswith(".d"):
+                continue
+
+            base, quote = data["base"], data["quote"]
+            self._pair_assets[pair] = (base, quote)
+            self._pair_assets[data["altname"]] = (base, quote)
+
+            base_alt = self.altname.get(base, base)
+            quote_alt = self.altname.get(quote, quote)
+            self._pairs[(base_alt, quote_alt)] = pair
+
+    # Return pair name for a coin and the currency to trade it to (both altnames)
+    def pair(self, coin, to_cur):
+        return self._pairs.get((coin, to_cur))
+
+    # From pair name or pair altname get base asset (XXBT) and quote asset (ZEUR)
+    def assets_from_pair(self, pair):
+        return self._pair_assets.get(pair, (None, None))
+
+
+class Kraken(krakenex.API):
+    def __init__(self, keyfile="kraken.key", retry_policy=None, tier="starter", trace=False, pool=None,
+                 cache_ttls=None, bulk_workers=5):
         super().__init__()
         self.load_key(keyfile)
-        self._retries = retries
+
+        # Send requests through the connection pool instead of an own session
+        self.pool = pool if pool else http_pool
+        self.pool.headers.update(self.session.headers)
+        self.session.close()
+        self.session = self.pool
+
+        self.retry_policy = retry_policy if retry_policy else RetryPolicy()
+        self.limiter = RateLimiter(tier)
+        self.tracer = RequestTracer(trace)
+        self.cache = ResponseCache(cache_ttls)
+
+        self.index = AssetIndex()
+        self._index_lock = threading.Lock()
+
+        # Number of retries of the last request per thread (for tracing)
+        self._local = threading.local()
+
+        # Nonces of private requests. Also used by the asyncio client
+        self.nonce = NonceGenerator(keyfile + ".nonce")
+
+        # Maximum number of concurrent requests for bulk operations
+        self._bulk_workers = bulk_workers
 
     # Issue Kraken API requests
-    def query(self, method, data=None, private=False, retries=None):
-        # Get arguments of this function
-        frame = inspect.currentframe()
-        args, _, _, values = inspect.getargvalues(frame)
+    def query(self, method, data=None, private=False, priority=None):
+        self._local.retries = 0
 
-        # Get name of caller function
-        caller = inspect.currentframe().f_back.f_code.co_name
+        start = time.monotonic()
+        res_data = self._query_cached(method, data, private, priority)
 
-        # Log caller of this function and all arguments
-        logger.debug(caller + " - args: " + str([(i, values[i]) for i in args]))
+        request_duration.observe(time.monotonic() - start, method)
+        if res_data["error"]:
+            request_errors.inc(method, error_class(res_data["error"][0]))
 
-        try:
-            if private:
-                return self.query_private(method, data)
-            else:
-                return self.query_public(method, data)
-
-        except Exception as ex:
-            logger.exception(self.__class__.__name__ + " exception:")
-
-            ex_name = type(ex).__name__
-
-            # Handle the following exceptions immediately without retrying
-
-            # Mostly this means that the API keys are not correct
-            if "Incorrect padding" in str(ex):
-                msg = "Incorrect padding: please verify that your Kraken API keys are valid"
-                return {"error": [msg]}
-            # No need to retry if the API service is not available right now
-            elif "Service:Unavailable" in str(ex):
-                msg = "Service: Unavailable"
-                return {"error": [msg]}
-
-            # Is retrying on error enabled?
-            if self._retries:
-                # It's the first call, start retrying
-                if retries is None:
-                    retries = self._retries
-                    return self.query(method, data, private, retries)
-                # If 'retries' is bigger then 0, decrement it and retry again
-                elif retries > 0:
-                    retries -= 1
-                    return self.query(method, data, private, retries)
-                # Return error from last Kraken request
+        if self.tracer.enabled:
+            # Get name of caller function
+            caller = sys._getframe(1).f_code.co_name
+            self.tracer.record(method, caller, start, data, res_data, self._local.retries)
+
+        return res_data
+
+    # Replaces the nonce of krakenex, which is only the current time
+    def _nonce(self):
+        return self.nonce.next()
+
+    # Return response of public calls from cache if possible
+    def _query_cached(self, method, data, private, priority):
+        if private:
+            return self._query_retry(method, data, private, priority)
+
+        return self.cache.get(method, data, lambda: self._query_retry(method, data, private, priority))
+
+    # Issue Kraken API request and retry it on error if the retry policy allows it
+    def _query_retry(self, method, data, private, priority):
+        start = time.monotonic()
+        attempt = 0
+
+        while True:
+            try:
+                if private:
+                    # Wait until the call doesn't exceed the rate limit
+                    self.limiter.acquire(method, priority)
+
+                    res_data = self.query_private(method, data)
+
+                    # Counter of the rate limiter got out of sync with Kraken
+                    if any("Rate limit exceeded" in error for error in res_data["error"]):
+                        self.limiter.penalize()
                 else:
-                    return {"error": [ex_name + ":" + str(ex)]}
-            # Retrying on error not enabled, return error from last Kraken request
-            else:
-                return {"error": [ex_name + ":" + str(ex)]}
+                    res_data = self.query_public(method, data)
 
-    def balance(self):
+                # Successful request, no need to retry
+                if not res_data["error"]:
+                    return res_data
+
+            except Exception as ex:
+                logger.exception(self.__class__.__name__ + " exception:")
+
+                # Handle some exceptions immediately without retrying
+                res_data = immediate_error(ex)
+                if res_data:
+                    return res_data
+
+                res_data = {"error": [type(ex).__name__ + ":" + str(ex)]}
+
+            # Return error from last Kraken request if it's not safe to retry
+            error = res_data["error"][0]
+            delay = self.retry_policy.next_delay(error, private, attempt, start)
+            if delay is None:
+                return res_data
+
+            attempt += 1
+            self._local.retries = attempt
+            request_retries.inc(method)
+            logger.warning("Retry %d for '%s' in %.2f seconds: %s" % (attempt, method, delay, error))
+            time.sleep(delay)
+
+    # Return available volume of all assets, considering all open orders
+    def available_balance(self):
         # Send request to Kraken to get current balance of all currencies
         res_balance = self.query("Balance", private=True)
 
@@ -79,43 +712,28 @@ class Kraken(krakenex.API):
         if res_orders["error"]:
             return False, res_orders["error"][0]
 
-        msg = str()
-
-        # Go over all currencies in your balance
-        for currency_key, currency_value in res_balance["result"].items():
-            available_value = currency_value
+        return True, AvailableBalance(res_balance["result"], res_orders["result"]["open"], self.index)
 
-            # Go through all open orders and check if an order exists for the currency
-            if res_orders["result"]["open"]:
-                for order in res_orders["result"]["open"]:
-                    order_desc = res_orders["result"]["open"][order]["descr"]["order"]
-                    order_desc_list = order_desc.split(" ")
-
-                    order_type = order_desc_list[0]
-                    order_volume = order_desc_list[1]
-                    price_per_coin = order_desc_list[5]
+    def balance(self):
+        success, balance = self.available_balance()
 
-                    # Check if asset is fiat-currency (EUR, USD, ...) and BUY order
-                    if currency_key.startswith("Z") and order_type == "buy":
-                        available_value = float(available_value) - (float(order_volume) * float(price_per_coin))
+        if not success:
+            return False, balance
 
-                    # Current asset is a coin and not a fiat currency
-                    else:
-                        for asset, data in self._assets.items():
-                            if order_desc_list[2].endswith(data["altname"]):
-                                order_currency = order_desc_list[2][:-len(data["altname"])]
-                                break
+        return True, self.balance_msg(balance)
 
-                        # Reduce current volume for coin if open sell-order exists
-                        if self._assets[currency_key]["altname"] == order_currency and order_type == "sell":
-                            available_value = float(available_value) - float(order_volume)
+    # Return message with total and available volume of all assets
+    def balance_msg(self, balance):
+        msg = str()
 
+        # Go over all currencies in your balance
+        for currency_key, currency_value in balance.total.items():
             # Only show assets with volume > 0
-            if trim_zeros(currency_value) is not "0":
-                msg += bold(self._assets[currency_key]["altname"] + ": " + trim_zeros(currency_value) + "\n")
+            if trim_zeros(currency_value) != "0":
+                currency_value = trim_zeros(currency_value)
+                available_value = trim_zeros(balance.available(currency_key))
 
-                available_value = trim_zeros("{0:.8f}".format(float(available_value)))
-                currency_value = trim_zeros("{0:.8f}".format(float(currency_value)))
+                msg += bold(self.index.altname[currency_key] + ": " + currency_value + "\n")
 
                 # If orders exist for this asset, show available volume too
                 if currency_value == available_value:
@@ -123,7 +741,43 @@ class Kraken(krakenex.API):
                 else:
                     msg += "(Available: " + available_value + ")\n"
 
-        return True, msg
+        return msg
+
+    # Issue the same kind of request for every item of 'data_list' concurrently (but
+    # never more requests at once than 'bulk_workers') and return a list of responses
+    def bulk_query(self, method, data_list, private=False):
+        if not data_list:
+            return list()
+
+        # Requests belong to the same update as the caller
+        cid = logger.correlation_id()
+
+        def query(data):
+            logger.new_correlation_id(cid)
+            return self.query(method, data, private)
+
+        workers = min(len(data_list), self._bulk_workers)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(query, data_list))
+
+    # Cancel orders concurrently. Return dictionary with TXID as key and error (or
+    # None if cancelled) as value and the number of cancelled orders that were not
+    # in 'txids'. If 'cancel_all' is TRUE, the given orders are all known open
+    # orders and all open orders will be cancelled with one request. Orders that
+    # were placed since they were retrieved will be cancelled too
+    def cancel_orders(self, txids, cancel_all=False):
+        if cancel_all:
+            res_data = self.query("CancelAll", private=True)
+
+            if not res_data["error"]:
+                return {txid: None for txid in txids}, others_cancelled(res_data, txids)
+
+            # Cancel them one by one if that didn't work
+            logger.warning("Cancelling all orders failed: " + res_data["error"][0])
+
+        responses = self.bulk_query("CancelOrder", [{"txid": txid} for txid in txids], private=True)
+
+        return {txid: res["error"][0] if res["error"] else None for txid, res in zip(txids, responses)}, 0
 
     def assets(self):
         res_assets = self.query("Assets")
@@ -131,9 +785,9 @@ class Kraken(krakenex.API):
         if res_assets["error"]:
             return False, res_assets["error"][0]
 
-        self._assets = res_assets["result"]
+        self._update_index(assets=res_assets["result"])
 
-        return True, self._assets
+        return True, res_assets["result"]
 
     def assets_pairs(self):
         res_pairs = self.query("AssetPairs")
@@ -141,13 +795,29 @@ class Kraken(krakenex.API):
         if res_pairs["error"]:
             return False, res_pairs["error"][0]
 
+        self._update_index(asset_pairs=res_pairs["result"])
+
         return True, res_pairs["result"]
 
+    # Use assets and pairs that were not retrieved from Kraken (from a snapshot for example)
+    def load_assets(self, assets, asset_pairs):
+        self._update_index(assets, asset_pairs)
+
+    # Build new index with changed assets or asset pairs and replace the current one
+    def _update_index(self, assets=None, asset_pairs=None):
+        with self._index_lock:
+            if assets is None:
+                assets = self.index.assets
+            if asset_pairs is None:
+                asset_pairs = self.index.asset_pairs
+
+            self.index = AssetIndex(assets, asset_pairs)
+
     # Return dictionary with asset name as key and order limit as value
     @staticmethod
     def min_order_size():
         url = "https://support.kraken.com/hc/en-us/articles/205893708-What-is-the-minimum-order-size-"
-        response = requests.get(url)
+        response = http_pool.get(url)
 
         # If response code is not 200, return empty dictionary
         if response.status_code != 200:
@@ -174,7 +844,7 @@ class Kraken(krakenex.API):
     @staticmethod
     def api_state():
         url = "https://status.kraken.com"
-        response = requests.get(url)
+        response = http_pool.get(url)
 
         # If response code is not 200, return state 'UNKNOWN'
         if response.status_code != 200:
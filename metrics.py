@@ -0,0 +1,222 @@
+import bisect
+import threading
+import http.server
+import socketserver
+from collections import defaultdict
+from file_logger import logger
+
+
+# Return label part of a sample like '{method="Balance"}'
+def _format_labels(names, values):
+    if not names:
+        return ""
+
+    labels = list()
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        labels.append(name + "=\"" + value + "\"")
+
+    return "{" + ",".join(labels) + "}"
+
+
+# Value that only increases (number of requests, errors, ...)
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+
+        self._values = defaultdict(float)
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    # Return dictionary with label values as key and current value as value
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        for label_values, value in sorted(self.values().items()):
+            yield self.name + _format_labels(self.labels, label_values), value
+
+
+# Distribution of observed values (durations) in buckets, with sum and count
+class Histogram:
+    type = "histogram"
+
+    # Upper bounds of the buckets in seconds
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self, name, description, labels=(), buckets=default_buckets):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+
+        # Label values as key and [count per bucket, sum, count] as value.
+        # Last bucket is for values bigger than the biggest upper bound
+        self._values = dict()
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            data = self._values.get(label_values)
+            if data is None:
+                data = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+
+            data[0][index] += 1
+            data[1] += value
+            data[2] += 1
+
+    # Return dictionary with label values as key and (sum, count) as value
+    def values(self):
+        with self._lock:
+            return {label_values: (data[1], data[2]) for label_values, data in self._values.items()}
+
+    # Return value below which the given share (0 - 1) of observations lies.
+    # It's the upper bound of the bucket, so this is only an estimation
+    def quantile(self, share, *label_values):
+        with self._lock:
+            data = self._values.get(label_values)
+            if not data:
+                return None
+            counts = list(data[0])
+            total = data[2]
+
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            if cumulative >= share * total:
+                return bound
+
+    def samples(self):
+        with self._lock:
+            items = sorted((label_values, list(data[0]), data[1], data[2])
+                           for label_values, data in self._values.items())
+
+        labels = self.labels + ("le",)
+        for label_values, counts, value_sum, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self.name + "_bucket" + _format_labels(labels, label_values + (bound,)), cumulative
+
+            yield self.name + "_bucket" + _format_labels(labels, label_values + ("+Inf",)), count
+            yield self.name + "_sum" + _format_labels(self.labels, label_values), value_sum
+            yield self.name + "_count" + _format_labels(self.labels, label_values), count
+
+
+# Value that is read when the metrics are requested (queue sizes, ...). The
+# function returns a number or a dictionary with label values as key
+class Gauge:
+    type = "gauge"
+
+    def __init__(self, name, description, function, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._function = function
+
+    def values(self):
+        try:
+            value = self._function()
+        except Exception as ex:
+            logger.warning("Not possible to read metric " + self.name + ": " + str(ex))
+            return dict()
+
+        return value if isinstance(value, dict) else {(): value}
+
+    def samples(self):
+        for label_values, value in sorted(self.values().items()):
+            yield self.name + _format_labels(self.labels, label_values), value
+
+
+# All metrics of the bot
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = dict()
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Metrics are registered once. Return existing one if registered again
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, description, labels=()):
+        return self._register(Counter(name, description, labels))
+
+    def histogram(self, name, description, labels=(), buckets=Histogram.default_buckets):
+        return self._register(Histogram(name, description, labels, buckets))
+
+    def gauge(self, name, description, function, labels=()):
+        return self._register(Gauge(name, description, function, labels))
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    # Return all metrics in the Prometheus text format
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+
+        lines = list()
+        for metric in metrics:
+            lines.append("# HELP " + metric.name + " " + metric.description)
+            lines.append("# TYPE " + metric.name + " " + metric.type)
+
+            for sample, value in metric.samples():
+                lines.append(sample + " " + repr(float(value)))
+
+        return "\n".join(lines) + "\n"
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+# Local HTTP endpoint that serves the metrics for Prometheus at '/metrics'
+class MetricsServer:
+    def __init__(self, registry, listen="127.0.0.1", port=8000):
+        self._registry = registry
+        self._address = (listen, port)
+        self._server = None
+
+    def start(self):
+        registry = self._registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _ThreadingHTTPServer(self._address, Handler)
+        threading.Thread(target=self._server.serve_forever, name="MetricsServer", daemon=True).start()
+
+        logger.info("Metrics available at http://%s:%d/metrics" % self._server.server_address[:2])
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+registry = MetricsRegistry()
@@ -0,0 +1,160 @@
+import json
+import threading
+from file_logger import logger
+
+# Optional dependency - without it, order states will only be polled
+try:
+    import websocket
+except ImportError:
+    websocket = None
+
+
+# Receives order updates from the private Kraken WebSocket feed ('openOrders')
+# and passes them to the order watcher, so that executed trades are notified
+# right away. Trades ('ownTrades') of monitored orders trigger a check of their
+# state, in case the status update got lost. While the feed is not connected,
+# the order watcher polls
+class OrderFeed:
+    def __init__(self, kraken, watcher, url="wss://ws-auth.kraken.com", reconnect_delay=5, max_reconnect_delay=300):
+        self._kraken = kraken
+        self._watcher = watcher
+        self._url = url
+        self._reconnect_delay = reconnect_delay
+        self._max_reconnect_delay = max_reconnect_delay
+
+        # Order descriptions by TXID. Status updates don't include them
+        self._descr = dict()
+
+        self._ws = None
+        self._connected = False
+        self._stopped = threading.Event()
+
+    # TRUE if order updates are currently received
+    @property
+    def connected(self):
+        return self._connected
+
+    # Connect in a background thread. Return FALSE if WebSocket support is not available
+    def start(self):
+        if websocket is None:
+            logger.warning("Module 'websocket-client' not installed - order states will be polled")
+            return False
+
+        threading.Thread(target=self._run, name="OrderFeed", daemon=True).start()
+        return True
+
+    def stop(self):
+        self._stopped.set()
+        if self._ws:
+            self._ws.close()
+
+    # Keep connected. After a connection loss, wait longer with every failed attempt
+    def _run(self):
+        delay = self._reconnect_delay
+
+        while not self._stopped.is_set():
+            try:
+                self._listen()
+                delay = self._reconnect_delay
+            except Exception as ex:
+                logger.warning("Order feed disconnected: " + type(ex).__name__ + ":" + str(ex))
+            finally:
+                self._connected = False
+
+            if self._stopped.wait(delay):
+                break
+
+            delay = min(delay * 2, self._max_reconnect_delay)
+
+    # Connect, subscribe to order updates and process received messages
+    def _listen(self):
+        res_data = self._kraken.query("GetWebSocketsToken", private=True)
+        if res_data["error"]:
+            raise ConnectionError(res_data["error"][0])
+
+        # Kraken sends heartbeats every second, so no data for 30 seconds means connection is lost
+        self._ws = websocket.create_connection(self._url, timeout=30)
+
+        try:
+            token = res_data["result"]["token"]
+            self._subscribe({"name": "openOrders", "token": token})
+            # Only new trades, past ones are not of interest
+            self._subscribe({"name": "ownTrades", "token": token, "snapshot": False})
+
+            snapshot = True
+
+            while not self._stopped.is_set():
+                msg = json.loads(self._ws.recv())
+
+                # Event messages (heartbeat, status, ...)
+                if isinstance(msg, dict):
+                    if msg.get("event") == "subscriptionStatus" and msg.get("status") == "error":
+                        raise ConnectionError(msg.get("errorMessage"))
+                    continue
+
+                if len(msg) < 2:
+                    continue
+
+                if msg[1] == "ownTrades":
+                    self._trades(msg[0])
+                    continue
+
+                if msg[1] != "openOrders":
+                    continue
+
+                # First message after subscribing contains all open orders
+                if snapshot:
+                    self._resync(msg[0])
+                    snapshot = False
+                    self._connected = True
+                    logger.info("Order feed connected")
+                else:
+                    self._update(msg[0])
+        finally:
+            self._ws.close()
+            self._ws = None
+
+    def _subscribe(self, subscription):
+        self._ws.send(json.dumps({"event": "subscribe", "subscription": subscription}))
+
+    # Updates might have been missed while disconnected. Save descriptions of
+    # all open orders and check state of monitored orders once
+    def _resync(self, orders):
+        for order in orders:
+            for txid, order_info in order.items():
+                if "descr" in order_info:
+                    self._descr[txid] = order_info["descr"]
+
+        self._watcher.check()
+
+    # Pass status changes of monitored orders to the order watcher
+    def _update(self, orders):
+        for order in orders:
+            for txid, order_info in order.items():
+                if "descr" in order_info:
+                    self._descr[txid] = order_info["descr"]
+
+                status = order_info.get("status")
+                descr = self._descr.get(txid)
+
+                # Order is done, description not needed anymore
+                if status in ("closed", "canceled", "expired"):
+                    self._descr.pop(txid, None)
+
+                if not status or txid not in self._watcher:
+                    continue
+
+                # Order description is needed for notification, get it by polling
+                if not descr:
+                    self._watcher.check()
+                    continue
+
+                self._watcher.update(txid, dict(order_info, descr=descr))
+
+    # Check state of monitored orders if one of them was (partially) executed
+    def _trades(self, trades):
+        for trade in trades:
+            for trade_info in trade.values():
+                if trade_info.get("ordertxid") in self._watcher:
+                    self._watcher.check()
+                    return
@@ -0,0 +1,96 @@
+import threading
+from collections import deque
+from balance_engine import parse_order
+
+
+# All open orders as parsed 'Order' records, with lookup by TXID and indexes by
+# pair and side (buy / sell). Kept current by applying the result of 'OpenOrders',
+# where only new, changed and removed orders are processed. Orders that are not
+# open anymore are kept in a history with limited size
+class OrderStore:
+    def __init__(self, history_size=100):
+        self._orders = dict()
+        self._by_pair = dict()
+        self._by_side = dict()
+
+        # Executed volume by TXID to find out if an order changed
+        self._vol_exec = dict()
+
+        self._history = deque(maxlen=history_size)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._orders)
+
+    def __contains__(self, txid):
+        return txid in self._orders
+
+    # Apply result of 'OpenOrders'. Orders with a TXID in 'keep' are not removed even
+    # if they are missing in 'open_orders'. Return list of added and list of removed TXIDs
+    def sync(self, open_orders, index, keep=()):
+        with self._lock:
+            removed = [txid for txid in self._orders if txid not in open_orders and txid not in keep]
+            for txid in removed:
+                self._remove(txid)
+
+            added = list()
+            for txid, data in open_orders.items():
+                vol_exec = data.get("vol_exec")
+
+                if txid not in self._orders:
+                    added.append(txid)
+                # Order didn't change (not partially executed since last sync)
+                elif self._vol_exec[txid] == vol_exec:
+                    continue
+
+                self._add(parse_order(txid, data, index), vol_exec)
+
+            return added, removed
+
+    # Order is not open anymore (closed, cancelled, ...)
+    def remove(self, txid):
+        with self._lock:
+            if txid in self._orders:
+                self._remove(txid)
+
+    def _add(self, order, vol_exec):
+        if order.txid in self._orders:
+            self._remove(order.txid, history=False)
+
+        self._orders[order.txid] = order
+        self._vol_exec[order.txid] = vol_exec
+        self._by_pair.setdefault(order.pair, dict())[order.txid] = order
+        self._by_side.setdefault(order.type, dict())[order.txid] = order
+
+    def _remove(self, txid, history=True):
+        order = self._orders.pop(txid)
+        del self._vol_exec[txid]
+        del self._by_pair[order.pair][txid]
+        del self._by_side[order.type][txid]
+
+        if history:
+            self._history.append(order)
+
+    # Return open order with the given TXID or None
+    def get(self, txid):
+        return self._orders.get(txid)
+
+    # Return list of all open orders
+    def all(self):
+        with self._lock:
+            return list(self._orders.values())
+
+    # Return list of open orders for a pair (pair altname like 'XBTEUR')
+    def by_pair(self, pair):
+        with self._lock:
+            return list(self._by_pair.get(pair, dict()).values())
+
+    # Return list of open orders for a side ('buy' or 'sell')
+    def by_side(self, side):
+        with self._lock:
+            return list(self._by_side.get(side, dict()).values())
+
+    # Return list of orders that are not open anymore (latest last)
+    def history(self):
+        with self._lock:
+            return list(self._history)
@@ -0,0 +1,100 @@
+import asyncio
+import threading
+from file_logger import logger
+from kraken_api import RateLimiter
+
+
+# Keeps track of all orders that should be monitored and checks their
+# state with as few Kraken API calls as possible (one call per batch of
+# orders instead of one call per order)
+class OrderWatcher:
+    # Maximum number of TXIDs that Kraken accepts in one 'QueryOrders' call
+    _batch_size = 50
+
+    def __init__(self, kraken, on_closed, on_error=None):
+        self._kraken = kraken
+        self._on_closed = on_closed
+        self._on_error = on_error
+
+        # Registry of all monitored order TXIDs
+        self._txids = set()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._txids)
+
+    def __contains__(self, txid):
+        return txid in self._txids
+
+    # Start monitoring an order
+    def add(self, txid):
+        with self._lock:
+            self._txids.add(txid)
+
+    # Stop monitoring an order. Return TRUE if the order was monitored
+    def remove(self, txid):
+        with self._lock:
+            if txid not in self._txids:
+                return False
+            self._txids.remove(txid)
+            return True
+
+    # Return a sorted copy of all monitored TXIDs
+    def watched(self):
+        with self._lock:
+            return sorted(self._txids)
+
+    # Return request data for 'QueryOrders' for every batch of monitored orders
+    def _batches(self):
+        txids = self.watched()
+
+        for i in range(0, len(txids), self._batch_size):
+            yield {"txid": ",".join(txids[i:i + self._batch_size])}
+
+    # Process the response for one batch. Return FALSE if Kraken replied with an error
+    def _process(self, res_data):
+        if res_data["error"]:
+            if self._on_error:
+                self._on_error(res_data["error"][0])
+            return False
+
+        for txid, order_info in res_data["result"].items():
+            self.update(txid, order_info)
+
+        return True
+
+    # Query state of all monitored orders and notify about executed trades
+    def check(self):
+        for req_data in self._batches():
+            # Send one request to get info on all orders of the batch
+            res_data = self._kraken.query("QueryOrders", data=req_data, private=True, priority=RateLimiter.PRIO_POLL)
+
+            # If Kraken replied with an error, stop checking until next run
+            if not self._process(res_data):
+                return
+
+    # Same as 'check' but with the asyncio client 'kraken' and all batches at once.
+    # Callbacks can block, so they are called in the default executor of the loop
+    async def check_async(self, kraken):
+        requests = [kraken.query("QueryOrders", data=req_data, private=True, priority=RateLimiter.PRIO_POLL)
+                    for req_data in self._batches()]
+
+        loop = asyncio.get_event_loop()
+        for res_data in await asyncio.gather(*requests):
+            if not await loop.run_in_executor(None, self._process, res_data):
+                return
+
+    # Process the current state of a monitored order. Updates can come from
+    # polling and from the WebSocket feed - only the first one will notify
+    def update(self, txid, order_info):
+        status = order_info["status"]
+
+        # Order was canceled or expired - stop monitoring
+        if status in ("canceled", "expired"):
+            if self.remove(txid):
+                logger.debug("Stopped monitoring order " + txid + " (" + status + ")")
+
+        # Trade was executed - stop monitoring and notify
+        elif status == "closed":
+            if self.remove(txid):
+                self._on_closed(txid, order_info)
@@ -0,0 +1,142 @@
+import os
+import mmap
+import time
+import struct
+import threading
+from file_logger import logger
+
+# One sample: time in seconds since the epoch and last trade price (both doubles)
+_record = struct.Struct("<dd")
+RECORD_SIZE = _record.size
+
+
+# Prices of pairs over time, stored on disk in one file per pair. A file is a
+# sequence of fixed-width records that are only ever appended, in time order.
+# Reading a time range maps the file into memory and finds the first record
+# with a binary search, so only the records in the range are unpacked
+class PriceHistory:
+    def __init__(self, directory="history"):
+        self.directory = directory
+        self._lock = threading.Lock()
+
+        # Time of the last sample per pair (samples need to be in time order)
+        self._last = dict()
+
+    def _path(self, pair):
+        return os.path.join(self.directory, pair + ".bin")
+
+    # Append a sample for every pair. 'prices' has the pair name as key and the
+    # price as value. Samples that are not newer than the last one are skipped
+    def record(self, prices, timestamp=None):
+        with self._lock:
+            timestamp = timestamp if timestamp else time.time()
+            os.makedirs(self.directory, exist_ok=True)
+
+            for pair, price in prices.items():
+                if timestamp <= self._last_time(pair):
+                    continue
+
+                try:
+                    with open(self._path(pair), "ab") as file:
+                        file.write(_record.pack(timestamp, price))
+                except OSError as ex:
+                    logger.error("Price history of '" + pair + "' not saved: " + str(ex))
+                    # Part of the record might have been written - repair file before next append
+                    self._last.pop(pair, None)
+                    continue
+
+                self._last[pair] = timestamp
+
+    # Time of the last sample of a pair (read from the file once)
+    def _last_time(self, pair):
+        if pair not in self._last:
+            self._truncate(pair)
+            last = self.last(pair)
+            self._last[pair] = last[0] if last else 0
+
+        return self._last[pair]
+
+    # Cut off a record that is not complete (an interrupted write) at the end of
+    # the file. Otherwise all records appended after it would be out of alignment
+    def _truncate(self, pair):
+        path = self._path(pair)
+
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return
+
+        if size % RECORD_SIZE:
+            logger.warning("Price history of '" + pair + "': removed incomplete record")
+            with open(path, "r+b") as file:
+                file.truncate(size // RECORD_SIZE * RECORD_SIZE)
+
+    # Return list of (time, price) for all samples of a pair between 'start' and 'end'
+    def range(self, pair, start=0, end=None):
+        with _Samples(self._path(pair)) as samples:
+            first = samples.bisect(start)
+            stop = samples.bisect(end) if end is not None else len(samples)
+
+            return [samples[i] for i in range(first, stop)]
+
+    # Return last sample of a pair as (time, price) or None if there is none
+    def last(self, pair):
+        with _Samples(self._path(pair)) as samples:
+            return samples[len(samples) - 1] if len(samples) else None
+
+    # Return list of all pairs with samples
+    def pairs(self):
+        if not os.path.isdir(self.directory):
+            return list()
+
+        return sorted(name[:-4] for name in os.listdir(self.directory) if name.endswith(".bin"))
+
+
+# Read-only view of the samples in one file. A record that is not complete
+# (still being written) at the end of the file is ignored
+class _Samples:
+    def __init__(self, path):
+        self._path = path
+        self._file = None
+        self._map = None
+        self._count = 0
+
+    def __enter__(self):
+        try:
+            self._file = open(self._path, "rb")
+        except FileNotFoundError:
+            return self
+
+        size = os.fstat(self._file.fileno()).st_size
+        self._count = size // RECORD_SIZE
+
+        # Empty files can't be mapped
+        if self._count:
+            self._map = mmap.mmap(self._file.fileno(), self._count * RECORD_SIZE, access=mmap.ACCESS_READ)
+
+        return self
+
+    def __exit__(self, *args):
+        if self._map:
+            self._map.close()
+        if self._file:
+            self._file.close()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return _record.unpack_from(self._map, i * RECORD_SIZE)
+
+    # Return index of the first sample with a time >= 'timestamp'
+    def bisect(self, timestamp):
+        low, high = 0, self._count
+
+        while low < high:
+            middle = (low + high) // 2
+            if _record.unpack_from(self._map, middle * RECORD_SIZE)[0] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
@@ -0,0 +1,155 @@
+import io
+import time
+import asyncio
+import pstats
+import cProfile
+import threading
+from file_logger import logger
+
+
+# Profiles handlers with cProfile for a limited time or number of updates and
+# creates a report with the functions that took the most time and the durations
+# of handlers and requests (from metrics). If not active, it's not used at all
+class Profiler:
+    def __init__(self, on_report, histograms=None, top=30):
+        # Function that gets the finished report as string
+        self._on_report = on_report
+        # Histograms of durations to include in the report, with title as key
+        self._histograms = histograms if histograms else dict()
+        self._top = top
+
+        self.active = False
+
+        self._stats = None
+        self._start = None
+        self._start_values = dict()
+        self._updates = 0
+        self._max_updates = None
+        self._skipped = 0
+        self._coroutines = 0
+        self._timer = None
+
+        self._lock = threading.Lock()
+        # Only one profile at a time. Handlers that run concurrently are not profiled
+        self._profile_lock = threading.Lock()
+
+    # Start profiling for the given number of seconds or updates (whatever comes
+    # first). Return FALSE if profiling is already active
+    def start(self, seconds=None, updates=None):
+        with self._lock:
+            if self.active:
+                return False
+
+            self._stats = None
+            self._start = time.monotonic()
+            self._start_values = {title: h.values() for title, h in self._histograms.items()}
+            self._updates = 0
+            self._max_updates = updates
+            self._skipped = 0
+            self._coroutines = 0
+
+            if seconds:
+                self._timer = threading.Timer(seconds, self.stop)
+                self._timer.daemon = True
+                self._timer.start()
+
+            self.active = True
+
+        logger.info("Profiling started (seconds: %s, updates: %s)" % (seconds, updates))
+        return True
+
+    # Stop profiling and pass the report to the report function
+    def stop(self):
+        with self._lock:
+            if not self.active:
+                return
+
+            self.active = False
+
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+            report = self._report()
+
+        logger.info("Profiling stopped")
+
+        try:
+            self._on_report(report)
+        except Exception as ex:
+            logger.error("Not possible to send profiling report: " + str(ex))
+
+    # Call 'callback' and profile it
+    def run(self, callback, *args, **kwargs):
+        if not self._profile_lock.acquire(blocking=False):
+            with self._lock:
+                self._skipped += 1
+            return callback(*args, **kwargs)
+
+        profile = cProfile.Profile()
+        result = None
+        try:
+            result = profile.runcall(callback, *args, **kwargs)
+            return result
+        finally:
+            self._profile_lock.release()
+
+            with self._lock:
+                # Handler returned a coroutine (asyncio mode). It runs later on the event
+                # loop, together with other coroutines, so it's not profiled at all
+                if asyncio.iscoroutine(result):
+                    self._coroutines += 1
+                else:
+                    if self.active:
+                        if self._stats is None:
+                            self._stats = pstats.Stats(profile)
+                        else:
+                            self._stats.add(profile)
+
+                    self._updates += 1
+
+                done = self.active and self._max_updates and self._updates >= self._max_updates
+
+            if done:
+                self.stop()
+
+    # Create text report. Needs to be called with lock
+    def _report(self):
+        out = io.StringIO()
+
+        out.write("Profiling report\n")
+        out.write("Duration: %.1f seconds\n" % (time.monotonic() - self._start))
+        out.write("Profiled updates: %d (not profiled because of concurrent updates: %d)\n" %
+                  (self._updates, self._skipped))
+        out.write("Not profiled because they run on the event loop (asyncio mode): %d\n\n" % self._coroutines)
+
+        # Durations while profiling was active, slowest first
+        for title, histogram in self._histograms.items():
+            start_values = self._start_values.get(title, dict())
+
+            rows = list()
+            for label_values, (total, count) in histogram.values().items():
+                start_total, start_count = start_values.get(label_values, (0.0, 0))
+                if count > start_count:
+                    total -= start_total
+                    count -= start_count
+                    rows.append((total, count, " ".join(label_values)))
+
+            out.write(title + "\n")
+            out.write("%-40s %8s %12s %12s\n" % ("NAME", "CALLS", "TOTAL ms", "AVG ms"))
+            for total, count, name in sorted(rows, reverse=True)[:self._top]:
+                out.write("%-40s %8d %12.1f %12.1f\n" % (name, count, total * 1000, total / count * 1000))
+            out.write("\n")
+
+        if self._stats:
+            self._stats.stream = out
+
+            out.write("Top %d functions by cumulative time\n" % self._top)
+            self._stats.sort_stats("cumulative").print_stats(self._top)
+
+            out.write("Top %d functions by own time\n" % self._top)
+            self._stats.sort_stats("tottime").print_stats(self._top)
+        else:
+            out.write("No update was profiled\n")
+
+        return out.getvalue()
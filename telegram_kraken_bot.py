@@ -1,20 +1,37 @@
 #!/usr/bin/python3
 
+import io
 import json
 import os
 import sys
 import time
+import logging
+import functools
+import asyncio
 import threading
+import collections
 import requests
 import kraken_api
 import re
 
 from enum import Enum, auto
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from telegram import KeyboardButton, ReplyKeyboardMarkup, ReplyKeyboardRemove, ParseMode
 from telegram.ext import Updater, CommandHandler, ConversationHandler, RegexHandler, MessageHandler
 from telegram.ext.filters import Filters
+from telegram.utils.promise import Promise
 from utils import *
 from file_logger import logger
+from order_store import OrderStore
+from order_watcher import OrderWatcher
+from order_feed import OrderFeed
+from accounts import AccountRegistry
+from event_loop import EventLoopThread
+from async_kraken import AsyncKraken
+from profiler import Profiler
+from price_history import PriceHistory
+import valuation
+import metrics
 
 # Check if file 'config.json' exists. Exit if not.
 if os.path.isfile("config.json"):
@@ -25,25 +42,81 @@ else:
     exit("No configuration file 'config.json' found")
 
 # Set up logging
-logger.init(config["log_level"], config["log_to_file"])
+logger.init(config["log_level"],
+            config["log_to_file"],
+            config["log_async"],
+            config["log_queue_size"],
+            config["log_queue_overflow"],
+            config["log_max_size"] * 1024 * 1024,
+            config["log_compress"],
+            config["log_keep_files"],
+            config["log_keep_days"],
+            config["log_format"])
 
 # Set bot token, get dispatcher and job queue
 updater = Updater(token=config["bot_token"])
 dispatcher = updater.dispatcher
 job_queue = updater.job_queue
 
-# Connect to kraken
-kraken = kraken_api.Kraken("kraken.key", config["retries"])
+# Set up connection pool for requests to websites (order limits, API state)
+kraken_api.http_pool.init(config["http_pool_size"], config["http_connect_timeout"], config["http_read_timeout"])
+
+# Retry failed Kraken requests with exponential backoff
+retry_policy = kraken_api.RetryPolicy(config["retries"],
+                                      config["retry_delay"],
+                                      config["retry_max_delay"],
+                                      config["retry_deadline"])
+
+# Connect to kraken. Every account has its own client with own key file, nonces,
+# rate limiter, cache and connection pool. The first account is used for trading
+accounts = AccountRegistry(config["bulk_workers"])
+for account_name, key_file in config["accounts"].items():
+    accounts.add(account_name, kraken_api.Kraken(key_file,
+                                                 retry_policy,
+                                                 config["api_tier"],
+                                                 config["trace_requests"] or config["log_format"] == "json",
+                                                 kraken_api.HttpPool(config["http_pool_size"],
+                                                                     config["http_connect_timeout"],
+                                                                     config["http_read_timeout"]),
+                                                 cache_ttls=config["cache_ttls"],
+                                                 bulk_workers=config["bulk_workers"]))
+
+# Client of the primary account
+kraken = accounts.get(accounts.primary)
+
+# Asyncio mode: handlers that wait for Kraken and the order state check run as
+# coroutines on one event loop instead of blocking threads (see 'start_async_mode')
+async_mode = False
+event_loop = EventLoopThread(config["async_telegram_workers"])
+async_accounts = AccountRegistry()
+for account_name, client in accounts.items():
+    async_accounts.add(account_name, AsyncKraken(client,
+                                                 config["http_pool_size"],
+                                                 config["http_connect_timeout"],
+                                                 config["http_read_timeout"],
+                                                 config["bulk_workers"]))
+async_kraken = async_accounts.get(async_accounts.primary)
 
 # Cached objects
-# All open orders
-orders = list()
+# All open orders of all accounts (kept current with every 'OpenOrders' request)
+order_store = OrderStore()
+# Account name of open orders by TXID
+order_accounts = dict()
 # All assets with internal long name & external short name
 assets = dict()
 # All assets from config with their trading pair
 pairs = dict()
 # Minimum order limits for assets
 limits = dict()
+# Sampled prices of all pairs in 'used_pairs'
+price_history = PriceHistory(config["history_dir"])
+# Number of prices that '/history' shows for a single coin
+history_points = 10
+
+# File with a snapshot of assets, pairs and limits for fast startup
+snapshot_file = "snapshot.json"
+# Version of the snapshot format. Snapshots with other versions will be ignored
+snapshot_version = 2
 
 
 class TradeState(Enum):
@@ -97,6 +170,7 @@ class KeyboardEnum(Enum):
 
 # Decorator to restrict access if user is not the same as in config
 def restrict_access(func):
+    @functools.wraps(func)
     def _restrict_access(bot, update):
         chat_id = get_chat_id(update)
         if str(chat_id) != config["user_id"]:
@@ -120,13 +194,77 @@ def restrict_access(func):
 def balance_cmd(bot, update):
     update.message.reply_text(emo_wa + " Retrieving balance...")
 
-    msg = get_api_result(kraken.balance(), update)
+    # Balances of all accounts at once
+    msg = balances_msg(accounts.fan_out(lambda name, client: client.balance()), update)
     if not msg:
         return
 
     update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
 
 
+# Return one message with the balances of all accounts. 'results' has the account
+# name as key and the result of 'Kraken.balance' as value. Errors are shown
+def balances_msg(results, update):
+    msg = str()
+
+    for name, result in results.items():
+        balance = get_api_result(result, update, account_prefix(name))
+        if not balance:
+            continue
+
+        if len(accounts) > 1:
+            msg += bold("[" + name + "]") + "\n"
+        msg += balance
+
+    return msg
+
+
+# Return prefix for messages about an account (nothing if there is only one)
+def account_prefix(name):
+    return name + ": " if len(accounts) > 1 else ""
+
+
+# Return client of the account that an order belongs to
+def account_of(txid):
+    return order_accounts.get(txid, accounts.primary)
+
+
+# Update order store with the open orders of some accounts. 'open_orders' has the
+# account name as key and the open orders from 'OpenOrders' as value. Orders of
+# accounts that are not in 'open_orders' (not requested or failed) are kept
+def sync_orders(open_orders):
+    global order_accounts
+
+    all_orders = dict()
+    for orders in open_orders.values():
+        all_orders.update(orders)
+
+    kept = {txid: name for txid, name in order_accounts.items() if name not in open_orders}
+
+    order_accounts = dict(kept)
+    order_accounts.update({txid: name for name, orders in open_orders.items() for txid in orders})
+    order_store.sync(all_orders, kraken.index, keep=kept)
+
+
+# Return open orders of all accounts from the responses of 'OpenOrders' ('results'
+# has the account name as key). Errors are shown. Accounts with errors are skipped
+def open_orders_of(results, update):
+    open_orders = collections.OrderedDict()
+
+    for name, res_data in results.items():
+        if not handle_api_error(res_data, update, account_prefix(name)):
+            open_orders[name] = res_data["result"]["open"]
+
+    return open_orders
+
+
+# Stop monitoring an order and remove it from the order store
+def forget_order(txid):
+    for watcher in order_watchers.values():
+        watcher.remove(txid)
+    order_store.remove(txid)
+
+
 # Create orders to buy or sell currencies with price limit - choose 'buy' or 'sell'
 @restrict_access
 def trade_cmd(bot, update):
@@ -173,64 +311,36 @@ def trade_sell_all(bot, update):
     return WorkflowEnum.TRADE_SELL_ALL_CONFIRM
 
 
-# Sells all assets for there respective current market value
-def trade_sell_all_confirm(bot, update):
-    if update.message.text.upper() == KeyboardEnum.NO.clean():
-        return cancel(bot, update)
-
-    update.message.reply_text(emo_wa + " Preparing to sell everything...")
-
-    # Send request for open orders to Kraken
-    res_open_orders = kraken.query("OpenOrders", private=True)
-
-    # If Kraken replied with an error, show it
-    if handle_api_error(res_open_orders, update):
-        return
-
-    # Close all currently open orders
-    if res_open_orders["result"]["open"]:
-        for order in res_open_orders["result"]["open"]:
-            req_data = dict()
-            req_data["txid"] = order
-
-            # Send request to Kraken to cancel orders
-            res_open_orders = kraken.query("CancelOrder", data=req_data, private=True)
-
-            # If Kraken replied with an error, show it
-            if handle_api_error(res_open_orders, update, "Not possible to close order\n" + order + "\n"):
-                return
-
-    # Send request to Kraken to get current balance of all assets
-    res_balance = kraken.query("Balance", private=True)
+# Create market sell orders (request data) for all assets in the balance.
+# Return list of (asset, request data) and list of skipped assets (with reason)
+def prepare_sell_orders(balance):
+    sell_orders = list()
+    skipped = list()
 
-    # If Kraken replied with an error, show it
-    if handle_api_error(res_balance, update):
-        return
-
-    # Go over all assets and sell them
-    for balance_asset, amount in res_balance["result"].items():
+    for balance_asset, amount in balance.items():
         # Asset is fiat-currency and not crypto-currency - skip it
         if balance_asset.startswith("Z"):
             continue
 
         # Filter out 0 volume currencies
-        if amount == "0.0000000000":
+        if float(amount) == 0:
             continue
 
         # Get clean asset name
         balance_asset = assets[balance_asset]["altname"]
 
+        if balance_asset not in pairs:
+            skipped.append(balance_asset + ": no trading pair configured")
+            continue
+
         # Make sure that the order size is at least the minimum order limit
         if balance_asset in limits:
             if float(amount) < float(limits[balance_asset]):
-                msg_error = emo_er + " Volume to low. Must be > " + limits[balance_asset]
-                msg_next = emo_wa + " Selling next asset..."
-
-                update.message.reply_text(msg_error + "\n" + msg_next)
-                logger.warning(msg_error)
+                skipped.append(balance_asset + ": volume to low. Must be > " + limits[balance_asset])
                 continue
         else:
             logger.warning("No minimum order limit in config for coin " + balance_asset)
+            skipped.append(balance_asset + ": no minimum order limit")
             continue
 
         req_data = dict()
@@ -240,23 +350,77 @@ def trade_sell_all_confirm(bot, update):
         req_data["ordertype"] = "market"
         req_data["volume"] = amount
 
-        # Send request to create order to Kraken
-        res_add_order = kraken.query("AddOrder", data=req_data, private=True)
+        sell_orders.append((balance_asset, req_data))
 
-        # If Kraken replied with an error, show it
-        if handle_api_error(res_add_order, update):
+    return sell_orders, skipped
+
+
+# Sells all assets for there respective current market value
+def trade_sell_all_confirm(bot, update):
+    if update.message.text.upper() == KeyboardEnum.NO.clean():
+        return cancel(bot, update)
+
+    update.message.reply_text(emo_wa + " Preparing to sell everything...")
+
+    start = time.monotonic()
+
+    # Send request for open orders to Kraken
+    res_open_orders = kraken.query("OpenOrders", private=True)
+
+    # If Kraken replied with an error, show it
+    if handle_api_error(res_open_orders, update):
+        return
+
+    sync_orders({accounts.primary: res_open_orders["result"]["open"]})
+
+    # Close all currently open orders
+    if res_open_orders["result"]["open"]:
+        txids = list(res_open_orders["result"]["open"])
+        closed, failed, _ = close_orders(txids, cancel_all=True)
+
+        # Assets can't be sold if orders are still open
+        if failed:
+            msg = emo_er + " Not possible to close orders:\n" + "\n".join(failed)
+            update.message.reply_text(msg, reply_markup=keyboard_cmds())
+            logger.error(msg)
+            return
+
+    # Send request to Kraken to get current balance of all assets
+    res_balance = kraken.query("Balance", private=True)
+
+    # If Kraken replied with an error, show it
+    if handle_api_error(res_balance, update):
+        return
+
+    # Prepare all orders first, then create them concurrently
+    sell_orders, failed = prepare_sell_orders(res_balance["result"])
+    responses = kraken.bulk_query("AddOrder", [req_data for _, req_data in sell_orders], private=True)
+
+    created = list()
+    for (balance_asset, req_data), res_add_order in zip(sell_orders, responses):
+        if res_add_order["error"]:
+            failed.append(balance_asset + ": " + res_add_order["error"][0])
             continue
 
         order_txid = res_add_order["result"]["txid"][0]
+        created.append(balance_asset + ": " + order_txid)
 
-        # Add Job to JobQueue to check status of created order (if setting is enabled)
+        # Monitor status of created order (if setting is enabled)
         if config["check_trade"]:
-            trade_time = config["check_trade_time"]
-            context = dict(order_txid=order_txid)
-            job_queue.run_repeating(order_state_check, trade_time, context=context)
+            order_watcher.add(order_txid)
 
-    msg = emo_fi + " Created orders to sell all assets"
-    update.message.reply_text(bold(msg), reply_markup=keyboard_cmds(), parse_mode=ParseMode.MARKDOWN)
+    duration = time.monotonic() - start
+    logger.info("Selling all assets took %.2f seconds" % duration)
+
+    # One report for all assets
+    msg = emo_fi + bold(" Created orders to sell all assets (%.1f s)" % duration)
+    if created:
+        msg += "\n" + bold("\n".join(created))
+    if failed:
+        msg += "\n" + emo_er + bold(" Not sold:\n" + "\n".join(failed))
+        logger.warning("Assets not sold: " + ", ".join(failed))
+
+    update.message.reply_text(msg, reply_markup=keyboard_cmds(), parse_mode=ParseMode.MARKDOWN)
 
     return ConversationHandler.END
 
@@ -361,37 +525,15 @@ def trade_vol_volume(bot, update, chat_data):
 def trade_vol_all(bot, update, chat_data):
     update.message.reply_text(emo_wa + " Calculating volume...")
 
-    # Send request to Kraken to get current balance of all currencies
-    res_balance = kraken.query("Balance", private=True)
-
-    # If Kraken replied with an error, show it
-    if handle_api_error(res_balance, update):
-        return
-
-    # Send request to Kraken to get open orders
-    res_orders = kraken.query("OpenOrders", private=True)
-
-    # If Kraken replied with an error, show it
-    if handle_api_error(res_orders, update):
+    # Get balance of all assets minus volume that is locked in open orders
+    balance = get_api_result(kraken.available_balance(), update)
+    if not balance:
         return
 
     # BUY -----------------
     if chat_data["buysell"].upper() == KeyboardEnum.BUY.clean():
         # Get amount of available currency to buy from
-        avail_buy_from_cur = float(res_balance["result"][chat_data["two"]])
-
-        # Go through all open orders and check if buy-orders exist
-        # If yes, subtract their value from the total of currency to buy from
-        if res_orders["result"]["open"]:
-            for order in res_orders["result"]["open"]:
-                order_desc = res_orders["result"]["open"][order]["descr"]["order"]
-                order_desc_list = order_desc.split(" ")
-                coin_price = trim_zeros(order_desc_list[5])
-                order_volume = order_desc_list[1]
-                order_type = order_desc_list[0]
-
-                if order_type == "buy":
-                    avail_buy_from_cur = float(avail_buy_from_cur) - (float(order_volume) * float(coin_price))
+        avail_buy_from_cur = balance.available(chat_data["two"])
 
         # Calculate volume depending on available trade-to balance and round it to 8 digits
         chat_data["volume"] = "{0:.8f}".format(avail_buy_from_cur / float(chat_data["price"]))
@@ -406,28 +548,7 @@ def trade_vol_all(bot, update, chat_data):
 
     # SELL -----------------
     if chat_data["buysell"].upper() == KeyboardEnum.SELL.clean():
-        available_volume = res_balance["result"][chat_data["one"]]
-
-        # Go through all open orders and check if sell-orders exists for the currency
-        # If yes, subtract their volume from the available volume
-        if res_orders["result"]["open"]:
-            for order in res_orders["result"]["open"]:
-                order_desc = res_orders["result"]["open"][order]["descr"]["order"]
-                order_desc_list = order_desc.split(" ")
-
-                # Get the currency of the order
-                for asset, data in assets.items():
-                    if order_desc_list[2].endswith(data["altname"]):
-                        order_currency = order_desc_list[2][:-len(data["altname"])]
-                        break
-
-                order_volume = order_desc_list[1]
-                order_type = order_desc_list[0]
-
-                # Check if currency from oder is the same as currency to sell
-                if chat_data["currency"] in order_currency:
-                    if order_type == "sell":
-                        available_volume = str(float(available_volume) - float(order_volume))
+        available_volume = balance.available(chat_data["one"])
 
         # Get volume from balance and round it to 8 digits
         chat_data["volume"] = "{0:.8f}".format(float(available_volume))
@@ -512,6 +633,8 @@ def trade_show_conf(update, chat_data):
             return
 
         chat_data["price"] = res_data["result"][pairs[chat_data["currency"]]]["c"][0]
+        if config["history_enabled"]:
+            price_history.record(valuation.parse_prices(res_data["result"]))
 
         trade_str = (chat_data["buysell"].lower() + " " +
                      trim_zeros(chat_data["volume"]) + " " +
@@ -551,23 +674,8 @@ def trade_confirm(bot, update, chat_data):
 
     update.message.reply_text(emo_wa + " Placing order...")
 
-    req_data = dict()
-
-    # Order type MARKET
-    if chat_data["market_price"]:
-        req_data["ordertype"] = "market"
-        req_data["trading_agreement"] = "agree"
-    # Order type LIMIT
-    else:
-        req_data["ordertype"] = "limit"
-        req_data["price"] = chat_data["price"]
-
-    req_data["type"] = chat_data["buysell"].lower()
-    req_data["volume"] = chat_data["volume"]
-    req_data["pair"] = pairs[chat_data["currency"]]
-
     # Send request to create order to Kraken
-    res_add_order = kraken.query("AddOrder", req_data, private=True)
+    res_add_order = kraken.query("AddOrder", trade_request(chat_data), private=True)
 
     # If Kraken replied with an error, show it
     if handle_api_error(res_add_order, update):
@@ -587,18 +695,7 @@ def trade_confirm(bot, update, chat_data):
         if handle_api_error(res_query_order, update):
             return
 
-        if res_query_order["result"][order_txid]:
-            order_desc = res_query_order["result"][order_txid]["descr"]["order"]
-            msg = emo_fi + " Order placed:\n" + order_txid + "\n" + trim_zeros(order_desc)
-            update.message.reply_text(bold(msg), reply_markup=keyboard_cmds(), parse_mode=ParseMode.MARKDOWN)
-
-            # Add Job to JobQueue to check status of created order (if enabled)
-            if config["check_trade"]:
-                trade_time = config["check_trade_time"]
-                context = dict(order_txid=order_txid)
-                job_queue.run_repeating(order_state_check, trade_time, context=context)
-        else:
-            update.message.reply_text("No order with TXID " + order_txid)
+        show_placed_order(update, order_txid, res_query_order)
 
     else:
         update.message.reply_text("Undefined state: no error and no TXID")
@@ -607,31 +704,68 @@ def trade_confirm(bot, update, chat_data):
     return ConversationHandler.END
 
 
+# Return request data for 'AddOrder' from the trade that the user entered
+def trade_request(chat_data):
+    req_data = dict()
+
+    # Order type MARKET
+    if chat_data["market_price"]:
+        req_data["ordertype"] = "market"
+        req_data["trading_agreement"] = "agree"
+    # Order type LIMIT
+    else:
+        req_data["ordertype"] = "limit"
+        req_data["price"] = chat_data["price"]
+
+    req_data["type"] = chat_data["buysell"].lower()
+    req_data["volume"] = chat_data["volume"]
+    req_data["pair"] = pairs[chat_data["currency"]]
+
+    return req_data
+
+
+# Show placed order and monitor it
+def show_placed_order(update, order_txid, res_query_order):
+    if res_query_order["result"][order_txid]:
+        order_desc = res_query_order["result"][order_txid]["descr"]["order"]
+        msg = emo_fi + " Order placed:\n" + order_txid + "\n" + trim_zeros(order_desc)
+        update.message.reply_text(bold(msg), reply_markup=keyboard_cmds(), parse_mode=ParseMode.MARKDOWN)
+
+        # Monitor status of created order (if enabled)
+        if config["check_trade"]:
+            order_watcher.add(order_txid)
+    else:
+        update.message.reply_text("No order with TXID " + order_txid)
+
+
 # Show and manage orders
 @restrict_access
 def orders_cmd(bot, update):
     update.message.reply_text(emo_wa + " Retrieving orders...")
 
-    # Send request to Kraken to get open orders
-    res_data = kraken.query("OpenOrders", private=True)
+    # Send requests to Kraken to get open orders of all accounts
+    results = accounts.fan_out(lambda name, client: client.query("OpenOrders", private=True))
 
     # If Kraken replied with an error, show it
-    if handle_api_error(res_data, update):
+    open_orders = open_orders_of(results, update)
+    if not open_orders:
         return
 
-    # Reset global orders list
-    global orders
-    orders = list()
+    # Update order store so that orders can be used later
+    # without requesting data from Kraken again
+    sync_orders(open_orders)
+
+    return show_orders(update)
+
 
+# Show all orders of the order store and what can be done with them
+def show_orders(update):
     # Go through all open orders and show them to the user
-    if res_data["result"]["open"]:
-        for order_id, order_details in res_data["result"]["open"].items():
-            # Add order to global order list so that it can be used later
-            # without requesting data from Kraken again
-            orders.append({order_id: order_details})
-
-            order_desc = trim_zeros(order_details["descr"]["order"])
-            update.message.reply_text(bold(order_id + "\n" + order_desc), parse_mode=ParseMode.MARKDOWN)
+    if len(order_store):
+        for order in order_store.all():
+            order_desc = trim_zeros(order.description)
+            msg = account_prefix(account_of(order.txid)) + order.txid + "\n" + order_desc
+            update.message.reply_text(bold(msg), parse_mode=ParseMode.MARKDOWN)
     else:
         update.message.reply_text(bold("No open orders"), parse_mode=ParseMode.MARKDOWN)
         return ConversationHandler.END
@@ -659,10 +793,9 @@ def orders_choose_order(bot, update):
     buttons = list()
 
     # Go through all open orders and create a button
-    if orders:
-        for order in orders:
-            order_id = next(iter(order), None)
-            buttons.append(KeyboardButton(order_id))
+    if len(order_store):
+        for order in order_store.all():
+            buttons.append(KeyboardButton(order.txid))
     else:
         update.message.reply_text("No open orders")
         return ConversationHandler.END
@@ -680,38 +813,96 @@ def orders_choose_order(bot, update):
     return WorkflowEnum.ORDERS_CLOSE_ORDER
 
 
+# Cancel orders concurrently (all accounts at once) and stop monitoring them. Return
+# list of closed TXIDs, list of not closed TXIDs (with error) and number of closed
+# orders that were not known. If 'cancel_all' is TRUE, the given orders are all
+# known open orders of their accounts and all open orders will be closed
+def close_orders(txids, cancel_all=False):
+    txids_by_account = orders_by_account(txids)
+
+    def cancel(name, client):
+        if name not in txids_by_account:
+            return dict(), 0
+        return client.cancel_orders(txids_by_account[name], cancel_all)
+
+    return merge_cancel_results(accounts.fan_out(cancel).values())
+
+
+# Merge results of 'cancel_orders' of all accounts and stop monitoring cancelled orders.
+# Return list of closed TXIDs, list of not closed TXIDs and number of other closed orders
+def merge_cancel_results(account_results):
+    results = dict()
+    others = 0
+
+    for txid_results, others_nr in account_results:
+        results.update(txid_results)
+        others += others_nr
+
+    closed_orders, failed_orders = forget_closed_orders(results)
+    return closed_orders, failed_orders, others
+
+
+# Return dictionary with account name as key and list of TXIDs as value
+def orders_by_account(txids):
+    txids_by_account = dict()
+    for txid in txids:
+        txids_by_account.setdefault(account_of(txid), list()).append(txid)
+    return txids_by_account
+
+
+# Stop monitoring cancelled orders. 'results' has the TXID as key and the error
+# (or None if cancelled) as value. Return list of closed TXIDs and list of not
+# closed TXIDs (with error)
+def forget_closed_orders(results):
+    closed_orders = list()
+    failed_orders = list()
+
+    for txid, error in results.items():
+        if error:
+            failed_orders.append(txid + ": " + error)
+        else:
+            closed_orders.append(txid)
+            forget_order(txid)
+
+    return closed_orders, failed_orders
+
+
 # Close all open orders
 def orders_close_all(bot, update):
     update.message.reply_text(emo_wa + " Closing orders...")
 
-    closed_orders = list()
+    txids = [order.txid for order in order_store.all()]
+    if txids:
+        closed_orders, failed_orders, others = close_orders(txids, cancel_all=True)
+    else:
+        closed_orders, failed_orders, others = list(), list(), 0
 
-    if orders:
-        for x in range(0, len(orders)):
-            order_id = next(iter(orders[x]), None)
+    return show_closed_orders(update, closed_orders, failed_orders, others)
 
-            # Send request to Kraken to cancel orders
-            res_data = kraken.query("CancelOrder", data={"txid": order_id}, private=True)
 
-            # If Kraken replied with an error, show it
-            if handle_api_error(res_data, update, "Order not closed:\n" + order_id + "\n"):
-                # If we are currently not closing the last order,
-                # show message that we a continuing with the next one
-                if x+1 != len(orders):
-                    update.message.reply_text(emo_wa + " Closing next order...")
-            else:
-                closed_orders.append(order_id)
+# Show which orders were closed and which not. 'others' is the number of closed
+# orders that were placed since the last '/orders'. Return next state of the conversation
+def show_closed_orders(update, closed_orders, failed_orders, others=0):
+    if others:
+        closed_orders = closed_orders + ["%d more order(s), placed since the last /orders" % others]
 
-        if closed_orders:
-            msg = bold(" Orders closed:\n" + "\n".join(closed_orders))
-            update.message.reply_text(emo_fi + msg, reply_markup=keyboard_cmds(), parse_mode=ParseMode.MARKDOWN)
-        else:
-            msg = bold("No orders closed")
-            update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
-            return
-    else:
+    if not closed_orders and not failed_orders:
         msg = bold("No open orders")
         update.message.reply_text(msg, reply_markup=keyboard_cmds(), parse_mode=ParseMode.MARKDOWN)
+        return ConversationHandler.END
+
+    msg = str()
+    if closed_orders:
+        msg += emo_fi + bold(" Orders closed:\n" + "\n".join(closed_orders)) + "\n"
+    if failed_orders:
+        msg += emo_er + bold(" Orders not closed:\n" + "\n".join(failed_orders))
+        logger.error("Orders not closed: " + ", ".join(failed_orders))
+
+    if closed_orders:
+        update.message.reply_text(msg, reply_markup=keyboard_cmds(), parse_mode=ParseMode.MARKDOWN)
+    else:
+        update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+        return
 
     return ConversationHandler.END
 
@@ -724,17 +915,145 @@ def orders_close_order(bot, update):
     req_data["txid"] = update.message.text
 
     # Send request to Kraken to cancel order
-    res_data = kraken.query("CancelOrder", data=req_data, private=True)
+    client = accounts.get(account_of(req_data["txid"]))
+    res_data = client.query("CancelOrder", data=req_data, private=True)
 
     # If Kraken replied with an error, show it
     if handle_api_error(res_data, update):
         return
 
-    msg = emo_fi + " " + bold("Order closed:\n" + req_data["txid"])
+    return show_closed_order(update, req_data["txid"])
+
+
+# Stop monitoring the closed order and show it. Return next state of the conversation
+def show_closed_order(update, txid):
+    # Closed order doesn't need to be monitored anymore
+    forget_order(txid)
+
+    msg = emo_fi + " " + bold("Order closed:\n" + txid)
     update.message.reply_text(msg, reply_markup=keyboard_cmds(), parse_mode=ParseMode.MARKDOWN)
     return ConversationHandler.END
 
 
+# Call blocking function (requests to Telegram) from a coroutine without blocking the event loop
+def blocking(function, *args, **kwargs):
+    return event_loop.run_blocking(function, *args, **kwargs)
+
+
+# Get balance of all currencies (asyncio mode)
+@restrict_access
+async def balance_cmd_async(bot, update):
+    await blocking(update.message.reply_text, emo_wa + " Retrieving balance...")
+
+    results = await async_accounts.fan_out_async(lambda name, client: client.balance())
+
+    msg = await blocking(balances_msg, results, update)
+    if not msg:
+        return
+
+    await blocking(update.message.reply_text, msg, parse_mode=ParseMode.MARKDOWN)
+
+
+# Show and manage orders (asyncio mode)
+@restrict_access
+async def orders_cmd_async(bot, update):
+    await blocking(update.message.reply_text, emo_wa + " Retrieving orders...")
+
+    # Send requests to Kraken to get open orders of all accounts
+    results = await async_accounts.fan_out_async(lambda name, client: client.query("OpenOrders", private=True))
+
+    # If Kraken replied with an error, show it
+    open_orders = await blocking(open_orders_of, results, update)
+    if not open_orders:
+        return
+
+    sync_orders(open_orders)
+
+    return await blocking(show_orders, update)
+
+
+# Close all open orders (asyncio mode)
+async def orders_close_all_async(bot, update):
+    await blocking(update.message.reply_text, emo_wa + " Closing orders...")
+
+    txids_by_account = orders_by_account([order.txid for order in order_store.all()])
+
+    async def cancel(name, client):
+        if name not in txids_by_account:
+            return dict(), 0
+        return await client.cancel_orders(txids_by_account[name], cancel_all=True)
+
+    account_results = (await async_accounts.fan_out_async(cancel)).values()
+    closed_orders, failed_orders, others = await blocking(merge_cancel_results, account_results)
+
+    return await blocking(show_closed_orders, update, closed_orders, failed_orders, others)
+
+
+# Close the specified order (asyncio mode)
+async def orders_close_order_async(bot, update):
+    await blocking(update.message.reply_text, emo_wa + " Closing order...")
+
+    # Send request to Kraken to cancel order
+    txid = update.message.text
+    client = async_accounts.get(account_of(txid))
+    res_data = await client.query("CancelOrder", data={"txid": txid}, private=True)
+
+    # If Kraken replied with an error, show it
+    if await blocking(handle_api_error, res_data, update):
+        return
+
+    return await blocking(show_closed_order, update, txid)
+
+
+# The user has to confirm placing the order (asyncio mode)
+async def trade_confirm_async(bot, update, chat_data):
+    if update.message.text.upper() == KeyboardEnum.NO.clean():
+        return await blocking(cancel, bot, update, chat_data=chat_data)
+
+    await blocking(update.message.reply_text, emo_wa + " Placing order...")
+
+    # Send request to create order to Kraken
+    res_add_order = await async_kraken.query("AddOrder", trade_request(chat_data), private=True)
+
+    # If Kraken replied with an error, show it
+    if await blocking(handle_api_error, res_add_order, update):
+        return
+
+    # If there is a transaction id then the order was placed successfully
+    if res_add_order["result"]["txid"]:
+        order_txid = res_add_order["result"]["txid"][0]
+
+        # Send request to get info on specific order
+        res_query_order = await async_kraken.query("QueryOrders", data={"txid": order_txid}, private=True)
+
+        # If Kraken replied with an error, show it
+        if await blocking(handle_api_error, res_query_order, update):
+            return
+
+        await blocking(show_placed_order, update, order_txid, res_query_order)
+
+    else:
+        await blocking(update.message.reply_text, "Undefined state: no error and no TXID")
+
+    clear_chat_data(chat_data)
+    return ConversationHandler.END
+
+
+# Handlers that will be replaced by their coroutines in asyncio mode
+async_handlers = {
+    balance_cmd: balance_cmd_async,
+    orders_cmd: orders_cmd_async,
+    orders_close_all: orders_close_all_async,
+    orders_close_order: orders_close_order_async,
+    trade_confirm: trade_confirm_async
+}
+
+
+# Return the coroutine version of a handler if the bot runs in asyncio mode
+def for_mode(callback):
+    return async_handlers.get(callback, callback) if async_mode else callback
+
+
 # FIXME: Doesn't end the current conversation
 # Reloads keyboard with available commands
 @restrict_access
@@ -744,6 +1063,130 @@ def reload_cmd(bot, update):
     return ConversationHandler.END
 
 
+# Show market value of all assets (of all accounts) in the base currency.
+# With a coin as argument ('/value XBT') only the value of this coin is shown
+@restrict_access
+def value_cmd(bot, update):
+    args = update.message.text.split()[1:]
+    coin = args[0].upper() if args else None
+    base = config["base_currency"]
+
+    update.message.reply_text(emo_wa + " Calculating value...")
+
+    # Balances of all accounts at once, summed up by asset
+    volumes = collections.defaultdict(float)
+    results = accounts.fan_out(lambda name, client: client.query("Balance", private=True))
+
+    for name, res_data in results.items():
+        if handle_api_error(res_data, update, account_prefix(name)):
+            return
+
+        for asset, volume in res_data["result"].items():
+            if float(volume):
+                volumes[kraken.index.altname.get(asset, asset)] += float(volume)
+
+    if coin:
+        volumes = {coin: volumes.get(coin, 0.0)}
+
+    if not volumes:
+        update.message.reply_text("No assets to value")
+        return
+
+    paths = {asset: valuation.price_path(kraken.index, asset, base, config["used_pairs"]) for asset in volumes}
+
+    # Prices of all needed pairs with one request
+    prices = dict()
+    needed_pairs = valuation.path_pairs(paths.values())
+    if needed_pairs:
+        res_data = kraken.query("Ticker", data={"pair": ",".join(needed_pairs)}, private=False)
+
+        if handle_api_error(res_data, update):
+            return
+
+        prices = valuation.parse_prices(res_data["result"])
+        if config["history_enabled"]:
+            price_history.record(prices)
+
+    value = valuation.PortfolioValue(volumes, paths, prices)
+
+    msg = str()
+    for asset, asset_value in sorted(value.values.items()):
+        if asset_value is None:
+            continue
+        msg += asset + ": " + trim_zeros(volumes[asset]) + " = " + trim_zeros(round(asset_value, 2)) + " " + base + "\n"
+
+    if not coin:
+        msg += bold("Total: " + trim_zeros(round(value.total, 2)) + " " + base) + "\n"
+
+    if value.missing:
+        msg += "No price to " + base + " for: " + ", ".join(sorted(value.missing))
+
+    update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+
+
+# Show price history of a coin from the local price history ('/history XBT 6' for
+# the last 6 hours). Without a coin, the price change of all coins is shown
+@restrict_access
+def history_cmd(bot, update):
+    args = update.message.text.split()[1:]
+
+    try:
+        hours = float(args[1]) if len(args) > 1 else 24
+    except ValueError:
+        update.message.reply_text("Usage: /history [coin] [hours]")
+        return
+
+    # Pairs are known after initialization
+    if not pairs:
+        update.message.reply_text("No pairs available. Configure 'used_pairs' and wait for initialization")
+        return
+
+    coins = [args[0].upper()] if args else list(pairs)
+    start = time.time() - hours * 3600
+
+    msg = str()
+    for coin in coins:
+        if coin not in pairs:
+            update.message.reply_text("Coin '" + coin + "' is not configured in 'used_pairs'")
+            return
+
+        to_cur = config["used_pairs"][coin]
+        samples = price_history.range(pairs[coin], start)
+
+        if not samples:
+            msg += coin + ": no prices in the last " + trim_zeros(float(hours)) + " hours\n"
+            continue
+
+        prices = [price for _, price in samples]
+        change = (prices[-1] / prices[0] - 1) * 100 if prices[0] else 0
+
+        msg += bold(coin + ": " + trim_zeros(prices[-1]) + " " + to_cur) + " (%+.2f%%)\n" % change
+        msg += "Low " + trim_zeros(min(prices)) + ", high " + trim_zeros(max(prices)) + "\n"
+
+        # Some evenly spaced samples for a single coin
+        if len(coins) == 1:
+            step = max(1, len(samples) // history_points)
+            for timestamp, price in samples[::step][-history_points:]:
+                msg += time.strftime("%d.%m. %H:%M", time.localtime(timestamp)) + "  " + trim_zeros(price) + "\n"
+
+    update.message.reply_text(msg, parse_mode=ParseMode.MARKDOWN)
+
+
+# Save current prices of all pairs in 'used_pairs' to the price history (one request)
+def price_sample(bot, job):
+    # Pairs are known after initialization
+    if not pairs:
+        return
+
+    res_data = kraken.query("Ticker", data={"pair": ",".join(sorted(pairs.values()))}, private=False)
+
+    if res_data["error"]:
+        logger.warning("Prices not sampled: " + res_data["error"][0])
+        return
+
+    price_history.record(valuation.parse_prices(res_data["result"]))
+
+
 # Get current state of Kraken API
 # Is it under maintenance or functional?
 @restrict_access
@@ -760,6 +1203,137 @@ def state_cmd(bot, update):
     return ConversationHandler.END
 
 
+# Return one line per label of a histogram with number of calls, average
+# duration, estimated 90th percentile and number of errors
+def histogram_lines(histogram, errors):
+    error_counts = dict()
+    for label_values, count in errors.values().items():
+        key = label_values[:-1]
+        error_counts[key] = error_counts.get(key, 0) + int(count)
+
+    lines = list()
+    for label_values, (duration_sum, count) in sorted(histogram.values().items()):
+        p90 = histogram.quantile(0.9, *label_values)
+        lines.append("%s: %d calls, avg %d ms, p90 < %s ms, %d errors" %
+                     (" ".join(label_values),
+                      count,
+                      duration_sum / count * 1000,
+                      "%d" % (p90 * 1000) if p90 != float("inf") else "inf",
+                      error_counts.get(label_values, 0)))
+
+    return lines
+
+
+# Return one line per method with number of cache hits, misses and shared
+# requests of all accounts ('counts' from gauge 'kraken_cache_requests')
+def cache_lines(counts):
+    methods = collections.defaultdict(collections.Counter)
+    for (_, method, result), count in counts.items():
+        methods[method][result] += count
+
+    lines = list()
+    for method, results in sorted(methods.items()):
+        total = results["hits"] + results["misses"] + results["shared"]
+        lines.append("%s: %d hits, %d misses, %d shared (%d%% from cache)" %
+                     (method, results["hits"], results["misses"], results["shared"],
+                      (results["hits"] + results["shared"]) / total * 100 if total else 0))
+
+    return lines
+
+
+# Return one line per host with number of requests and opened connections of
+# all connection pools ('counts' from gauge 'http_pool_requests')
+def pool_lines(counts):
+    hosts = collections.defaultdict(collections.Counter)
+    for (_, host, kind), count in counts.items():
+        hosts[host][kind] += count
+
+    return ["%s: %d requests, %d connections (%d reused)" %
+            (host, kinds["requests"], kinds["connections"], kinds["reused"]) for host, kinds in sorted(hosts.items())]
+
+
+# Show metrics of Kraken requests, handlers, Telegram requests and queues
+@restrict_access
+def stats_cmd(bot, update):
+    request_duration = metrics.registry.get("kraken_request_duration_seconds")
+    request_errors = metrics.registry.get("kraken_request_errors_total")
+    request_retries = metrics.registry.get("kraken_request_retries_total")
+
+    msg = "Kraken requests:\n"
+    msg += "\n".join(histogram_lines(request_duration, request_errors)) + "\n"
+    msg += "Retries: %d\n\n" % sum(request_retries.values().values())
+
+    cache = cache_lines(metrics.registry.get("kraken_cache_requests").values())
+    msg += "Cache:\n" + ("\n".join(cache) if cache else "no cached requests") + "\n\n"
+
+    connections = pool_lines(metrics.registry.get("http_pool_requests").values())
+    msg += "Connections:\n" + ("\n".join(connections) if connections else "no connections") + "\n\n"
+
+    msg += "Commands:\n"
+    msg += "\n".join(histogram_lines(handler_duration, handler_errors)) + "\n\n"
+
+    msg += "Telegram requests:\n"
+    msg += "\n".join(histogram_lines(telegram_duration, telegram_errors)) + "\n\n"
+
+    jobs = ", ".join("%s (%d)" % (name[0], count) for name, count in job_counts().items())
+
+    msg += "Queues:\n"
+    msg += "Waiting updates: %d\n" % dispatcher.update_queue.qsize()
+    msg += "Waiting Kraken requests: %d\n" % sum(queue_depths().values())
+    msg += "Scheduled jobs: %s\n" % (jobs if jobs else "none")
+    msg += "Monitored orders: %d" % sum(len(watcher) for watcher in order_watchers.values())
+
+    # Names of handlers contain underscores, so no Markdown
+    update.message.reply_text(msg, reply_markup=keyboard_cmds())
+
+
+# Profile handlers for some seconds or updates and send report as file.
+# Usage: '/profile [number] [seconds|updates]' or '/profile stop'
+@restrict_access
+def profile_cmd(bot, update):
+    args = update.message.text.split()[1:]
+
+    if args and args[0].lower() == "stop":
+        if not profiler.active:
+            update.message.reply_text("Profiling is not active")
+        else:
+            profiler.stop()
+        return
+
+    try:
+        number = int(args[0]) if args else 60
+    except ValueError:
+        number = 0
+
+    # Without a positive number, profiling would never stop by itself
+    if number <= 0:
+        update.message.reply_text("Usage: /profile [number] [seconds|updates] or /profile stop")
+        return
+
+    if len(args) > 1 and args[1].lower().startswith("update"):
+        started = profiler.start(updates=number)
+        unit = "updates"
+    else:
+        started = profiler.start(seconds=number)
+        unit = "seconds"
+
+    if started:
+        msg = emo_wa + " Profiling the next %d %s..." % (number, unit)
+    else:
+        msg = "Profiling is already active. Stop it with /profile stop"
+
+    update.message.reply_text(msg)
+
+
+# Send profiling report as file
+def send_profile_report(report):
+    filename = "profile_" + time.strftime("%y%m%d_%H%M%S") + ".txt"
+    updater.bot.send_document(chat_id=config["user_id"],
+                              document=io.BytesIO(report.encode("utf-8")),
+                              filename=filename,
+                              caption="Profiling report")
+
+
 def start_cmd(bot, update):
     msg = emo_be + " Welcome to Kraken-Telegram-Bot!"
     update.message.reply_text(msg, reply_markup=keyboard_cmds())
@@ -806,8 +1380,12 @@ def bot_sub_cmd(bot, update):
 # This needs to be run on a new thread because calling 'updater.stop()' inside a
 # handler (shutdown_cmd) causes a deadlock because it waits for itself to finish
 def shutdown():
+    order_feed.stop()
+    metrics_server.stop()
+    stop_async_mode()
     updater.stop()
     updater.is_idle = False
+    logger.flush()
 
 
 # Terminate this script
@@ -825,6 +1403,11 @@ def restart_cmd(bot, update):
     update.message.reply_text(emo_wa + " Bot is restarting...", reply_markup=ReplyKeyboardRemove())
 
     time.sleep(0.2)
+
+    # Process will be replaced, so save last nonce and write remaining log records now
+    for _, client in accounts.items():
+        client.nonce.save()
+    logger.close()
     os.execl(sys.executable, sys.executable, *sys.argv)
 
 
@@ -986,70 +1569,99 @@ def coin_buttons():
     return buttons
 
 
-# Check order state and send message if order closed
+# Check state of all monitored orders with one batched request
 def order_state_check(bot, job):
-    req_data = dict()
-    req_data["txid"] = job.context["order_txid"]
+    global order_check
 
-    # Send request to get info on specific order
-    res_data = kraken.query("QueryOrders", data=req_data, private=True)
+    # No need to poll the primary account if its updates are received via WebSocket
+    def polled(name):
+        return not (order_feed.connected and name == accounts.primary)
 
-    # If Kraken replied with an error, return without notification
-    if res_data["error"]:
-        error = btfy(res_data["error"][0])
-        logger.error(error)
-        if config["send_error"]:
-            src = "Order state check:\n"
-            bot.send_message(chat_id=config["user_id"], text=src + emo_er + " " + error)
-        return
+    async def check_async(name, client):
+        if polled(name):
+            await order_watchers[name].check_async(client)
 
-    # Save information about order
-    order_info = res_data["result"][job.context["order_txid"]]
+    def check(name, client):
+        if polled(name):
+            order_watchers[name].check()
 
-    # Check if order was canceled. If so, stop monitoring
-    if order_info["status"] == "canceled":
-        # Stop this job
-        job.schedule_removal()
-        return
+    # Orders of all accounts are checked at once
+    if async_mode:
+        # Don't start a new check while the last one is still running
+        if order_check is None or order_check.done():
+            order_check = event_loop.submit(async_accounts.fan_out_async(check_async))
+    else:
+        accounts.fan_out(check)
 
-    # Check if trade was executed. If so, stop monitoring and send message
-    if order_info["status"] == "closed":
-        msg = " Trade executed:\n" + job.context["order_txid"] + "\n" + trim_zeros(order_info["descr"]["order"])
-        bot.send_message(chat_id=config["user_id"], text=bold(emo_no + msg), parse_mode=ParseMode.MARKDOWN)
-        # Stop this job
-        job.schedule_removal()
+
+# Send message if trade of a monitored order was executed
+def order_closed(account, txid, order_info):
+    order_store.remove(txid)
+
+    msg = " Trade executed:\n" + account_prefix(account) + txid + "\n" + trim_zeros(order_info["descr"]["order"])
+    updater.bot.send_message(chat_id=config["user_id"], text=bold(emo_no + msg), parse_mode=ParseMode.MARKDOWN)
+
+
+# Log error of order state check and send it if enabled
+def order_check_error(account, error):
+    error = btfy(account_prefix(account) + error)
+    logger.error(error)
+    if config["send_error"]:
+        src = "Order state check:\n"
+        updater.bot.send_message(chat_id=config["user_id"], text=src + emo_er + " " + error)
 
 
 # Monitor status changes of previously created open orders
 def monitor_orders():
     if config["check_trade"]:
-        # Send request for open orders to Kraken
-        res_data = kraken.query("OpenOrders", private=True)
+        # Send requests for open orders of all accounts to Kraken
+        results = accounts.fan_out(lambda name, client: client.query("OpenOrders", private=True))
 
-        # If Kraken replied with an error, show it
-        if res_data["error"]:
-            error = btfy(res_data["error"][0])
-            logger.error(error)
-            if config["send_error"]:
-                src = "Monitoring orders:\n"
-                updater.bot.send_message(chat_id=config["user_id"], text=src + emo_er + " " + error)
-            return
+        open_orders = collections.OrderedDict()
+        for name, res_data in results.items():
+            # If Kraken replied with an error, show it
+            if res_data["error"]:
+                error = btfy(account_prefix(name) + res_data["error"][0])
+                logger.error(error)
+                if config["send_error"]:
+                    src = "Monitoring orders:\n"
+                    updater.bot.send_message(chat_id=config["user_id"], text=src + emo_er + " " + error)
+            else:
+                open_orders[name] = res_data["result"]["open"]
+
+                # Add all open orders to the watcher of the account
+                for order_txid in res_data["result"]["open"]:
+                    order_watchers[name].add(str(order_txid))
+
+        sync_orders(open_orders)
+
+        # One repeating job checks the state of all monitored orders
+        job_queue.run_repeating(order_state_check, config["check_trade_time"])
 
-        if res_data["result"]["open"]:
-            for order in res_data["result"]["open"]:
-                # Save order transaction ID
-                order_txid = str(order)
-                # Save time in seconds from config
-                check_trade_time = config["check_trade_time"]
+        # Receive order updates immediately (polling is used as fallback)
+        if config["ws_enabled"]:
+            order_feed.start()
 
-                # Add Job to JobQueue to check status of order
-                context = dict(order_txid=order_txid)
-                job_queue.run_repeating(order_state_check, check_trade_time, context=context)
+
+# Registries of all orders that will be checked for status changes, by account
+order_watchers = collections.OrderedDict()
+for account_name, client in accounts.items():
+    order_watchers[account_name] = OrderWatcher(client,
+                                                functools.partial(order_closed, account_name),
+                                                functools.partial(order_check_error, account_name))
+
+# Orders of the primary account (trades are created there)
+order_watcher = order_watchers[accounts.primary]
+# Running order state check in asyncio mode
+order_check = None
+
+# Streaming of order updates via WebSocket (primary account)
+order_feed = OrderFeed(kraken, order_watcher, config["ws_url"])
 
 
 # TODO: Complete sanity check
 # Check sanity of settings in config file
-def is_conf_sane(trade_pairs):
+def is_conf_sane(index):
     for setting, value in config.items():
         # Check if user ID is a digit
         if "USER_ID" == setting.upper():
@@ -1060,14 +1672,10 @@ def is_conf_sane(trade_pairs):
         elif "USED_PAIRS" == setting.upper():
             global pairs
             for coin, to_cur in value.items():
-                found = False
-                for pair, data in trade_pairs.items():
-                    if coin in pair and to_cur in pair:
-                        if not pair.endswith(".d"):
-                            pairs[coin] = pair
-                            found = True
-                if not found:
+                pair = index.pair(coin, to_cur)
+                if not pair:
                     return False, setting.upper() + " - " + coin
+                pairs[coin] = pair
 
     return True, None
 
@@ -1080,93 +1688,240 @@ def handle_init_error(error, msg, uid, msg_id):
     logger.error(error)
 
 
+# Init stage: read all assets
+def init_assets(results):
+    return kraken.assets()
+
+
+# Init stage: read all asset pairs
+def init_pairs(results):
+    return kraken.assets_pairs()
+
+
+# Init stage: check sanity of configuration file (needs assets and asset pairs)
+def init_sanity(results):
+    sane, parameter = is_conf_sane(kraken.index)
+    if not sane:
+        return False, "Wrong configuration: " + parameter
+    return True, None
+
+
+# Init stage: read order limits
+def init_limits(results):
+    return True, kraken.min_order_size()
+
+
+# Stages of the initialization as (name, description, function, dependencies).
+# A stage is started once all stages it depends on finished successfully. Stages
+# without dependencies between each other will run concurrently
+init_stages = [
+    ("assets", "Reading assets", init_assets, []),
+    ("pairs", "Reading asset pairs", init_pairs, []),
+    ("sanity", "Checking sanity", init_sanity, ["assets", "pairs"]),
+    ("limits", "Reading order limits", init_limits, [])
+]
+
+
+# Execute an init stage after its dependencies are done and
+# return (success, result, duration in seconds)
+def run_init_stage(name, function, dependencies, futures):
+    results = dict()
+
+    for dependency in dependencies:
+        success, result, _ = futures[dependency].result()
+        if not success:
+            return False, "Stage '" + dependency + "' failed", 0
+        results[dependency] = result
+
+    start = time.monotonic()
+
+    try:
+        success, result = function(results)
+    except Exception as ex:
+        logger.exception("Init stage '" + name + "' failed:")
+        success, result = False, type(ex).__name__ + ":" + str(ex)
+
+    return success, result, time.monotonic() - start
+
+
+# Start all init stages on a thread pool and return a future for every stage
+def run_init_stages():
+    futures = dict()
+
+    executor = ThreadPoolExecutor(max_workers=len(init_stages))
+    for name, _, function, dependencies in init_stages:
+        futures[name] = executor.submit(run_init_stage, name, function, dependencies, futures)
+    executor.shutdown(wait=False)
+
+    return futures
+
+
+# Save results of finished init stages in global variables
+def apply_init_results(futures):
+    global assets, limits
+    assets = futures["assets"].result()[1]
+    limits = futures["limits"].result()[1]
+
+    share_asset_index()
+
+    timings = [name + " %.2f s" % futures[name].result()[2] for name, _, _, _ in init_stages]
+    logger.info("Init stage timings: " + ", ".join(timings))
+
+
 # Make sure preconditions are met and show welcome screen
 def init_cmd(bot, update):
     uid = config["user_id"]
     cmds = "/initialize - retry again\n/shutdown - shut down the bot"
 
+    # Start reading data from Kraken while the messages are sent
+    futures = run_init_stages()
+
     # Show start up message
     msg = " Preparing Kraken-Bot"
     updater.bot.send_message(uid, emo_be + msg, disable_notification=True, reply_markup=ReplyKeyboardRemove())
 
-    # Assets -----------------
+    # Show a progress message for every stage
+    messages = dict()
+    descriptions = dict()
+    for name, description, _, _ in init_stages:
+        msg = " " + description + "..."
+        messages[name] = updater.bot.send_message(uid, emo_wa + msg, disable_notification=True)
+        descriptions[name] = description
 
-    msg = " Reading assets..."
-    m = updater.bot.send_message(uid, emo_wa + msg, disable_notification=True)
+    names = {future: name for name, future in futures.items()}
 
-    # TODO: encapsulate assets
-    success, res_assets = kraken.assets()
-    if not success:
-        msg = "Reading assets... FAILED\n" + cmds
-        return handle_init_error(res_assets, msg, uid, m.message_id)
+    # Update progress message as soon as a stage is done
+    for future in as_completed(futures.values()):
+        name = names[future]
+        success, result, duration = future.result()
+        msg_id = messages[name].message_id
 
-    global assets
-    assets = res_assets
+        if not success:
+            msg = " " + descriptions[name] + "... FAILED\n" + cmds
+            return handle_init_error(result, msg, uid, msg_id)
 
-    msg = " Reading assets... DONE"
-    updater.bot.edit_message_text(emo_do + msg, chat_id=uid, message_id=m.message_id)
+        msg = " " + descriptions[name] + "... DONE (%.2f s)" % duration
+        updater.bot.edit_message_text(emo_do + msg, chat_id=uid, message_id=msg_id)
 
-    # Asset pairs -----------------
+    apply_init_results(futures)
 
-    msg = " Reading asset pairs..."
-    m = updater.bot.send_message(uid, emo_wa + msg, disable_notification=True)
-
-    success, res_pairs = kraken.assets_pairs()
-    if not success:
-        msg = "Reading asset pairs... FAILED\n" + cmds
-        return handle_init_error(res_pairs, msg, uid, m.message_id)
+    # Bot is ready -----------------
 
-    msg = " Reading asset pairs... DONE"
-    updater.bot.edit_message_text(emo_do + msg, chat_id=uid, message_id=m.message_id)
+    # Save data for next startup
+    save_snapshot()
 
-    # Sanity check -----------------
+    msg = " Kraken-Bot is ready!"
+    updater.bot.send_message(uid, emo_be + msg, reply_markup=keyboard_cmds())
 
-    msg = " Checking sanity..."
-    m = updater.bot.send_message(uid, emo_wa + msg, disable_notification=True)
 
-    # Check sanity of configuration file
-    # Sanity check not finished successfully
-    sane, parameter = is_conf_sane(res_pairs)
-    if not sane:
-        msg = " Checking sanity... FAILED\n/shutdown - shut down the bot"
-        return handle_init_error("Wrong configuration: " + parameter, msg, uid, m.message_id)
-
-    msg = " Checking sanity... DONE"
-    updater.bot.edit_message_text(emo_do + msg, chat_id=uid, message_id=m.message_id)
+# Force reading all data from Kraken again (and not from cache or snapshot)
+@restrict_access
+def refresh_cmd(bot, update):
+    for _, client in accounts.items():
+        client.cache.invalidate()
+    init_cmd(bot, update)
+
+
+# Save assets, pairs and order limits to the snapshot file
+def save_snapshot():
+    snapshot = {
+        "version": snapshot_version,
+        "time": time.time(),
+        "used_pairs": config["used_pairs"],
+        "assets": assets,
+        "asset_pairs": kraken.index.asset_pairs,
+        "pairs": pairs,
+        "limits": limits
+    }
+
+    try:
+        # Write to temporary file first so that the snapshot is never incomplete
+        with open(snapshot_file + ".tmp", "w") as file:
+            json.dump(snapshot, file)
+        os.replace(snapshot_file + ".tmp", snapshot_file)
+    except OSError as ex:
+        logger.error("Not possible to save snapshot: " + str(ex))
+
+
+# Load assets, pairs and order limits from the snapshot file. Return
+# FALSE if there is no snapshot or if it's outdated and can't be used
+def load_snapshot():
+    if not os.path.isfile(snapshot_file):
+        return False
+
+    try:
+        with open(snapshot_file) as file:
+            snapshot = json.load(file)
+    except (OSError, ValueError) as ex:
+        logger.error("Not possible to read snapshot: " + str(ex))
+        return False
+
+    if snapshot.get("version") != snapshot_version:
+        logger.info("Snapshot ignored: different version")
+        return False
+    if time.time() - snapshot["time"] > config["snapshot_max_age"]:
+        logger.info("Snapshot ignored: too old")
+        return False
+    if snapshot["used_pairs"] != config["used_pairs"]:
+        logger.info("Snapshot ignored: setting 'used_pairs' changed")
+        return False
+
+    global assets, pairs, limits
+    assets = snapshot["assets"]
+    pairs = snapshot["pairs"]
+    limits = snapshot["limits"]
+
+    kraken.load_assets(assets, snapshot["asset_pairs"])
+    share_asset_index()
+
+    return True
+
+
+# Assets and pairs are the same for all accounts. They are only read with the
+# client of the primary account and its index is used by all other clients
+def share_asset_index():
+    for _, client in accounts.items():
+        if client is not kraken:
+            client.index = kraken.index
+
+
+# Read current data from Kraken in the background after the bot
+# was started with data from the snapshot and save a new snapshot
+def revalidate_snapshot():
+    futures = run_init_stages()
+
+    for name, description, _, _ in init_stages:
+        success, result, _ = futures[name].result()
+        if not success:
+            error = btfy(description + " failed: " + result)
+            logger.error(error)
 
-    # Order limits -----------------
+            # Configuration is wrong, user has to fix it
+            if name == "sanity":
+                updater.bot.send_message(config["user_id"], error)
+            return
 
-    msg = " Reading order limits..."
-    m = updater.bot.send_message(uid, emo_wa + msg, disable_notification=True)
+    apply_init_results(futures)
 
-    # Save order limits in global variable
-    global limits
-    limits = kraken.min_order_size()
+    save_snapshot()
+    logger.info("Snapshot revalidated")
 
-    msg = " Reading order limits... DONE"
-    updater.bot.edit_message_text(emo_do + msg, chat_id=uid, message_id=m.message_id)
 
-    # Bot is ready -----------------
+# Start bot with data from snapshot if possible. If not, read all data from Kraken
+def startup():
+    if not load_snapshot():
+        return init_cmd(None, None)
 
     msg = " Kraken-Bot is ready!"
-    updater.bot.send_message(uid, emo_be + msg, reply_markup=keyboard_cmds())
+    updater.bot.send_message(config["user_id"], emo_be + msg, reply_markup=keyboard_cmds())
+
+    # Make sure that data from snapshot is still valid
+    threading.Thread(target=revalidate_snapshot).start()
 
 
 # From pair string (XXBTZEUR) get from-asset (XXBT) and to-asset (ZEUR)
 def assets_from_pair(pair):
-    for asset, data in assets.items():
-        # If TRUE, we know that 'to_asset' exists in assets
-        if pair.endswith(asset):
-            from_asset = pair[:len(asset)]
-            to_asset = pair[len(pair)-len(asset):]
-
-            # If TRUE, we know that 'from_asset' exists in assets
-            if from_asset in assets:
-                return from_asset, to_asset
-            else:
-                return None, to_asset
-
-    return None, None
+    return kraken.index.assets_from_pair(pair)
 
 
 # Returns a pre compiled Regex pattern to ignore case
@@ -1232,75 +1987,6 @@ def handle_telegram_error(bot, update, error):
         updater.bot.send_message(chat_id=config["user_id"], text=error_str)
 
 
-# Make sure preconditions are met and show welcome screen
-init_cmd(None, None)
-
-
-# Log all errors
-dispatcher.add_error_handler(handle_telegram_error)
-
-# Add command handlers to dispatcher
-dispatcher.add_handler(CommandHandler("restart", restart_cmd))
-dispatcher.add_handler(CommandHandler("shutdown", shutdown_cmd))
-dispatcher.add_handler(CommandHandler("initialize", init_cmd))
-dispatcher.add_handler(CommandHandler("balance", balance_cmd))
-dispatcher.add_handler(CommandHandler("reload", reload_cmd))
-dispatcher.add_handler(CommandHandler("state", state_cmd))
-dispatcher.add_handler(CommandHandler("start", start_cmd))
-
-
-# ORDERS conversation handler
-orders_handler = ConversationHandler(
-    entry_points=[CommandHandler('orders', orders_cmd)],
-    states={
-        WorkflowEnum.ORDERS_CLOSE:
-            [RegexHandler(comp("^(CLOSE ORDER)$"), orders_choose_order),
-             RegexHandler(comp("^(CLOSE ALL)$"), orders_close_all),
-             RegexHandler(comp("^(CANCEL)$"), cancel)],
-        WorkflowEnum.ORDERS_CLOSE_ORDER:
-            [RegexHandler(comp("^(CANCEL)$"), cancel),
-             RegexHandler(comp("^[A-Z0-9]{6}-[A-Z0-9]{5}-[A-Z0-9]{6}$"), orders_close_order)]
-    },
-    fallbacks=[CommandHandler('cancel', cancel)]
-)
-dispatcher.add_handler(orders_handler)
-
-
-# TRADE conversation handler
-trade_handler = ConversationHandler(
-    entry_points=[CommandHandler('trade', trade_cmd)],
-    states={
-        WorkflowEnum.TRADE_BUY_SELL:
-            [RegexHandler(comp("^(BUY|SELL)$"), trade_buy_sell, pass_chat_data=True),
-             RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True)],
-        WorkflowEnum.TRADE_CURRENCY:
-            [RegexHandler(comp("^(" + regex_coin_or() + ")$"), trade_currency, pass_chat_data=True),
-             RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True),
-             RegexHandler(comp("^(ALL)$"), trade_sell_all)],
-        WorkflowEnum.TRADE_SELL_ALL_CONFIRM:
-            [RegexHandler(comp("^(YES|NO)$"), trade_sell_all_confirm)],
-        WorkflowEnum.TRADE_PRICE:
-            [RegexHandler(comp("^((?=.*?\d)\d*[.,]?\d*|MARKET PRICE)$"), trade_price, pass_chat_data=True),
-             RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True)],
-        WorkflowEnum.TRADE_VOL_TYPE:
-            [RegexHandler(comp("^(" + regex_asset_or() + ")$"), trade_vol_asset, pass_chat_data=True),
-             RegexHandler(comp("^(VOLUME)$"), trade_vol_volume, pass_chat_data=True),
-             RegexHandler(comp("^(ALL)$"), trade_vol_all, pass_chat_data=True),
-             RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True)],
-        WorkflowEnum.TRADE_VOLUME:
-            [RegexHandler(comp("^^(?=.*?\d)\d*[.,]?\d*$"), trade_volume, pass_chat_data=True),
-             RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True)],
-        WorkflowEnum.TRADE_VOLUME_ASSET:
-            [RegexHandler(comp("^^(?=.*?\d)\d*[.,]?\d*$"), trade_volume_asset, pass_chat_data=True),
-             RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True)],
-        WorkflowEnum.TRADE_CONFIRM:
-            [RegexHandler(comp("^(YES|NO)$"), trade_confirm, pass_chat_data=True)]
-    },
-    fallbacks=[CommandHandler('cancel', cancel, pass_chat_data=True)]
-)
-dispatcher.add_handler(trade_handler)
-
-
 # Will return the SETTINGS_CHANGE state for a conversation handler
 # This way the state is reusable
 def settings_change_state():
@@ -1323,58 +2009,385 @@ def settings_confirm_state():
             [RegexHandler(comp("^(YES|NO)$"), settings_confirm, pass_chat_data=True)]]
 
 
-# BOT conversation handler
-bot_handler = ConversationHandler(
-    entry_points=[CommandHandler('bot', bot_cmd)],
-    states={
-        WorkflowEnum.BOT_SUB_CMD:
-            [RegexHandler(comp("^(RESTART|SHUTDOWN)$"), bot_sub_cmd),
-             RegexHandler(comp("^(API STATE)$"), state_cmd),
-             RegexHandler(comp("^(SETTINGS)$"), settings_cmd),
-             RegexHandler(comp("^(CANCEL)$"), cancel)],
-        settings_change_state()[0]: settings_change_state()[1],
-        settings_save_state()[0]: settings_save_state()[1],
-        settings_confirm_state()[0]: settings_confirm_state()[1]
-    },
-    fallbacks=[CommandHandler('cancel', cancel)]
-)
-dispatcher.add_handler(bot_handler)
-
-
-# SETTINGS conversation handler
-settings_handler = ConversationHandler(
-    entry_points=[CommandHandler('settings', settings_cmd)],
-    states={
-        settings_change_state()[0]: settings_change_state()[1],
-        settings_save_state()[0]: settings_save_state()[1],
-        settings_confirm_state()[0]: settings_confirm_state()[1]
-    },
-    fallbacks=[CommandHandler('cancel', cancel)]
-)
-dispatcher.add_handler(settings_handler)
-
-
-# Write content of configuration file to log
-logger.debug("Configuration: " + str(config))
-
-# If webhook is enabled, don't use polling
-# https://github.com/python-telegram-bot/python-telegram-bot/wiki/Webhooks
-if config["webhook_enabled"]:
-    updater.start_webhook(listen=config["webhook_listen"],
-                          port=config["webhook_port"],
-                          url_path=config["bot_token"],
-                          key=config["webhook_key"],
-                          cert=config["webhook_cert"],
-                          webhook_url=config["webhook_url"])
-else:
-    # Start polling to handle all user input
-    # Dismiss all in the meantime send commands
-    updater.start_polling(clean=True)
+# Return all handlers of the dispatcher, including the ones of conversations,
+# together with the conversation state they belong to
+def all_handlers():
+    for group in dispatcher.handlers.values():
+        for handler in group:
+            if isinstance(handler, ConversationHandler):
+                for entry_point in handler.entry_points:
+                    yield "entry", entry_point
+                for state, state_handlers in handler.states.items():
+                    for state_handler in state_handlers:
+                        yield state.name, state_handler
+                for fallback in handler.fallbacks:
+                    yield "fallback", fallback
+            else:
+                yield "command", handler
+
+
+# Replace the callback of every handler with 'wrapper(callback, state)'
+def wrap_handlers(wrapper):
+    for state, handler in all_handlers():
+        handler.callback = wrapper(handler.callback, state)
+
+
+# Measure duration and outcome of a handler and log them if tracing is enabled.
+# Every update gets a new correlation ID that is shared with the Kraken requests it
+# causes. Coroutines (asyncio mode) are measured until they are done
+def instrumented_handler(callback, state):
+    def measure(start, error):
+        duration = time.monotonic() - start
+
+        if error:
+            handler_errors.inc(callback.__name__, state, error)
+        handler_duration.observe(duration, callback.__name__, state)
+
+        if kraken.tracer.enabled:
+            trace = {
+                "handler": callback.__name__,
+                "state": state,
+                "duration_ms": round(duration * 1000, 1),
+                "error_class": error
+            }
+            logger.event("telegram_handler", trace, "Trace: " + str(trace), logging.DEBUG)
+
+    async def instrumented_coroutine(coro, cid, start):
+        logger.new_correlation_id(cid)
+
+        try:
+            result = await coro
+        except Exception as ex:
+            measure(start, type(ex).__name__)
+            raise
+
+        measure(start, None)
+        return result
+
+    @functools.wraps(callback)
+    def _instrumented_handler(*args, **kwargs):
+        cid = logger.new_correlation_id()
+        start = time.monotonic()
+
+        try:
+            if profiler.active:
+                result = profiler.run(callback, *args, **kwargs)
+            else:
+                result = callback(*args, **kwargs)
+        except Exception as ex:
+            measure(start, type(ex).__name__)
+            raise
+
+        if asyncio.iscoroutine(result):
+            return instrumented_coroutine(result, cid, start)
+
+        measure(start, None)
+        return result
+
+    return _instrumented_handler
+
+
+# Promise of the dispatcher for a coroutine that runs on the event loop. A
+# conversation waits for it before it handles the next update of the user. If
+# the coroutine has no result or raised an exception, 'default' is the result
+class CoroutinePromise(Promise):
+    def __init__(self, future, default):
+        super().__init__(self._result_of, (future, default), {})
+        future.add_done_callback(lambda _: self.run())
+
+    @staticmethod
+    def _result_of(future, default):
+        try:
+            result = future.result()
+        except Exception:
+            logger.exception("An uncaught error was raised while handling an update")
+            return default
+
+        return default if result is None else result
+
+
+# Run coroutines that handlers return on the event loop (asyncio mode). The
+# dispatcher doesn't wait for them
+def scheduled_handler(callback, state):
+    # A conversation stays in its state if the handler has no result. Otherwise
+    # it would wait for the same promise forever
+    default = WorkflowEnum[state] if state in WorkflowEnum.__members__ else ConversationHandler.END
+
+    @functools.wraps(callback)
+    def _scheduled_handler(*args, **kwargs):
+        result = callback(*args, **kwargs)
+
+        if asyncio.iscoroutine(result):
+            return CoroutinePromise(event_loop.submit(result), default)
+        return result
+
+    return _scheduled_handler
+
+
+# Start the event loop and the asyncio Kraken client. Return FALSE if not possible
+def start_async_mode():
+    event_loop.start()
+
+    if all(event_loop.run(client.open()) for _, client in async_accounts.items()):
+        return True
+
+    stop_async_mode()
+    return False
+
+
+def stop_async_mode():
+    if event_loop.running:
+        try:
+            for _, client in async_accounts.items():
+                event_loop.run(client.close(), 5)
+        except Exception as ex:
+            logger.warning("Not possible to close asyncio Kraken client: " + str(ex))
+
+        event_loop.stop()
+
+
+# Measure duration of requests to Telegram (sending messages, ...)
+def instrumented_post(post):
+    @functools.wraps(post)
+    def _instrumented_post(url, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+
+        # Waits for new updates, so the duration doesn't tell anything
+        if method == "getUpdates":
+            return post(url, *args, **kwargs)
+
+        start = time.monotonic()
+        try:
+            return post(url, *args, **kwargs)
+        except Exception as ex:
+            telegram_errors.inc(method, type(ex).__name__)
+            raise
+        finally:
+            telegram_duration.observe(time.monotonic() - start, method)
+
+    return _instrumented_post
+
+
+# Number of private Kraken requests that wait for the rate limiter per account
+def queue_depths():
+    return {(name,): client.limiter.metrics()["queue_depth"] for name, client in accounts.items()}
+
+
+# Number of cache hits, misses and shared requests per account, method and result
+def cache_counts():
+    counts = dict()
+    for name, client in accounts.items():
+        for method, stats in client.cache.stats().items():
+            for result in ("hits", "misses", "shared"):
+                counts[(name, method, result)] = stats[result]
+    return counts
+
+
+# Number of requests, opened and reused connections per connection pool and host.
+# Every account has its own pool, pool 'shared' is used for websites
+def pool_counts():
+    pools = [("shared", kraken_api.http_pool)] + [(name, client.pool) for name, client in accounts.items()]
+
+    counts = dict()
+    for pool_name, pool in pools:
+        for host, stats in pool.stats().items():
+            for kind, count in stats.items():
+                counts[(pool_name, host, kind)] = count
+    return counts
+
+
+# Number of scheduled jobs per job name
+def job_counts():
+    counts = dict()
+    for job in job_queue.jobs():
+        counts[(job.name,)] = counts.get((job.name,), 0) + 1
+    return counts
+
+
+# Metrics of the bot. Metrics of Kraken requests are in module 'kraken_api'
+handler_duration = metrics.registry.histogram("telegram_handler_duration_seconds",
+                                              "Duration of handling an update", ["handler", "state"])
+handler_errors = metrics.registry.counter("telegram_handler_errors_total",
+                                          "Handlers that raised an exception", ["handler", "state", "error_class"])
+telegram_duration = metrics.registry.histogram("telegram_request_duration_seconds",
+                                               "Duration of requests to Telegram", ["method"])
+telegram_errors = metrics.registry.counter("telegram_request_errors_total",
+                                           "Requests to Telegram that failed", ["method", "error_class"])
+metrics.registry.gauge("telegram_update_queue_size",
+                       "Updates that wait to be handled", lambda: dispatcher.update_queue.qsize())
+metrics.registry.gauge("job_queue_jobs", "Scheduled jobs", job_counts, ["job"])
+metrics.registry.gauge("kraken_rate_limit_queue_size",
+                       "Private Kraken requests that wait for the rate limiter", queue_depths, ["account"])
+metrics.registry.gauge("kraken_cache_requests", "Cacheable Kraken requests by result (hits, misses, shared)",
+                       cache_counts, ["account", "method", "result"])
+metrics.registry.gauge("http_pool_requests", "Requests, opened and reused connections of connection pools",
+                       pool_counts, ["pool", "host", "kind"])
+metrics.registry.gauge("monitored_orders", "Orders that are checked for status changes",
+                       lambda: {(name,): len(watcher) for name, watcher in order_watchers.items()}, ["account"])
+
+# Profiler for command '/profile'
+profiler = Profiler(send_profile_report, {
+    "Commands": handler_duration,
+    "Kraken requests": metrics.registry.get("kraken_request_duration_seconds"),
+    "Telegram requests": telegram_duration
+})
+
+# Measure requests to Telegram
+updater.bot.request.post = instrumented_post(updater.bot.request.post)
+
+# Local HTTP endpoint for Prometheus
+metrics_server = metrics.MetricsServer(metrics.registry, config["metrics_listen"], config["metrics_port"])
+
+
+# Add all handlers to the dispatcher. Needs assets and pairs (see 'startup')
+def add_handlers():
+    # Log all errors
+    dispatcher.add_error_handler(handle_telegram_error)
+
+    # Add command handlers to dispatcher
+    dispatcher.add_handler(CommandHandler("restart", restart_cmd))
+    dispatcher.add_handler(CommandHandler("shutdown", shutdown_cmd))
+    dispatcher.add_handler(CommandHandler("initialize", init_cmd))
+    dispatcher.add_handler(CommandHandler("refresh", refresh_cmd))
+    dispatcher.add_handler(CommandHandler("balance", for_mode(balance_cmd)))
+    dispatcher.add_handler(CommandHandler("value", value_cmd))
+    dispatcher.add_handler(CommandHandler("history", history_cmd))
+    dispatcher.add_handler(CommandHandler("reload", reload_cmd))
+    dispatcher.add_handler(CommandHandler("state", state_cmd))
+    dispatcher.add_handler(CommandHandler("stats", stats_cmd))
+    dispatcher.add_handler(CommandHandler("profile", profile_cmd))
+    dispatcher.add_handler(CommandHandler("start", start_cmd))
+
+    # ORDERS conversation handler
+    orders_handler = ConversationHandler(
+        entry_points=[CommandHandler('orders', for_mode(orders_cmd))],
+        states={
+            WorkflowEnum.ORDERS_CLOSE:
+                [RegexHandler(comp("^(CLOSE ORDER)$"), orders_choose_order),
+                 RegexHandler(comp("^(CLOSE ALL)$"), for_mode(orders_close_all)),
+                 RegexHandler(comp("^(CANCEL)$"), cancel)],
+            WorkflowEnum.ORDERS_CLOSE_ORDER:
+                [RegexHandler(comp("^(CANCEL)$"), cancel),
+                 RegexHandler(comp("^[A-Z0-9]{6}-[A-Z0-9]{5}-[A-Z0-9]{6}$"), for_mode(orders_close_order))]
+        },
+        fallbacks=[CommandHandler('cancel', cancel)]
+    )
+    dispatcher.add_handler(orders_handler)
+
+    # TRADE conversation handler
+    trade_handler = ConversationHandler(
+        entry_points=[CommandHandler('trade', trade_cmd)],
+        states={
+            WorkflowEnum.TRADE_BUY_SELL:
+                [RegexHandler(comp("^(BUY|SELL)$"), trade_buy_sell, pass_chat_data=True),
+                 RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True)],
+            WorkflowEnum.TRADE_CURRENCY:
+                [RegexHandler(comp("^(" + regex_coin_or() + ")$"), trade_currency, pass_chat_data=True),
+                 RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True),
+                 RegexHandler(comp("^(ALL)$"), trade_sell_all)],
+            WorkflowEnum.TRADE_SELL_ALL_CONFIRM:
+                [RegexHandler(comp("^(YES|NO)$"), trade_sell_all_confirm)],
+            WorkflowEnum.TRADE_PRICE:
+                [RegexHandler(comp("^((?=.*?\d)\d*[.,]?\d*|MARKET PRICE)$"), trade_price, pass_chat_data=True),
+                 RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True)],
+            WorkflowEnum.TRADE_VOL_TYPE:
+                [RegexHandler(comp("^(" + regex_asset_or() + ")$"), trade_vol_asset, pass_chat_data=True),
+                 RegexHandler(comp("^(VOLUME)$"), trade_vol_volume, pass_chat_data=True),
+                 RegexHandler(comp("^(ALL)$"), trade_vol_all, pass_chat_data=True),
+                 RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True)],
+            WorkflowEnum.TRADE_VOLUME:
+                [RegexHandler(comp("^^(?=.*?\d)\d*[.,]?\d*$"), trade_volume, pass_chat_data=True),
+                 RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True)],
+            WorkflowEnum.TRADE_VOLUME_ASSET:
+                [RegexHandler(comp("^^(?=.*?\d)\d*[.,]?\d*$"), trade_volume_asset, pass_chat_data=True),
+                 RegexHandler(comp("^(CANCEL)$"), cancel, pass_chat_data=True)],
+            WorkflowEnum.TRADE_CONFIRM:
+                [RegexHandler(comp("^(YES|NO)$"), for_mode(trade_confirm), pass_chat_data=True)]
+        },
+        fallbacks=[CommandHandler('cancel', cancel, pass_chat_data=True)]
+    )
+    dispatcher.add_handler(trade_handler)
+
+    # BOT conversation handler
+    bot_handler = ConversationHandler(
+        entry_points=[CommandHandler('bot', bot_cmd)],
+        states={
+            WorkflowEnum.BOT_SUB_CMD:
+                [RegexHandler(comp("^(RESTART|SHUTDOWN)$"), bot_sub_cmd),
+                 RegexHandler(comp("^(API STATE)$"), state_cmd),
+                 RegexHandler(comp("^(SETTINGS)$"), settings_cmd),
+                 RegexHandler(comp("^(CANCEL)$"), cancel)],
+            settings_change_state()[0]: settings_change_state()[1],
+            settings_save_state()[0]: settings_save_state()[1],
+            settings_confirm_state()[0]: settings_confirm_state()[1]
+        },
+        fallbacks=[CommandHandler('cancel', cancel)]
+    )
+    dispatcher.add_handler(bot_handler)
+
+    # SETTINGS conversation handler
+    settings_handler = ConversationHandler(
+        entry_points=[CommandHandler('settings', settings_cmd)],
+        states={
+            settings_change_state()[0]: settings_change_state()[1],
+            settings_save_state()[0]: settings_save_state()[1],
+            settings_confirm_state()[0]: settings_confirm_state()[1]
+        },
+        fallbacks=[CommandHandler('cancel', cancel)]
+    )
+    dispatcher.add_handler(settings_handler)
+
+    # Measure all handlers
+    wrap_handlers(instrumented_handler)
+
+    # Coroutines of handlers run on the event loop
+    if async_mode:
+        wrap_handlers(scheduled_handler)
+
+
+def main():
+    global async_mode
+
+    # Make sure preconditions are met and show welcome screen
+    startup()
+
+    if config["async_mode"]:
+        async_mode = start_async_mode()
+
+    add_handlers()
+
+    if config["metrics_enabled"]:
+        metrics_server.start()
+
+    # Write content of configuration file to log
+    logger.debug("Configuration: " + str(config))
+
+    # If webhook is enabled, don't use polling
+    # https://github.com/python-telegram-bot/python-telegram-bot/wiki/Webhooks
+    if config["webhook_enabled"]:
+        updater.start_webhook(listen=config["webhook_listen"],
+                              port=config["webhook_port"],
+                              url_path=config["bot_token"],
+                              key=config["webhook_key"],
+                              cert=config["webhook_cert"],
+                              webhook_url=config["webhook_url"])
+    else:
+        # Start polling to handle all user input
+        # Dismiss all in the meantime send commands
+        updater.start_polling(clean=True)
+
+    # Monitor status changes of open orders
+    monitor_orders()
+
+    # Sample prices of all used pairs for the price history
+    if config["history_enabled"]:
+        job_queue.run_repeating(price_sample, config["history_time"])
+
+    # Run the bot until you press Ctrl-C or the process receives SIGINT,
+    # SIGTERM or SIGABRT. This should be used most of the time, since
+    # start_polling() is non-blocking and will stop the bot gracefully.
+    updater.idle()
 
-# Monitor status changes of open orders
-monitor_orders()
 
-# Run the bot until you press Ctrl-C or the process receives SIGINT,
-# SIGTERM or SIGABRT. This should be used most of the time, since
-# start_polling() is non-blocking and will stop the bot gracefully.
-updater.idle()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+# Modules of the bot and the fake Kraken API are imported from the project folders
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+sys.path.insert(0, os.path.join(ROOT_DIR, "benchmarks"))
@@ -0,0 +1,92 @@
+import time
+import unittest
+
+import order_feed
+from order_feed import OrderFeed
+from order_watcher import OrderWatcher
+from fake_kraken import FakeKraken, connect
+from fake_kraken_ws import FakeKrakenWS
+
+
+# Wait until 'condition' is TRUE. Return FALSE on timeout
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+
+    return False
+
+
+@unittest.skipIf(order_feed.websocket is None, "module 'websocket-client' not installed")
+class OrderFeedTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeKraken(latency=0).start()
+        self.fake_ws = FakeKrakenWS(self.fake).start()
+        self.kraken = connect(self.fake)
+
+        self.closed = list()
+        self.watcher = OrderWatcher(self.kraken, lambda txid, order_info: self.closed.append(txid))
+
+        self.txids = [self.fake.add_open_order("XXBTZEUR", "buy", 0.01, 1000 + i) for i in range(3)]
+        for txid in self.txids:
+            self.watcher.add(txid)
+
+        self.feed = OrderFeed(self.kraken, self.watcher, self.fake_ws.url, reconnect_delay=0.05)
+        self.feed.start()
+
+        self.assertTrue(self.fake_ws.wait_subscribed("ownTrades"))
+        self.assertTrue(wait_for(lambda: self.feed.connected))
+
+    def tearDown(self):
+        self.feed.stop()
+        self.fake_ws.stop()
+        self.fake.stop()
+
+    def test_subscriptions(self):
+        channels = {msg["subscription"]["name"]: msg["subscription"] for msg in self.fake_ws.subscriptions}
+
+        self.assertEqual(set(channels), {"openOrders", "ownTrades"})
+        self.assertFalse(channels["ownTrades"]["snapshot"])
+        self.assertEqual(channels["openOrders"]["token"], "fake_websockets_token")
+
+    def test_status_change(self):
+        polls = self.fake.calls.get("QueryOrders", 0)
+
+        self.fake_ws.set_status(self.txids[0], "closed")
+        self.fake_ws.set_status(self.txids[1], "canceled")
+
+        self.assertTrue(wait_for(lambda: len(self.watcher) == 1))
+        self.assertEqual(self.closed, [self.txids[0]])
+
+        # Description is known from the snapshot, no need to poll
+        self.assertEqual(self.fake.calls.get("QueryOrders", 0), polls)
+
+    def test_trade_triggers_check(self):
+        # Status update got lost, only the trade arrives
+        with self.fake._lock:
+            order = self.fake.open_orders.pop(self.txids[0])
+            self.fake.closed_orders[self.txids[0]] = dict(order, status="closed", vol_exec=order["vol"])
+        self.fake_ws.trade(self.txids[0], 0.01)
+
+        self.assertTrue(wait_for(lambda: self.closed == [self.txids[0]]))
+
+    def test_reconnect_and_resync(self):
+        self.fake_ws.disconnect()
+        self.assertTrue(wait_for(lambda: not self.feed.connected))
+
+        # Order is executed while disconnected (no update is sent)
+        with self.fake._lock:
+            order = self.fake.open_orders.pop(self.txids[2])
+            self.fake.closed_orders[self.txids[2]] = dict(order, status="closed", vol_exec=order["vol"])
+
+        # Reconnected feed checks the state of all monitored orders once
+        self.assertTrue(wait_for(lambda: self.fake_ws.connections == 2 and self.feed.connected))
+        self.assertTrue(wait_for(lambda: self.closed == [self.txids[2]]))
+        self.assertEqual(len(self.watcher), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from price_history import PriceHistory, RECORD_SIZE
+
+
+class PriceHistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix="price_history_")
+        self.history = PriceHistory(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_range(self):
+        for i in range(1, 11):
+            self.history.record({"XXBTZEUR": 5000.0 + i}, timestamp=1000.0 + i)
+
+        self.assertEqual(len(self.history.range("XXBTZEUR")), 10)
+        self.assertEqual(self.history.range("XXBTZEUR", 1004, 1006), [(1004.0, 5004.0), (1005.0, 5005.0)])
+        self.assertEqual(self.history.last("XXBTZEUR"), (1010.0, 5010.0))
+        self.assertEqual(self.history.range("XETHZEUR"), [])
+
+    def test_samples_in_time_order(self):
+        self.history.record({"XXBTZEUR": 5000.0}, timestamp=1000.0)
+        self.history.record({"XXBTZEUR": 4000.0}, timestamp=999.0)
+
+        self.assertEqual(self.history.range("XXBTZEUR"), [(1000.0, 5000.0)])
+
+    def test_incomplete_record(self):
+        self.history.record({"XXBTZEUR": 5000.0}, timestamp=1000.0)
+
+        # Interrupted write of the next record
+        path = os.path.join(self.directory, "XXBTZEUR.bin")
+        with open(path, "ab") as file:
+            file.write(b"\x01\x02")
+
+        # Readers ignore the incomplete record
+        self.assertEqual(self.history.range("XXBTZEUR"), [(1000.0, 5000.0)])
+
+        # A new instance (restart of the bot) appends aligned records again
+        history = PriceHistory(self.directory)
+        history.record({"XXBTZEUR": 5100.0}, timestamp=1001.0)
+        history.record({"XXBTZEUR": 5200.0}, timestamp=1002.0)
+
+        self.assertEqual(os.path.getsize(path), 3 * RECORD_SIZE)
+        self.assertEqual(history.range("XXBTZEUR"), [(1000.0, 5000.0), (1001.0, 5100.0), (1002.0, 5200.0)])
+        self.assertEqual(history.range("XXBTZEUR", 1001), [(1001.0, 5100.0), (1002.0, 5200.0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
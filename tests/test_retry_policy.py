@@ -0,0 +1,124 @@
+import time
+import unittest
+
+from kraken_api import RetryPolicy
+from fake_kraken import FakeKraken, connect
+
+
+class RetryPolicyTest(unittest.TestCase):
+    # Expected result of 'is_retryable' as (error, public call, private call)
+    classification = [
+        ("EService:Busy", True, True),
+        ("EAPI:Rate limit exceeded", True, True),
+        ("EAPI:Invalid nonce", False, True),
+        ("ConnectTimeout:HTTPSConnectionPool(...)", True, True),
+        ("ReadTimeout:HTTPSConnectionPool(...)", True, False),
+        ("Timeout:timed out", True, False),
+        ("ConnectionError:Connection aborted", True, False),
+        ("HTTPError:502 Server Error", True, False),
+        ("EOrder:Insufficient funds", False, False),
+        ("EGeneral:Invalid arguments", False, False)
+    ]
+
+    def test_classification(self):
+        policy = RetryPolicy(retries=3)
+
+        for error, public, private in self.classification:
+            self.assertEqual(policy.is_retryable(error, private=False), public, error)
+            self.assertEqual(policy.is_retryable(error, private=True), private, error)
+
+    def test_backoff(self):
+        policy = RetryPolicy(retries=10, delay=1, max_delay=4, deadline=1000)
+        start = time.monotonic()
+
+        for attempt in range(10):
+            backoff = min(4, 2 ** attempt)
+            delays = [policy.next_delay("EService:Busy", False, attempt, start) for _ in range(100)]
+
+            # Between half and the full backoff time, never above the cap
+            self.assertGreaterEqual(min(delays), backoff / 2)
+            self.assertLessEqual(max(delays), backoff)
+            self.assertLessEqual(max(delays), policy.max_delay)
+
+    def test_retries_exhausted(self):
+        policy = RetryPolicy(retries=2, delay=0.01)
+        start = time.monotonic()
+
+        self.assertIsNotNone(policy.next_delay("EService:Busy", False, 1, start))
+        self.assertIsNone(policy.next_delay("EService:Busy", False, 2, start))
+
+    def test_deadline(self):
+        policy = RetryPolicy(retries=10, delay=1, max_delay=10, deadline=5)
+
+        self.assertIsNotNone(policy.next_delay("EService:Busy", False, 0, time.monotonic()))
+        self.assertIsNone(policy.next_delay("EService:Busy", False, 0, time.monotonic() - 5))
+
+
+# Retries of the client against the fake Kraken API with scripted errors
+class RetryTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeKraken(latency=0).start()
+        policy = RetryPolicy(retries=3, delay=0.01, max_delay=0.02, deadline=5)
+        self.kraken = connect(self.fake, retry_policy=policy, cache_ttls={})
+
+    def tearDown(self):
+        self.fake.stop()
+
+    def test_temporary_error_retried(self):
+        self.fake.fail("Time", "EService:Busy", "EService:Busy")
+        self.fake.fail("Balance", "EAPI:Rate limit exceeded")
+
+        self.assertFalse(self.kraken.query("Time")["error"])
+        self.assertFalse(self.kraken.query("Balance", private=True)["error"])
+        self.assertEqual(self.fake.calls["Time"], 3)
+        self.assertEqual(self.fake.calls["Balance"], 2)
+
+    def test_http_error_only_retried_for_public_calls(self):
+        self.fake.fail("Time", 502)
+        self.fake.fail("AddOrder", 502)
+
+        self.assertFalse(self.kraken.query("Time")["error"])
+        self.assertEqual(self.fake.calls["Time"], 2)
+
+        # Order might have been placed - never send it twice
+        data = {"pair": "XXBTZEUR", "type": "buy", "ordertype": "limit", "price": "1000", "volume": "1"}
+        res_data = self.kraken.query("AddOrder", data=data, private=True)
+        self.assertTrue(res_data["error"][0].startswith("HTTPError"))
+        self.assertEqual(self.fake.calls["AddOrder"], 1)
+        self.assertFalse(self.fake.open_orders)
+
+    def test_invalid_nonce_only_retried_for_private_calls(self):
+        self.fake.fail("Time", "EAPI:Invalid nonce")
+        self.fake.fail("Balance", "EAPI:Invalid nonce")
+
+        self.assertEqual(self.kraken.query("Time")["error"], ["EAPI:Invalid nonce"])
+        self.assertEqual(self.fake.calls["Time"], 1)
+
+        self.assertFalse(self.kraken.query("Balance", private=True)["error"])
+        self.assertEqual(self.fake.calls["Balance"], 2)
+
+    def test_permanent_error_not_retried(self):
+        self.fake.fail("Balance", "EGeneral:Permission denied")
+
+        self.assertEqual(self.kraken.query("Balance", private=True)["error"], ["EGeneral:Permission denied"])
+        self.assertEqual(self.fake.calls["Balance"], 1)
+
+    def test_retries_limited(self):
+        self.fake.fail("Time", *["EService:Busy"] * 10)
+
+        self.assertEqual(self.kraken.query("Time")["error"], ["EService:Busy"])
+        self.assertEqual(self.fake.calls["Time"], 4)
+
+    def test_deadline_stops_retrying(self):
+        self.kraken.retry_policy = RetryPolicy(retries=10, delay=0.2, max_delay=0.2, deadline=0.3)
+        self.fake.fail("Time", *["EService:Busy"] * 10)
+
+        start = time.monotonic()
+        self.assertEqual(self.kraken.query("Time")["error"], ["EService:Busy"])
+
+        self.assertLess(self.fake.calls["Time"], 4)
+        self.assertLess(time.monotonic() - start, 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# Value of a balance in one currency. Prices of all pairs that are needed are
+# requested with one 'Ticker' call. Assets without a pair to the currency are
+# valued through the currency they are traded to in 'used_pairs' (XLM -> XBT -> EUR)
+
+
+# Return one step of a conversion path from 'from_cur' to 'to_cur' (both altnames)
+# as (pair name, inverted). Inverted means that the price of the pair needs to be
+# divided because the pair is quoted the other way round. None if there is no pair
+def _step(index, from_cur, to_cur):
+    pair = index.pair(from_cur, to_cur)
+    if pair:
+        return pair, False
+
+    pair = index.pair(to_cur, from_cur)
+    if pair:
+        return pair, True
+
+    return None
+
+
+# Return conversion path from an asset to the currency 'to_cur' (both altnames) as
+# list of steps. Uses the direct pair if there is one, otherwise the currency that
+# the asset is traded to in 'used_pairs'. None if the asset can't be converted
+def price_path(index, asset, to_cur, used_pairs):
+    if asset == to_cur:
+        return list()
+
+    step = _step(index, asset, to_cur)
+    if step:
+        return [step]
+
+    via = used_pairs.get(asset)
+    if via and via != to_cur:
+        first, second = _step(index, asset, via), _step(index, via, to_cur)
+        if first and second:
+            return [first, second]
+
+    return None
+
+
+# Return sorted list of all pairs that the given paths need (sorted so that the
+# same assets always lead to the same request and the response can be cached)
+def path_pairs(paths):
+    return sorted({pair for path in paths if path for pair, _ in path})
+
+
+# Return dictionary with pair name as key and last trade price as value
+# from the result of a 'Ticker' request
+def parse_prices(ticker):
+    return {pair: float(data["c"][0]) for pair, data in ticker.items()}
+
+
+# Return rate of a path or None if a price is missing
+def path_rate(path, prices):
+    rate = 1.0
+
+    for pair, inverted in path:
+        price = prices.get(pair)
+        if not price:
+            return None
+        rate = rate / price if inverted else rate * price
+
+    return rate
+
+
+# Value of all assets of a balance. 'volumes' has the asset altname as key and the
+# volume as value, 'paths' has the path of every asset (see 'price_path') and
+# 'prices' the price of every pair (see 'parse_prices')
+class PortfolioValue:
+    def __init__(self, volumes, paths, prices):
+        assets = list(volumes)
+
+        # Rate of every distinct path is calculated once and applied to all volumes
+        rates = dict()
+        for asset in assets:
+            path = paths.get(asset)
+            if path is not None:
+                key = tuple(path)
+                if key not in rates:
+                    rates[key] = path_rate(path, prices)
+
+        asset_rates = [rates.get(tuple(paths[asset])) if paths.get(asset) is not None else None
+                       for asset in assets]
+
+        # Value of assets that couldn't be converted is None
+        self.values = {asset: volumes[asset] * rate if rate is not None else None
+                       for asset, rate in zip(assets, asset_rates)}
+        self.total = sum((value for value in self.values.values() if value is not None), 0.0)
+        self.missing = [asset for asset, value in self.values.items() if value is None]